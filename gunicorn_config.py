@@ -1,7 +1,9 @@
 """
 Gunicorn 配置文件
 """
+import glob
 import multiprocessing
+import os
 
 # 绑定的 IP 和端口
 bind = "0.0.0.0:$PORT"
@@ -11,9 +13,38 @@ workers = multiprocessing.cpu_count() * 2 + 1
 
 # 工作模式
 worker_class = "gevent"
+# 应用按 worker 类型设置数据库连接池大小（见 MYBLOG_DB_POOL_SIZES）
+os.environ.setdefault('MYBLOG_WORKER_CLASS', worker_class)
+
+# 在主进程中加载并预热应用（见 when_ready），worker fork 后以写时复制共享编译好的模板等内存
+preload_app = True
 
 # 超时时间
 timeout = 120
 
 # 日志级别
 loglevel = "info"
+
+
+def on_starting(server):
+    # 清除上次运行留下的各 worker 指标文件，/metrics 只汇总本次启动后的数据
+    basedir = os.path.abspath(os.path.dirname(__file__))
+    directory = os.getenv('MYBLOG_METRICS_DIR', os.path.join(basedir, 'logs', 'metrics'))
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    from myblog.startup import warm_up
+
+    templates, statuses = warm_up(server.app.wsgi())
+    server.log.info('Compiled %d templates, warm-up requests: %s', templates,
+                    ', '.join('%s %d' % item for item in statuses.items()))
+
+
+def post_worker_init(worker):
+    from myblog.startup import after_fork
+
+    after_fork(worker.wsgi)
@@ -0,0 +1,36 @@
+"""add denormalized post/comment counters
+
+Revision ID: 1a2b3c4d5e01
+Revises: 1a2b3c4d5e00
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a2b3c4d5e01'
+down_revision = '1a2b3c4d5e00'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('post', sa.Column('comment_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('category', sa.Column('post_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute(
+        'UPDATE post SET comment_count = '
+        '(SELECT COUNT(comment.id) FROM comment WHERE comment.post_id = post.id AND comment.reviewed = 1)'
+    )
+    op.execute(
+        'UPDATE category SET post_count = '
+        '(SELECT COUNT(post.id) FROM post WHERE post.category_id = category.id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('category') as batch_op:
+        batch_op.drop_column('post_count')
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('comment_count')
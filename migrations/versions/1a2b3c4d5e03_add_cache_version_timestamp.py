@@ -0,0 +1,25 @@
+"""add cache version timestamp
+
+Revision ID: 1a2b3c4d5e03
+Revises: 1a2b3c4d5e02
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a2b3c4d5e03'
+down_revision = '1a2b3c4d5e02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('cache_version', sa.Column('timestamp', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('cache_version') as batch_op:
+        batch_op.drop_column('timestamp')
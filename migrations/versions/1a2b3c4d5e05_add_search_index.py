@@ -0,0 +1,41 @@
+"""add full-text search index
+
+Revision ID: 1a2b3c4d5e05
+Revises: 1a2b3c4d5e04
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '1a2b3c4d5e05'
+down_revision = '1a2b3c4d5e04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 建表后需要执行 flask reindex 填充索引；DDL 写在这里，不依赖之后会变的 myblog.search
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        tokenizer = current_app.config.get('MYBLOG_SEARCH_TOKENIZER', 'unicode61')
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+            "kind UNINDEXED, ref_id UNINDEXED, post_id UNINDEXED, title, body, tokenize='%s')" % tokenizer)
+    elif dialect == 'mysql':
+        op.execute(
+            'CREATE TABLE IF NOT EXISTS search_index ('
+            'id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY, '
+            'kind VARCHAR(10) NOT NULL, ref_id INTEGER NOT NULL, post_id INTEGER NOT NULL, '
+            'title VARCHAR(255), body LONGTEXT, '
+            'KEY ix_search_index_ref (kind, ref_id), KEY ix_search_index_post_id (post_id), '
+            'FULLTEXT KEY ft_search_index (title, body) WITH PARSER ngram'
+            ') ENGINE=InnoDB DEFAULT CHARSET=utf8mb4')
+
+
+def downgrade():
+    if op.get_bind().dialect.name in ('sqlite', 'mysql'):
+        op.execute('DROP TABLE IF EXISTS search_index')
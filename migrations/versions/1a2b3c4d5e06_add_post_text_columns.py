@@ -0,0 +1,30 @@
+"""add derived post text columns
+
+Revision ID: 1a2b3c4d5e06
+Revises: 1a2b3c4d5e05
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a2b3c4d5e06'
+down_revision = '1a2b3c4d5e05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 升级后执行 flask backfill-text 计算已有文章的摘要和字数
+    op.add_column('post', sa.Column('plain_text', sa.Text(), nullable=True))
+    op.add_column('post', sa.Column('excerpt', sa.String(length=255), nullable=True))
+    op.add_column('post', sa.Column('word_count', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('word_count')
+        batch_op.drop_column('excerpt')
+        batch_op.drop_column('plain_text')
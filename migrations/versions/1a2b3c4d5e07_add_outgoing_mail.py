@@ -0,0 +1,46 @@
+"""add outgoing mail queue
+
+Revision ID: 1a2b3c4d5e07
+Revises: 1a2b3c4d5e06
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a2b3c4d5e07'
+down_revision = '1a2b3c4d5e06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'outgoing_mail',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.String(length=254), nullable=True),
+        sa.Column('subject', sa.String(length=255), nullable=True),
+        sa.Column('html', sa.Text(), nullable=True),
+        sa.Column('coalesce_key', sa.String(length=64), nullable=True),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('send_after', sa.DateTime(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('claimed_by', sa.String(length=64), nullable=True),
+        sa.Column('claimed_at', sa.DateTime(), nullable=True),
+        sa.Column('sent', sa.Boolean(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outgoing_mail_pending', 'outgoing_mail', ['sent', 'send_after'], unique=False)
+    op.create_index('ix_outgoing_mail_coalesce', 'outgoing_mail', ['recipient', 'coalesce_key', 'sent'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outgoing_mail_coalesce', table_name='outgoing_mail')
+    op.drop_index('ix_outgoing_mail_pending', table_name='outgoing_mail')
+    op.drop_table('outgoing_mail')
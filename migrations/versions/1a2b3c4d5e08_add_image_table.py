@@ -0,0 +1,40 @@
+"""add image table
+
+Revision ID: 1a2b3c4d5e08
+Revises: 1a2b3c4d5e07
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a2b3c4d5e08'
+down_revision = '1a2b3c4d5e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'image',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hash', sa.String(length=64), nullable=True),
+        sa.Column('ext', sa.String(length=10), nullable=True),
+        sa.Column('filename', sa.String(length=255), nullable=True),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('width', sa.Integer(), nullable=True),
+        sa.Column('height', sa.Integer(), nullable=True),
+        sa.Column('variants', sa.String(length=255), nullable=True),
+        sa.Column('webp', sa.Boolean(), nullable=False),
+        sa.Column('processed', sa.Boolean(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_image_hash'), 'image', ['hash'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_image_hash'), table_name='image')
+    op.drop_table('image')
@@ -0,0 +1,33 @@
+"""key search index rows by rowid
+
+Revision ID: 1a2b3c4d5e09
+Revises: 1a2b3c4d5e08
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a2b3c4d5e09'
+down_revision = '1a2b3c4d5e08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite 的全文索引改为按 kind 和 id 算出的 rowid 定位行（文章 id * 2，评论 id * 2 + 1），
+    # 旧行的 rowid 是自增的，需要重建
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DELETE FROM search_index')
+        op.execute(
+            "INSERT INTO search_index (rowid, kind, ref_id, post_id, title, body) "
+            "SELECT id * 2, 'post', id, id, title, plain_text FROM post")
+        op.execute(
+            "INSERT INTO search_index (rowid, kind, ref_id, post_id, title, body) "
+            "SELECT id * 2 + 1, 'comment', id, post_id, '', body FROM comment WHERE reviewed = 1")
+
+
+def downgrade():
+    pass
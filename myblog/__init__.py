@@ -4,12 +4,13 @@
     :copyright: © 2025 Cheung Jan <CheungJan@live.com>
     :license: MIT, see LICENSE for more details.
 """
+import json
 import logging
 import os
 from logging.handlers import SMTPHandler, RotatingFileHandler
 
 import click
-from flask import Flask,render_template,request
+from flask import Flask,render_template,request,has_request_context
 from flask_login import current_user
 from flask_sqlalchemy import get_debug_queries
 from flask_wtf.csrf import CSRFError
@@ -17,9 +18,17 @@ from flask_wtf.csrf import CSRFError
 from myblog.blueprints.admin import admin_bp
 from myblog.blueprints.auth import auth_bp
 from myblog.blueprints.blog import blog_bp
-from myblog.extensions import bootstrap,db,login_manager,csrf,ckeditor,mail,moment,migrate,toolbar
-from myblog.models import Admin,Category,Post,Comment,Link
+from myblog.assets import register_static_fingerprints
+from myblog.caching import get_site_context,bump_version,FragmentCacheExtension
+from myblog.extensions import bootstrap,db,login_manager,csrf,mail,moment,cache,init_db,init_ckeditor,init_migrate,init_debug_toolbar,create_schema
+from myblog.export import dynamic_url_for
+from myblog.images import responsive_images
+from myblog.metrics import register_metrics
+from myblog.querycount import register_query_audit
+from myblog.replication import register_read_replicas
+from myblog.models import Admin,Category,Post,Comment,Link,CacheVersion,OutgoingMail,Image,rebuild_counters,backfill_post_text
 from myblog.settings import config
+from myblog.templating import init_template_cache
 
 # 基础目录 basedir=E:\project\Escort_management_system\flask_demo\myblog
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))   
@@ -29,6 +38,7 @@ def create_app(config_name=None):
         config_name = os.getenv('FLASK_CONFIG', 'development')
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    init_template_cache(app) # 模板字节码缓存，需在使用模板环境之前设置
 
     register_logging(app) # 注册日志处理器
     register_extensions(app) # 注册扩展
@@ -46,8 +56,12 @@ def register_logging(app):
     class RequestFormatter(logging.Formatter):
 
         def format(self, record):
-            record.url = request.url
-            record.remote_addr = request.remote_addr
+            # 后台线程（发信、图片处理）里记录的日志没有请求上下文
+            if has_request_context():
+                record.url = request.url
+                record.remote_addr = request.remote_addr
+            else:
+                record.url = record.remote_addr = None
             return super(RequestFormatter, self).format(record)
 
     request_formatter = RequestFormatter(
@@ -77,14 +91,16 @@ def register_logging(app):
         
 def register_extensions(app):
     bootstrap.init_app(app)
-    db.init_app(app)
+    init_db(app)
     login_manager.init_app(app)
     csrf.init_app(app)
-    ckeditor.init_app(app)
+    init_ckeditor(app)
     mail.init_app(app)
     moment.init_app(app)
-    migrate.init_app(app, db)
-    # toolbar.init_app(app)  # 暂时禁用debug toolbar以解决跨盘符问题
+    cache.init_app(app)
+    # 后台和开发用的扩展在 MYBLOG_LAZY_EXTENSIONS 下推迟导入
+    init_migrate(app)
+    init_debug_toolbar(app)
 
 def register_blueprints(app): 
     app.register_blueprint(blog_bp)         
@@ -94,19 +110,23 @@ def register_blueprints(app):
 def register_shell_context(app):
     @app.shell_context_processor
     def make_context():
-        return dict(db=db, Admin=Admin, Category=Category, Post=Post, Comment=Comment, Link=Link)
+        return dict(db=db, Admin=Admin, Category=Category, Post=Post, Comment=Comment, Link=Link,
+                    CacheVersion=CacheVersion, OutgoingMail=OutgoingMail,
+                    Image=Image)
 
 def register_template_context(app):
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.add_template_filter(responsive_images)
+    app.add_template_global(dynamic_url_for)
+
     @app.context_processor
     def make_template_context():
-        admin=Admin.query.first()
-        categories=Category.query.all()
-        links=Link.query.all()
+        context = get_site_context()
         if current_user.is_authenticated:
-            unread_comments = Comment.query.filter_by(reviewed=False).count()
+            context['unread_comments'] = Comment.query.filter_by(reviewed=False).count()
         else:
-            unread_comments = None
-        return dict(admin=admin, categories=categories, links=links, unread_comments=unread_comments)
+            context['unread_comments'] = None
+        return context
 
 def register_errors(app):
     @app.errorhandler(400)
@@ -129,12 +149,16 @@ def register_commands(app):
     @app.cli.command('initdb')
     @click.option('--drop', is_flag=True, help='Create after drop.')
     def initdb(drop):
-        """Initialize dataase."""
+        """Initialize dataase.
+
+        A new database is stamped with the newest migration, so later schema changes
+        are applied with 'flask db upgrade'.
+        """
         if drop:
             click.confirm('This operation will delete the database, do you want to continue?', abort=True)
             db.drop_all()
             click.echo('Drop tables.')
-        db.create_all()
+        create_schema()
         click.echo('Initialized database.')
     
     @app.cli.command()
@@ -144,7 +168,7 @@ def register_commands(app):
         """Building Bluelog,just for you."""
         
         click.echo('Initializing the database...')
-        db.create_all()
+        create_schema()
 
         admin = Admin.query.first()
         if admin is not None:
@@ -169,6 +193,7 @@ def register_commands(app):
             category = Category(name='Default')
             db.session.add(category)
         
+        bump_version('site')
         db.session.commit()
         click.echo('Done.')
 
@@ -176,31 +201,266 @@ def register_commands(app):
     @click.option('--category', default=10, help='Quantity of categories, default is 10.')
     @click.option('--post', default=50, help='Quantity of posts, default is 50.')
     @click.option('--comment', default=500, help='Quantity of comments, default is 500.')
-    def forge(category, post, comment):
+    @click.option('--seed', type=int, help='Seed the generator, so the same options give the same data.')
+    @click.option('--jobs', '-j', default=1, help='Processes generating the fake text, default is 1.')
+    def forge(category, post, comment, seed, jobs):
         """Generate fake data."""
-        from myblog.fakes import fake_admin, fake_categories, fake_posts, fake_comments, fake_links
-        
-        db.drop_all()
-        db.create_all()
-        
-        click.echo('Initializing the database...')
-        fake_admin()
+        from myblog.fakes import forge as forge_data
 
-        click.echo('Generating %d categories...' % category)
-        fake_categories(category)
-        
-        click.echo('Generating %d posts...' % post)
-        fake_posts(post)
-        
-        click.echo('Generating %d comments...' % comment)
-        fake_comments(comment)
+        forge_data(category, post, comment, seed, jobs, echo=click.echo)
 
-        click.echo('Generating links...')
-        fake_links()
+    @app.cli.command(with_appcontext=False)
+    @click.option('--scale', type=click.Choice(['1k', '100k', '1m']), default='1k',
+                  help='Dataset size, by number of comments. Default is 1k.')
+    @click.option('--seed', default=1, help='Seed of the dataset and of the request sequence.')
+    @click.option('--mode', type=click.Choice(['both', 'inprocess', 'gunicorn']), default='both',
+                  help='Drive the app in-process, over a local gunicorn + gevent server, or both.')
+    @click.option('--requests', 'requests_', default=2000, help='Measured requests per mode.')
+    @click.option('--warmup', default=200, help='Requests sent before measuring.')
+    @click.option('--concurrency', default=8, help='Client threads for the gunicorn run.')
+    @click.option('--workers', default=2, help='gunicorn worker processes.')
+    @click.option('--reforge', is_flag=True, help='Forge the dataset again even if it exists.')
+    @click.option('-o', '--output', help='JSON report path, default is MYBLOG_BENCH_PATH/results-<scale>.json.')
+    def bench(scale, seed, mode, requests_, warmup, concurrency, workers, reforge, output):
+        """Benchmark a traffic mix against a forged dataset."""
+        from myblog.bench import run_benchmark, write_report
 
-        click.echo('Done.')
+        directory = app.config['MYBLOG_BENCH_PATH']
+        modes = ('inprocess', 'gunicorn') if mode == 'both' else (mode,)
+        report = run_benchmark(directory, scale, seed, modes, requests_, warmup, concurrency, workers, reforge,
+                               echo=click.echo)
+        output = output or os.path.join(directory, 'results-%s.json' % scale)
+        write_report(report, output)
+        for name, run in report['runs'].items():
+            click.echo('%-10s %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms  errors %d' % (
+                name, run['throughput'], run['p50'], run['p99'], run['errors']))
+        click.echo('Report written to %s.' % output)
+
+    @app.cli.command('profile-imports', with_appcontext=False)
+    @click.option('--target', default='wsgi:app', help='Entry point to import, default is wsgi:app.')
+    @click.option('--config', 'config_name', default='production', help='FLASK_CONFIG of the import, default is production.')
+    @click.option('--eager', is_flag=True, help='Turn MYBLOG_LAZY_EXTENSIONS off.')
+    @click.option('--top', default=20, help='Number of packages to list, default is 20.')
+    def profile_imports(target, config_name, eager, top):
+        """Show which packages the startup time is spent importing."""
+        from myblog.startup import import_profile
+
+        total, packages = import_profile(target, config_name, lazy=False if eager else None)
+        click.echo('%-24s %10s %8s %7s  %s' % ('package', 'ms', 'share', 'modules', 'first imported by'))
+        for package in packages[:top]:
+            click.echo('%-24s %10.1f %7.1f%% %7d  %s' % (package['name'], package['time'] / 1000,
+                                                      package['time'] * 100.0 / total, package['modules'],
+                                                      package['importer']))
+        click.echo('Importing %s took %.1f ms (%d packages).' % (target, total / 1000, len(packages)))
+
+    @app.cli.command('cold-start', with_appcontext=False)
+    @click.option('--target', default='wsgi:app', help='Entry point to start, default is wsgi:app.')
+    @click.option('--config', 'config_name', default='production', help='FLASK_CONFIG of the app, default is production.')
+    @click.option('--runs', default=10, help='Measured starts per mode, default is 10.')
+    @click.option('--path', default='/', help='Path of the first request, default is /.')
+    @click.option('--database', help='SQLite file to serve (sets DATABASE_URL), e.g. a flask bench dataset.')
+    @click.option('--compare', is_flag=True, help='Also measure with MYBLOG_LAZY_EXTENSIONS off.')
+    @click.option('-o', '--output', help='Also write the results to this JSON file.')
+    def cold_start_command(target, config_name, runs, path, database, compare, output):
+        """Time cold starts of the app: import and first request in a new process."""
+        from myblog.startup import cold_start
+
+        modes = (('default', None), ('eager', False)) if compare else (('default', None),)
+        results = {}
+        for name, lazy in modes:
+            results[name] = result = cold_start(target, config_name, runs, path, lazy, database)
+            click.echo('%-8s %s' % (name, '  '.join('%s %.1f ms' % (phase, result[phase]['median'])
+                                                   for phase in ('interpreter', 'import', 'request', 'process'))))
+            if result['status'] != [200]:
+                click.echo('         %s answered with status %s.' % (path, ', '.join(map(str, result['status']))))
+        click.echo('Medians of %d runs of %s.' % (runs, target))
+        if output:
+            with open(output, 'w') as f:
+                json.dump(dict(target=target, config=config_name, path=path, results=results), f, indent=2)
+            click.echo('Results written to %s.' % output)
+
+    @app.cli.command('check-templates')
+    @click.option('--top', default=15, help='Number of templates to list, default is 15.')
+    def check_templates(top):
+        """Report the compile cost of each template and fill the bytecode cache."""
+        from myblog.templating import template_costs
+
+        costs = sorted(template_costs(app), key=lambda cost: cost[1], reverse=True)
+        cached = app.jinja_env.bytecode_cache is not None
+        click.echo('%-36s %10s %10s' % ('template', 'compile', 'cached'))
+        for name, compile_ms, cached_ms in costs[:top]:
+            click.echo('%-36s %7.2f ms %s' % (name, compile_ms, '%7.2f ms' % cached_ms if cached else '%10s' % '-'))
+        click.echo('Compiling %d templates takes %.1f ms%s.' % (
+            len(costs), sum(cost[1] for cost in costs),
+            ', loading them from the bytecode cache %.1f ms' % sum(cost[2] for cost in costs) if cached
+            else ' (MYBLOG_TEMPLATE_CACHE_PATH is not set)'))
+
+    @app.cli.command()
+    def recount():
+        """Rebuild the cached post and comment counters."""
+        rebuild_counters()
+        bump_version('site')
+        db.session.commit()
+        click.echo('Counters rebuilt.')
+
+    @app.cli.command('backfill-text')
+    @click.option('--batch-size', default=500, help='Posts per transaction, default is 500.')
+    def backfill_text(batch_size):
+        """Recompute post excerpts, plain-text bodies and word counts."""
+        click.echo('Updated %d posts.' % backfill_post_text(batch_size))
+
+    @app.cli.command()
+    @click.option('--output', '-o', help='Output directory, default is MYBLOG_EXPORT_PATH.')
+    @click.option('--jobs', '-j', default=os.cpu_count() or 1, help='Number of rendering processes.')
+    @click.option('--full', is_flag=True, help='Re-render every page, not only the changed ones.')
+    def export(output, jobs, full):
+        """Pre-render the public pages to static files."""
+        from myblog.export import export_site
+
+        output = output or app.config['MYBLOG_EXPORT_PATH']
+        rendered, total, removed = export_site(app, output, jobs=jobs, full=full)
+        click.echo('Rendered %d of %d pages to %s, removed %d.' % (rendered, total, output, removed))
+
+    @app.cli.command('process-images')
+    @click.option('--all', 'process_all', is_flag=True, help='Regenerate the variants of every image.')
+    def process_images(process_all):
+        """Generate resized and WebP variants of uploaded images."""
+        from concurrent.futures import ThreadPoolExecutor
+        from myblog.images import get_processor
+
+        query = Image.query if process_all else Image.query.filter_by(processed=False)
+        ids = [id for id, in query.with_entities(Image.id).all()]
+        processor = get_processor(app)
+        with ThreadPoolExecutor(max_workers=max(app.config['MYBLOG_IMAGE_WORKERS'], 1)) as executor:
+            done = sum(executor.map(processor.run, ids))
+        click.echo('Processed %d of %d images.' % (done, len(ids)))
+
+    @app.cli.command('send-mail')
+    def send_queued_mail():
+        """Send every due message in the outbox now."""
+        from myblog.emails import get_dispatcher
+
+        dispatcher = get_dispatcher(app)
+        total = 0
+        try:
+            while True:
+                sent = dispatcher.dispatch()
+                if not sent:
+                    break
+                total += sent
+        finally:
+            if dispatcher.connection is not None:
+                dispatcher.close()
+        click.echo('Processed %d messages.' % total)
+
+    @app.cli.command('mail-sink')
+    @click.option('--host', default='127.0.0.1', help='Address to listen on, default is 127.0.0.1.')
+    @click.option('--port', default=1025, help='Port to listen on, default is 1025.')
+    def mail_sink(host, port):
+        """Run a local SMTP server that prints received messages."""
+        from myblog.smtpsink import SMTPSink
+
+        server = SMTPSink(host, port, echo=click.echo)
+        click.echo('SMTP sink listening on %s:%d (MAIL_SERVER=%s MAIL_PORT=%d MAIL_USE_SSL=false)'
+                   % (host, server.port, host, server.port))
+        server.serve_forever()
+
+    @app.cli.command('cache-server', with_appcontext=False)
+    @click.option('--host', default='127.0.0.1', help='Address to listen on, default is 127.0.0.1.')
+    @click.option('--port', default=6379, help='Port to listen on, default is 6379.')
+    def cache_server(host, port):
+        """Run a local in-memory stand-in for Redis."""
+        from myblog.respserver import RESPServer
+
+        server = RESPServer(host, port)
+        click.echo('Cache server listening on %s:%d (MYBLOG_CACHE_URL=redis://%s:%d)' % (host, server.port, host, server.port))
+        server.serve_forever()
+
+    @app.cli.command('clear-cache')
+    @click.option('--namespace', help='Only clear this namespace, e.g. pages or fragments.')
+    def clear_cache(namespace):
+        """Remove cached pages, fragments and other entries from the shared cache."""
+        if not cache.backend.shared:
+            click.echo('MYBLOG_CACHE_URL is %s: each process has its own cache, restart the workers instead.'
+                       % app.config['MYBLOG_CACHE_URL'])
+            return
+        cache.clear(namespace)
+        click.echo('Cleared %s in %s.' % (namespace or 'every namespace', app.config['MYBLOG_CACHE_URL']))
+
+    @app.cli.command()
+    @click.option('--interval', default=1.0, help='Seconds between copies, default is 1.')
+    @click.option('--lag', default=0.0, help='Delay the copies by this many seconds, to test lagging replicas.')
+    @click.option('--once', is_flag=True, help='Copy once and exit.')
+    def replicate(interval, lag, once):
+        """Keep SQLite read replicas in sync with the primary (a local stand-in for replication)."""
+        from myblog.replication import SQLiteReplicator, sqlite_path
+
+        if not app.config['MYBLOG_REPLICA_URLS']:
+            raise click.UsageError('Set MYBLOG_REPLICA_URLS to the SQLite files of the replicas.')
+        replicator = SQLiteReplicator(sqlite_path(app.config['SQLALCHEMY_DATABASE_URI']),
+                                      [sqlite_path(url) for url in app.config['MYBLOG_REPLICA_URLS']], lag)
+        if once:
+            replicator.lag = 0
+            replicator.tick()
+            click.echo('Copied the primary to %d replicas.' % len(replicator.replicas))
+            return
+        click.echo('Replicating every %gs with a lag of %gs, press Ctrl+C to stop.' % (interval, lag))
+        replicator.run(interval, echo=click.echo)
+
+    @app.cli.command('replica-status')
+    def replica_status_command():
+        """Show the lag of each read replica and whether reads are routed to it."""
+        from sqlalchemy.engine import make_url
+        from myblog.replication import measure_lag
+
+        lags = measure_lag(app)
+        if not lags:
+            click.echo('No read replicas configured (MYBLOG_REPLICA_URLS).')
+        for (key, lag), url in zip(lags.items(), app.config['MYBLOG_REPLICA_URLS']):
+            usable = lag is not None and lag <= app.config['MYBLOG_REPLICA_MAX_LAG']
+            click.echo('%-10s %-8s %-10s %s' % (key, 'down' if lag is None else '%.1fs' % lag,
+                                               'in use' if usable else 'skipped', repr(make_url(url))))
+
+    @app.cli.command('check-queries', with_appcontext=False)
+    def check_queries():
+        """Count the queries issued by each listing view against its budget."""
+        from myblog.querycount import check_view_queries
+
+        failed = False
+        for endpoint, url, count, budget in check_view_queries(app):
+            over = budget is not None and count > budget
+            failed = failed or over
+            click.echo('%-24s %-32s %3d / %s%s' % (endpoint, url, count, budget if budget is not None else '-',
+                                                  '  OVER BUDGET' if over else ''))
+        if failed:
+            raise SystemExit(1)
+        click.echo('All views within their query budgets.')
+
+    @app.cli.command()
+    def reindex():
+        """Rebuild the full-text search index."""
+        from myblog.search import create_search_index, reindex as rebuild_search_index
+
+        with db.engine.begin() as connection:
+            create_search_index(connection)
+        click.echo('Indexed %d posts and comments.' % rebuild_search_index())
+
+    @app.cli.command()
+    def explain():
+        """Print the query plan of each listing query."""
+        from myblog.querycount import listing_queries, explain as explain_statement
+
+        for name, statement in listing_queries():
+            click.echo('== %s' % name)
+            for line in explain_statement(statement):
+                click.echo('   %s' % line)
          
 def register_request_handlers(app):
+    register_static_fingerprints(app)
+    register_metrics(app)
+    register_read_replicas(app)
+    register_query_audit(app)
+
     @app.after_request
     def query_time_stat(request):
         for q in get_debug_queries():
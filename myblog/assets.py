@@ -0,0 +1,119 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import stat as stat_module
+
+from flask import current_app, request, abort
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+# 内容寻址的上传文件：<hh>/<sha256>.<ext> 及其缩略图 <hh>/<sha256>-<width>.<ext>
+_content_addressed_re = re.compile(r'^[0-9a-f]{2}/([0-9a-f]{64}(?:-\d+)?)\.(\w+)$')
+
+# 按路径缓存静态文件指纹，文件的 mtime 或大小变化时重新计算
+_fingerprints = {}
+
+
+def fingerprint(path):
+    """Short content hash of the file at ``path``, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if not stat_module.S_ISREG(stat.st_mode):
+        return None
+    cached = _fingerprints.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    version = digest.hexdigest()[:12]
+    _fingerprints[path] = (stat.st_mtime_ns, stat.st_size, version)
+    return version
+
+
+def _static_path(app, filename):
+    return safe_join(app.static_folder, filename)
+
+
+def register_static_fingerprints(app):
+    """Append ``?v=<content hash>`` to every ``url_for('static', ...)`` and cache those URLs forever.
+
+    The version changes with the file's content, so a deploy that touches a theme's CSS
+    or JS gets new URLs while unchanged files stay cached in browsers and CDNs.
+    """
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            path = _static_path(app, values['filename'])
+            version = fingerprint(path) if path is not None else None
+            if version is not None:
+                values['v'] = version
+
+    @app.after_request
+    def cache_fingerprinted_static(response):
+        version = request.args.get('v')
+        if request.endpoint == 'static' and version and response.status_code in (200, 206, 304):
+            path = _static_path(app, request.view_args['filename'])
+            # 旧版本号请求到的是新内容，不能让它被永久缓存
+            if path is not None and fingerprint(path) == version:
+                _cache_forever(response)
+        return response
+
+
+def _cache_forever(response):
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['MYBLOG_IMMUTABLE_MAX_AGE']
+    response.cache_control.immutable = True
+
+
+def send_upload(filename):
+    """Serve a file from MYBLOG_UPLOAD_PATH with validators, Range support and optional offloading.
+
+    Content-addressed files never change under their URL, so they get a strong ETag
+    derived from the name and are cached as immutable. Files uploaded before content
+    addressing are cached for MYBLOG_UPLOAD_MAX_AGE and revalidated by mtime and size.
+    With MYBLOG_UPLOAD_OFFLOAD set to 'x-sendfile' or 'x-accel', the front-end server
+    (Apache/lighttpd or nginx) sends the file body instead of the Python worker.
+    """
+    config = current_app.config
+    path = safe_join(config['MYBLOG_UPLOAD_PATH'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    match = _content_addressed_re.match(filename)
+    etag = match.group(1) if match else True
+    max_age = config['MYBLOG_IMMUTABLE_MAX_AGE'] if match else config['MYBLOG_UPLOAD_MAX_AGE']
+    offload = config['MYBLOG_UPLOAD_OFFLOAD']
+
+    if offload == 'x-accel':
+        # nginx 通过 internal location 发送文件并处理 Range，这里只负责响应头和条件请求
+        response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0])
+        response.headers['X-Accel-Redirect'] = config['MYBLOG_UPLOAD_ACCEL_PREFIX'] + filename
+        stat = os.stat(path)
+        if match:
+            response.set_etag(etag)
+        else:
+            response.set_etag('%s-%s' % (stat.st_mtime_ns, stat.st_size))
+        response.last_modified = int(stat.st_mtime)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response = response.make_conditional(request.environ)
+        if response.status_code == 304:
+            # 否则 nginx 仍会内部跳转并返回完整文件
+            del response.headers['X-Accel-Redirect']
+    else:
+        response = send_file(path, request.environ, etag=etag, max_age=max_age,
+                             use_x_sendfile=offload == 'x-sendfile', response_class=current_app.response_class)
+    if match:
+        _cache_forever(response)
+    return response
@@ -0,0 +1,396 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.client import HTTPConnection, HTTPException
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from myblog.settings import config, prefix, BenchmarkConfig
+
+# 数据集规模：名称以评论数计
+SCALES = {
+    '1k': dict(category=10, post=50, comment=1000),
+    '100k': dict(category=20, post=2000, comment=100000),
+    '1m': dict(category=50, post=20000, comment=1000000),
+}
+
+# 流量组成：(名称, 权重)，对应 _next_request 中的请求
+TRAFFIC_MIX = (
+    ('index', 25),
+    ('index_page', 5),
+    ('category', 15),
+    ('post', 30),
+    ('comment', 5),
+    ('admin_posts', 7),
+    ('admin_comments', 8),
+    ('admin_categories', 5),
+)
+
+ADMIN_USERNAME = 'admin'
+ADMIN_PASSWORD = '123456'  # 与 fakes.fake_admin 一致
+
+
+def create_bench_app(database=None, metrics_dir=None):
+    """Create the app with BenchmarkConfig on the SQLite file ``database``.
+
+    Also the gunicorn entry point (``myblog.bench:create_bench_app()``), which reads the
+    database and metrics directory from MYBLOG_BENCH_DATABASE and MYBLOG_METRICS_DIR.
+    """
+    from myblog import create_app
+
+    database = database or os.environ['MYBLOG_BENCH_DATABASE']
+    metrics_dir = metrics_dir or os.getenv('MYBLOG_METRICS_DIR') or None
+    config['benchmark'] = type('BenchmarkConfig', (BenchmarkConfig,), {
+        'SQLALCHEMY_DATABASE_URI': prefix + os.path.abspath(database),
+        'MYBLOG_METRICS_DIR': metrics_dir,
+    })
+    return create_app('benchmark')
+
+
+def dataset_path(directory, scale, seed):
+    return os.path.join(directory, '%s-seed%d.db' % (scale, seed))
+
+
+def forge_dataset(path, scale, seed):
+    """Build the dataset of ``scale`` into ``path`` with the ``flask forge`` generator."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    app = create_bench_app(temp_path)
+    with app.app_context():
+        from myblog.extensions import db
+        from myblog.fakes import forge
+
+        forge(seed=seed, jobs=os.cpu_count() or 1, echo=lambda message: None, **SCALES[scale])
+        db.engine.dispose()
+    # 生成完整后才改名，中断的生成不会被当作可用的数据集
+    os.replace(temp_path, path)
+
+
+def dataset_info(app):
+    from myblog.extensions import db
+    from myblog.models import Category, Post, Comment
+
+    with app.app_context():
+        return {
+            'categories': db.session.query(db.func.count(Category.id)).scalar(),
+            'posts': db.session.query(db.func.count(Post.id)).scalar(),
+            'comments': db.session.query(db.func.count(Comment.id)).scalar(),
+        }
+
+
+def _next_request(rng, mix, dataset):
+    """``(name, method, url, data, admin)`` of the next request in the traffic mix."""
+    name = rng.choices([name for name, weight in mix], [weight for name, weight in mix])[0]
+    post_id = rng.randint(1, max(dataset['posts'], 1))
+    if name == 'index':
+        return name, 'GET', '/', None, False
+    if name == 'index_page':
+        return name, 'GET', '/?page=%d' % rng.randint(2, 5), None, False
+    if name == 'category':
+        return name, 'GET', '/category/%d' % rng.randint(1, max(dataset['categories'], 1)), None, False
+    if name == 'post':
+        return name, 'GET', '/post/%d' % post_id, None, False
+    if name == 'comment':
+        data = {'author': 'Bench %d' % rng.randint(1, 1000), 'email': 'bench@example.com',
+                'body': 'Benchmark comment %d.' % rng.randint(1, 10 ** 6)}
+        return name, 'POST', '/post/%d' % post_id, data, False
+    urls = {'admin_posts': '/admin/post/manage', 'admin_comments': '/admin/comment/manage',
+            'admin_categories': '/admin/category/manage'}
+    return name, 'GET', urls[name], None, True
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(int(round(percent / 100.0 * len(values) + 0.5)) - 1, 0)
+    return round(values[min(index, len(values) - 1)] * 1000, 3)
+
+
+def _summary(samples, elapsed):
+    """Throughput and latency (in ms) of ``samples``, a list of ``(name, seconds, ok)``."""
+    def stats(items):
+        latencies = [seconds for name, seconds, ok in items]
+        return {
+            'requests': len(items),
+            'errors': sum(1 for name, seconds, ok in items if not ok),
+            'p50': _percentile(latencies, 50),
+            'p99': _percentile(latencies, 99),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        }
+    summary = stats(samples)
+    summary['seconds'] = round(elapsed, 3)
+    summary['throughput'] = round(len(samples) / elapsed, 1) if elapsed else None
+    summary['routes'] = {name: stats([sample for sample in samples if sample[0] == name])
+                         for name in sorted({sample[0] for sample in samples})}
+    return summary
+
+
+def queries_per_request(before, after):
+    """Average SQL statements per request by endpoint, between two sets of metrics counters."""
+    totals = {}
+    for (name, labels), value in after.items():
+        if name not in ('myblog_requests_total', 'myblog_db_queries_total'):
+            continue
+        entry = totals.setdefault(dict(labels)['endpoint'], [0, 0])
+        entry[0 if name == 'myblog_requests_total' else 1] += value - before.get((name, labels), 0)
+    return {endpoint: round(queries / requests, 2)
+            for endpoint, (requests, queries) in sorted(totals.items()) if requests}
+
+
+def run_in_process(app, dataset, requests, warmup, seed, mix=TRAFFIC_MIX):
+    """Drive the WSGI app through test clients, one request at a time, without any network."""
+    from myblog.extensions import db
+    from myblog.metrics import get_collector
+    from myblog.models import Admin
+
+    anonymous = app.test_client()
+    admin = app.test_client()
+    with app.app_context():
+        admin_id = db.session.query(Admin.id).scalar()
+    with admin.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+
+    def send(rng):
+        name, method, url, data, as_admin = _next_request(rng, mix, dataset)
+        client = admin if as_admin else anonymous
+        started = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        response.get_data()
+        response.close()
+        return name, time.perf_counter() - started, response.status_code < 400
+
+    rng = random.Random(seed)
+    for i in range(warmup):
+        send(rng)
+    collector = get_collector(app)
+    before = collector.collect()[0]
+    samples = []
+    started = time.perf_counter()
+    for i in range(requests):
+        samples.append(send(rng))
+    summary = _summary(samples, time.perf_counter() - started)
+    summary['concurrency'] = 1
+    summary['queries_per_request'] = queries_per_request(before, collector.collect()[0])
+    return summary
+
+
+class HTTPClient(object):
+    """A keep-alive HTTP/1.1 connection that remembers cookies, like one browser tab."""
+
+    def __init__(self, host, port, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+        self.cookies = SimpleCookie()
+
+    def request(self, method, url, data=None):
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % (key, morsel.value) for key, morsel in self.cookies.items())
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, url, body=body, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                break
+            except (OSError, HTTPException):
+                # 服务器关闭了空闲连接，重连后再试一次
+                self.connection.close()
+                self.connection = None
+                if attempt == 2:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or ():
+            self.cookies.load(header)
+        return response.status
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(database, metrics_dir, workers, port):
+    """Start ``gunicorn -k gevent`` serving the benchmark app; returns the process once it answers."""
+    env = dict(os.environ, MYBLOG_BENCH_DATABASE=os.path.abspath(database), MYBLOG_METRICS_DIR=metrics_dir)
+    command = [sys.executable, '-m', 'gunicorn', '-k', 'gevent', '-w', str(workers), '-b', '127.0.0.1:%d' % port,
+               '--log-level', 'warning', 'myblog.bench:create_bench_app()']
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited with status %d' % process.returncode)
+        try:
+            client = HTTPClient('127.0.0.1', port, timeout=5)
+            client.request('GET', '/')
+            client.close()
+            return process
+        except (OSError, HTTPException):
+            time.sleep(0.2)
+    stop_gunicorn(process)
+    raise RuntimeError('gunicorn did not start within 60 seconds')
+
+
+def stop_gunicorn(process):
+    # SIGTERM 让 worker 正常退出，退出前写出最后的指标
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_gunicorn(database, dataset, requests, warmup, seed, concurrency, workers, mix=TRAFFIC_MIX):
+    """Drive a local gunicorn + gevent server over HTTP from ``concurrency`` client threads."""
+    from myblog.metrics import load_snapshots, sum_snapshots
+
+    metrics_dir = tempfile.mkdtemp(prefix='myblog-bench-metrics-')
+    port = _free_port()
+    process = start_gunicorn(database, metrics_dir, workers, port)
+    try:
+        clients = []
+        for i in range(concurrency):
+            anonymous, admin = HTTPClient('127.0.0.1', port), HTTPClient('127.0.0.1', port)
+            admin.request('POST', '/auth/login?next=/', {'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+            clients.append((anonymous, admin, random.Random('%d-%d' % (seed, i))))
+
+        def send(anonymous, admin, rng):
+            name, method, url, data, as_admin = _next_request(rng, mix, dataset)
+            started = time.perf_counter()
+            try:
+                ok = (admin if as_admin else anonymous).request(method, url, data) < 400
+            except (OSError, HTTPException):
+                ok = False
+            return name, time.perf_counter() - started, ok
+
+        def worker(index, count, samples):
+            anonymous, admin, rng = clients[index]
+            for i in range(count):
+                samples.append(send(anonymous, admin, rng))
+
+        def run(total):
+            samples = [[] for i in range(concurrency)]
+            threads = [threading.Thread(target=worker, args=(i, total // concurrency + (i < total % concurrency),
+                                                             samples[i]))
+                       for i in range(concurrency)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return [sample for items in samples for sample in items], time.perf_counter() - started
+
+        run(warmup)
+        # worker 每隔 MYBLOG_METRICS_FLUSH_INTERVAL 秒才写一次文件：等过这段时间后再发几个请求让各
+        # worker 写出预热的数据（大致如此，gevent 不保证每个 worker 都分到），停止时再写出剩下的
+        time.sleep(BenchmarkConfig.MYBLOG_METRICS_FLUSH_INTERVAL + 0.5)
+        for anonymous, admin, rng in clients:
+            for i in range(workers):
+                anonymous.request('GET', '/robots.txt')
+        before = sum_snapshots(load_snapshots(metrics_dir))[0]
+        samples, elapsed = run(requests)
+        for anonymous, admin, rng in clients:
+            anonymous.close()
+            admin.close()
+    finally:
+        stop_gunicorn(process)
+    after = sum_snapshots(load_snapshots(metrics_dir))[0]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    summary = _summary(samples, elapsed)
+    summary['concurrency'] = concurrency
+    summary['workers'] = workers
+    summary['queries_per_request'] = queries_per_request(before, after)
+    return summary
+
+
+def _revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(directory, scale='1k', seed=1, modes=('inprocess', 'gunicorn'), requests=2000, warmup=200,
+                  concurrency=8, workers=2, reforge=False, echo=print):
+    """Forge (or reuse) the dataset of ``scale`` and benchmark it in each of ``modes``.
+
+    Every mode starts from a fresh copy of the dataset, so the comments posted by one run
+    do not change the next, and the same seed replays the same sequence of requests.
+    Returns the report as a dict.
+    """
+    path = dataset_path(directory, scale, seed)
+    if reforge or not os.path.exists(path):
+        echo('Forging the %s dataset (seed %d)...' % (scale, seed))
+        started = time.perf_counter()
+        forge_dataset(path, scale, seed)
+        echo('Forged in %.1fs.' % (time.perf_counter() - started))
+    report = {
+        'revision': _revision(),
+        'timestamp': datetime.utcnow().replace(microsecond=0).isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'seed': seed,
+        'mix': dict(TRAFFIC_MIX),
+        'runs': {},
+    }
+    for mode in modes:
+        work_path = os.path.join(directory, '%s-seed%d.run.db' % (scale, seed))
+        shutil.copyfile(path, work_path)
+        try:
+            echo('Running %d requests %s...' % (requests, 'in-process' if mode == 'inprocess' else 'over gunicorn'))
+            if mode == 'inprocess':
+                app = create_bench_app(work_path)
+                report['dataset'] = dataset = dataset_info(app)
+                report['runs'][mode] = run_in_process(app, dataset, requests, warmup, seed)
+                with app.app_context():
+                    from myblog.extensions import db
+                    db.engine.dispose()
+            else:
+                dataset = report.get('dataset') or dataset_info(create_bench_app(work_path))
+                report['dataset'] = dataset
+                report['runs'][mode] = run_gunicorn(work_path, dataset, requests, warmup, seed, concurrency, workers)
+        finally:
+            os.remove(work_path)
+    return report
+
+
+def write_report(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        # 键排序、缩进输出，便于在两次提交之间 diff
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
@@ -4,21 +4,39 @@
     :copyright: ©2025 Cheung Jan <CheungJan@live.com>
     :license: MIT, see LICENSE for more details.
 """
-import os
-
-from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint, send_from_directory, abort
-from werkzeug.utils import secure_filename
+from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint
 from markupsafe import Markup
 from flask_login import login_required, current_user
-from flask_ckeditor import upload_success, upload_fail
+from sqlalchemy.orm import joinedload, defer
 
+from myblog import search
+from myblog.assets import send_upload
+from myblog.images import store_upload, get_processor
+from myblog.caching import bump_version, post_tags
 from myblog.extensions import db
+from myblog.feeds import feed_tags
 from myblog.forms import SettingForm,PostForm,CategoryForm,LinkForm
-from myblog.models import Post,Category,Comment,Link
+from myblog.models import Post,Category,Comment,Link,delete_comment_tree,update_comment_counts
+from myblog.pagination import paginate
 from myblog.utils import redirect_back,allowed_file
 
 admin_bp = Blueprint('admin', __name__)
 
+def remove_comment_tree(*criteria):
+    """Delete the comments matching ``criteria`` and their replies, with their search rows.
+
+    Replies can be on other posts than the comments they reply to, so the counters and
+    cached pages of every post that lost a comment are updated.
+    """
+    deleted = delete_comment_tree(*criteria)
+    search.remove_comments(deleted)
+    post_ids = {post_id for post_id in deleted.values() if post_id is not None}
+    if post_ids:
+        update_comment_counts(Post.id.in_(post_ids))
+        category_ids = [id for id, in db.session.query(Post.category_id).filter(Post.id.in_(post_ids)).distinct()]
+        bump_version('posts', *('post:%d' % id for id in post_ids), *('category:%d' % id for id in category_ids))
+    return deleted
+
 @admin_bp.route('/settings',methods=['GET','POST'])
 @login_required
 def settings():
@@ -28,6 +46,7 @@ def settings():
         current_user.blog_title = form.blog_title.data
         current_user.blog_sub_title = form.blog_sub_title.data
         current_user.about = form.about.data
+        bump_version('site')
         db.session.commit()
         flash('Setting updated.', 'success')
         return redirect(url_for('blog.index'))
@@ -41,7 +60,9 @@ def settings():
 @login_required
 def manage_post():
     page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(page=page, per_page=current_app.config['MYBLOG_MANAGE_POST_PER_PAGE'])
+    posts = Post.query.options(joinedload(Post.category), defer(Post.body), defer(Post.plain_text))
+    pagination = paginate(posts, Post, current_app.config['MYBLOG_MANAGE_POST_PER_PAGE'],
+                          total=lambda: db.session.query(db.func.sum(Category.post_count)).scalar() or 0)
     posts = pagination.items
     return render_template('admin/manage_post.html', page=page, pagination=pagination, posts=posts)
 
@@ -57,7 +78,11 @@ def new_post():
         # same with:
         # category_id = form.category.data
         # post = Post(title=title, body=body, category_id=category_id)
+        post.update_text()
         db.session.add(post)
+        category.update_post_count()
+        bump_version('site', *post_tags(post), *feed_tags(post))
+        search.index_post(post)
         db.session.commit()
         flash('Post created.', 'success')
         return redirect(url_for('blog.show_post', post_id=post.id))
@@ -69,9 +94,17 @@ def edit_post(post_id):
     form = PostForm()
     post = Post.query.get_or_404(post_id)
     if request.method == 'POST' and form.validate():
+        old_category = post.category
+        bump_version(*post_tags(post), *feed_tags(post))
         post.title = form.title.data
         post.body = form.body.data
+        post.update_text()
         post.category = Category.query.get(form.category.data)
+        if post.category is not old_category:
+            old_category.update_post_count()
+            post.category.update_post_count()
+            bump_version('site', 'category:%d' % post.category.id, 'feed:category:%d' % post.category.id)
+        search.index_post(post)
         db.session.commit()
         flash('Post updated.', 'success')
         return redirect(url_for('blog.show_post', post_id=post.id))
@@ -84,7 +117,12 @@ def edit_post(post_id):
 @login_required
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
+    category = post.category
+    bump_version('site', *post_tags(post), *feed_tags(post))
+    search.remove_post(post)
+    remove_comment_tree(Comment.post_id == post.id)
     db.session.delete(post)
+    category.update_post_count()
     db.session.commit()
     flash('Post deleted.', 'success')
     return redirect_back()
@@ -99,6 +137,7 @@ def set_comment(post_id):
     else:
         post.can_comment = True
         flash('Comment enabled.', 'success')
+    bump_version('post:%d' % post.id)
     db.session.commit()
     return redirect_back()
 
@@ -106,7 +145,6 @@ def set_comment(post_id):
 @login_required
 def manage_comment():
     filter_rule = request.args.get('filter', 'all')  # 'all', 'unreviewed', 'admin'
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config['MYBLOG_COMMENT_PER_PAGE']
     if filter_rule == 'unread':
         filtered_comments = Comment.query.filter_by(reviewed=False)
@@ -115,7 +153,7 @@ def manage_comment():
     else:
         filtered_comments = Comment.query
 
-    pagination = filtered_comments.order_by(Comment.timestamp.desc()).paginate(page=page, per_page=per_page)
+    pagination = paginate(filtered_comments, Comment, per_page)
     comments = pagination.items
     return render_template('admin/manage_comment.html', comments=comments, pagination=pagination)
 
@@ -124,6 +162,9 @@ def manage_comment():
 def approve_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
     comment.reviewed = True
+    comment.post.update_comment_count()
+    bump_version(*post_tags(comment.post))
+    search.index_comment(comment)
     db.session.commit()
     flash('Comment published.', 'success')
     return redirect_back()
@@ -131,8 +172,8 @@ def approve_comment(comment_id):
 @admin_bp.route('/comment/<int:comment_id>/delete', methods=['POST'])
 @login_required
 def delete_comment(comment_id):
-    comment = Comment.query.get_or_404(comment_id)
-    db.session.delete(comment)
+    Comment.query.get_or_404(comment_id)
+    remove_comment_tree(Comment.id == comment_id)
     db.session.commit()
     flash('Comment deleted.', 'success')
     return redirect_back()
@@ -150,6 +191,7 @@ def new_category():
         name = form.name.data
         category = Category(name=name)
         db.session.add(category)
+        bump_version('site')
         db.session.commit()
         flash('Category created.', 'success')
         return redirect(url_for('.manage_category'))
@@ -165,6 +207,7 @@ def edit_category(category_id):
         return redirect(url_for('.blog.index'))
     if request.method == 'POST' and form.validate():
         category.name = form.name.data
+        bump_version('site')
         db.session.commit()
         flash('Category updated.', 'success')
         return redirect(url_for('.manage_category'))
@@ -179,6 +222,7 @@ def delete_category(category_id):
     if category.id == 1:
         flash('You can not delete the default category.', 'warning')
         return redirect(url_for('blog.index'))
+    bump_version('site')
     category.delete()
     flash('Category deleted.', 'success')
     return redirect(url_for('.manage_category'))
@@ -196,6 +240,7 @@ def new_link():
         name = form.name.data
         link = Link(name=name, url=form.url.data)
         db.session.add(link)
+        bump_version('site')
         db.session.commit()
         flash('Link created.', 'success')
         return redirect(url_for('.manage_link'))
@@ -209,6 +254,7 @@ def edit_link(link_id):
     if request.method == 'POST' and form.validate():
         link.name = form.name.data
         link.url = form.url.data
+        bump_version('site')
         db.session.commit()
         flash('Link updated.', 'success')
         return redirect(url_for('.manage_link'))
@@ -221,37 +267,33 @@ def edit_link(link_id):
 def delete_link(link_id):
     link = Link.query.get_or_404(link_id)
     db.session.delete(link)
+    bump_version('site')
     db.session.commit()
     flash('Link deleted.', 'success')
     return redirect(url_for('.manage_link'))
 
 @admin_bp.route('/uploads/<path:filename>')
 def get_image(filename):
-    try:
-        return send_from_directory(current_app.config['MYBLOG_UPLOAD_PATH'], filename)
-    except Exception as e:
-        current_app.logger.error(f'图片加载失败: {str(e)}')
-        abort(404)
+    return send_upload(filename)
 
 
 @admin_bp.route('/uploads',methods=['POST'])
 @login_required
 def upload_image():
+    from flask_ckeditor import upload_success, upload_fail
+
     f = request.files.get('upload')
     if not f:
         return upload_fail('No file uploaded!')
     if not allowed_file(f.filename):
         return upload_fail('只允许上传图片文件！')
-    # 确保上传目录存在
-    upload_path = current_app.config['MYBLOG_UPLOAD_PATH']
-    if not os.path.exists(upload_path):
-        os.makedirs(upload_path)
-    # 生成安全的文件名
-    filename = secure_filename(f.filename)
     try:
-        f.save(os.path.join(upload_path, filename))
-        url = url_for('.get_image', filename=filename)
-        return upload_success(url, filename)
+        # 按内容哈希保存，缩略图和 WebP 版本在后台生成
+        image = store_upload(f)
+        if not image.processed:
+            get_processor().submit(image.id)
+        url = url_for('.get_image', filename=image.path)
+        return upload_success(url, image.filename)
     except Exception as e:
         current_app.logger.error(f'上传失败: {str(e)}')
         return upload_fail('上传失败，请重试！')
@@ -6,52 +6,67 @@
 """
 from flask import render_template, request, url_for, flash, redirect, current_app, Blueprint,abort,make_response
 from flask_login import current_user
+from sqlalchemy.orm import joinedload, defer
+from myblog import search as search_index
+from myblog import sitemap
+from myblog.caching import cached_page, bump_version, post_tags, get_site_context
 from myblog.emails import send_new_comment_email, send_new_reply_email
 from myblog.extensions import db
+from myblog.feeds import render_feed
 from myblog.forms import CommentForm,AdminCommentForm
 from myblog.models import Post,Comment,Category
+from myblog.pagination import paginate
 from myblog.utils import redirect_back
 
 blog_bp = Blueprint('blog', __name__)
 
 @blog_bp.route('/')
+@cached_page('site', 'posts')
 def index():
-    page = request.args.get('page', 1, type=int)#从查询字符串获取页码
     per_page = current_app.config['MYBLOG_POST_PER_PAGE']#每页显示的文章数量
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=per_page)#分页对象
+    # 分页对象，默认游标分页，兼容 ?page=N
+    # 列表只显示摘要，不加载正文
+    posts = Post.query.options(joinedload(Post.category), defer(Post.body), defer(Post.plain_text))
+    pagination = paginate(posts, Post, per_page,
+                          total=lambda: db.session.query(db.func.sum(Category.post_count)).scalar() or 0)
     posts = pagination.items #当前页数的记录列表
     return render_template('blog/index.html', pagination=pagination, posts=posts)
 
 @blog_bp.route('/about')
+@cached_page('site')
 def about():
     return render_template('blog/about.html')
 
 @blog_bp.route('/category/<int:category_id>')
+@cached_page('site', 'category:{category_id}')
 def show_category(category_id):
     # 获取分类对象，如果不存在返回404
     category = Category.query.get_or_404(category_id)
-    # 分页参数设置，与首页类似
-    page = request.args.get('page', 1, type=int)
     # 每页显示的文章数量
     per_page = current_app.config['MYBLOG_POST_PER_PAGE']
-    # 使用with_parent()方法获取分类下的所有文章
-    pagination = Post.query.with_parent(category).order_by(Post.timestamp.desc()).paginate(page=page, per_page=per_page)
+    # 使用with_parent()方法获取分类下的所有文章，分页方式与首页相同
+    posts = Post.query.with_parent(category) \
+        .options(joinedload(Post.category), defer(Post.body), defer(Post.plain_text))
+    pagination = paginate(posts, Post, per_page, total=category.post_count)
     # 获取文章列表
     posts = pagination.items
     # 渲染分类页面
     return render_template('blog/category.html', pagination=pagination, posts=posts, category=category)
 
 @blog_bp.route('/post/<int:post_id>', methods=['GET', 'POST'])
+@cached_page('site', 'post:{post_id}', 'images')
 def show_post(post_id):
     # 获取文章对象，如果不存在返回404
-    post = Post.query.get_or_404(post_id)
+    post = Post.query.options(joinedload(Post.category)).get_or_404(post_id)
     
     # 评论分页
     page = request.args.get('page', 1, type=int)
     per_page = current_app.config['MYBLOG_COMMENT_PER_PAGE']
     # 注意这里改为按时间正序排序，与 bluelog 保持一致
-    pagination = Comment.query.with_parent(post).filter_by(reviewed=True).order_by(Comment.timestamp.desc()).paginate(page=page, per_page=per_page)
+    # 一次性连带加载被回复的评论，避免模板中每条回复再查询一次
+    pagination = Comment.query.with_parent(post).filter_by(reviewed=True).options(joinedload(Comment.replied)) \
+        .order_by(Comment.timestamp.desc()).paginate(page=page, per_page=per_page, count=False)
+    pagination.total = post.comment_count  # 用冗余计数代替 COUNT(*)
     comments = pagination.items
 
     # 处理评论表单
@@ -85,16 +100,22 @@ def show_post(post_id):
         
         # 处理回复评论
         replied_id = request.args.get('reply')
+        replied_comment = None
         if replied_id:
             replied_comment = Comment.query.get_or_404(replied_id)
             comment.replied = replied_comment
-            send_new_reply_email(replied_comment)
             
         # 保存评论
         db.session.add(comment)
+        if reviewed:
+            post.update_comment_count()
+            bump_version(*post_tags(post))
+            search_index.index_comment(comment)
         db.session.commit()
         
-        # 发送通知
+        # 发送通知（写入发件队列，由后台线程发送）
+        if replied_comment is not None:
+            send_new_reply_email(replied_comment)
         if current_user.is_authenticated:
             flash('评论已发布。', 'success')
         else:
@@ -105,6 +126,17 @@ def show_post(post_id):
         
     return render_template('blog/post.html', post=post, pagination=pagination, form=form, comments=comments)
     
+@blog_bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    if not q:
+        flash('Enter keyword about post or comment.', 'warning')
+        return redirect_back('blog.index')
+    page = request.args.get('page', 1, type=int)
+    per_page = current_app.config['MYBLOG_SEARCH_RESULT_PER_PAGE']
+    pagination = search_index.search(q, page=page, per_page=per_page)
+    return render_template('blog/search.html', q=q, pagination=pagination, results=pagination.items)
+
 @blog_bp.route('/reply/comment/<int:comment_id>')   
 def reply_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
@@ -114,6 +146,47 @@ def reply_comment(comment_id):
     return redirect(
         url_for('.show_post', post_id=comment.post_id, reply=comment_id, author=comment.author) + '#comment-form')
         
+@blog_bp.route('/feed.<any(atom, rss, json):format>')
+@cached_page('site', 'feed')
+def feed(format):
+    admin = get_site_context()['admin']
+    title = admin.blog_title if admin is not None else 'Blog'
+    return render_feed(format, title, url_for('.index', _external=True), Post.query, ('site', 'feed'))
+
+@blog_bp.route('/category/<int:category_id>/feed.<any(atom, rss, json):format>')
+@cached_page('site', 'feed:category:{category_id}')
+def category_feed(category_id, format):
+    category = Category.query.get_or_404(category_id)
+    admin = get_site_context()['admin']
+    title = '%s - %s' % (category.name, admin.blog_title if admin is not None else 'Blog')
+    return render_feed(format, title, url_for('.show_category', category_id=category.id, _external=True),
+                       Post.query.with_parent(category), ('site', 'feed:category:%d' % category.id))
+
+@blog_bp.route('/sitemap.xml')
+@cached_page('site', 'posts')
+def sitemap_index():
+    return sitemap.render_index()
+
+@blog_bp.route('/sitemap-pages.xml')
+@cached_page('site', 'posts')
+def sitemap_pages():
+    return sitemap.render_pages()
+
+@blog_bp.route('/sitemap-posts-<int:shard>.xml')
+@cached_page('site', 'posts')
+def sitemap_posts(shard):
+    response = sitemap.render_posts(shard)
+    if response is None:
+        abort(404)
+    return response
+
+@blog_bp.route('/robots.txt')
+def robots():
+    response = make_response('User-agent: *\nDisallow: /admin/\nDisallow: /auth/\n\nSitemap: %s\n'
+                             % url_for('.sitemap_index', _external=True))
+    response.mimetype = 'text/plain'
+    return response
+
 @blog_bp.route('/change-theme/<theme_name>')
 def change_theme(theme_name):
     if theme_name not in current_app.config['MYBLOG_THEMES'].keys():
@@ -0,0 +1,264 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+import time
+from datetime import datetime
+from functools import wraps
+from types import SimpleNamespace
+
+from flask import current_app, request, session, g, make_response, has_request_context
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from jinja2 import nodes
+from jinja2.ext import Extension
+from werkzeug.http import is_resource_modified
+
+from myblog.extensions import db, cache
+from myblog.models import Admin, Category, Link, CacheVersion
+from myblog.replication import current_replica, read_your_writes
+
+
+def _state():
+    # 版本号以数据库为准，每个 worker 在进程内保存一份，定期重新读取；
+    # 读副本的请求使用副本上的版本号，缓存的内容和它的键总是来自同一个数据库
+    states = current_app.extensions.setdefault('myblog_cache', {})
+    return states.setdefault(current_replica(), {
+        'versions': {},
+        'modified': {},
+        'loaded_at': None,
+    })
+
+
+def load_versions(force=False):
+    """Return the {tag: version} map, re-reading the stamp table at most once per interval."""
+    state = _state()
+    interval = current_app.config['MYBLOG_CACHE_VERSION_CHECK_INTERVAL']
+    now = time.monotonic()
+    in_request = has_request_context()
+    expired = now - (state['loaded_at'] or 0) >= interval and \
+        not (in_request and request.environ.get('myblog.versions_loaded'))
+    if force or state['loaded_at'] is None or expired:
+        rows = db.session.query(CacheVersion.name, CacheVersion.version, CacheVersion.timestamp).all()
+        state['versions'] = {name: version for name, version, timestamp in rows}
+        state['modified'] = {name: timestamp for name, version, timestamp in rows}
+        state['loaded_at'] = now
+        # 同一个请求内最多读取一次
+        if in_request:
+            request.environ['myblog.versions_loaded'] = True
+    return state['versions']
+
+
+def get_version(tag):
+    return load_versions().get(tag, 0)
+
+
+def last_modified(*tags):
+    """The most recent bump time among ``tags``, or None if none of them was ever bumped."""
+    load_versions()
+    stamps = [_state()['modified'].get(tag) for tag in tags]
+    return max((stamp for stamp in stamps if stamp is not None), default=None)
+
+
+def bump_version(*tags):
+    """Invalidate everything cached under ``tags``; committed with the caller's transaction."""
+    for tag in tags:
+        now = datetime.utcnow()
+        updated = CacheVersion.query.filter_by(name=tag).update(
+            {CacheVersion.version: CacheVersion.version + 1, CacheVersion.timestamp: now},
+            synchronize_session=False)
+        if not updated:
+            db.session.add(CacheVersion(name=tag, version=1, timestamp=now))
+    # 本进程的下一次读取立即重新加载版本号，其他 worker 在检查间隔后感知
+    for state in current_app.extensions.get('myblog_cache', {}).values():
+        state['loaded_at'] = None
+
+
+def post_tags(post):
+    """Tags of the pages that show ``post``: its own page, the index and its category listing."""
+    return ('posts', 'post:%d' % post.id, 'category:%d' % post.category_id)
+
+
+def _snapshot(obj):
+    return SimpleNamespace(**{column.key: getattr(obj, column.key) for column in obj.__table__.columns})
+
+
+def _build_site_context():
+    admin = Admin.query.first()
+    return {
+        'admin': _snapshot(admin) if admin is not None else None,
+        'categories': [_snapshot(category) for category in Category.query.order_by(Category.id).all()],
+        'links': [_snapshot(link) for link in Link.query.order_by(Link.id).all()],
+    }
+
+
+def get_site_context():
+    """Admin profile, categories and links shared by every page, rebuilt only when 'site' changes."""
+    cached = cache.get_or_set('site', 'context:%d' % get_version('site'), _build_site_context)
+    return dict(cached)
+
+
+CSRF_PLACEHOLDER = '__myblog_csrf_token__'
+
+
+def _csrf_token():
+    # Flask-WTF 把本次请求生成的令牌保存在 g 中
+    return g.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+
+
+def _page_versioned():
+    # 访客看到的页面只取决于标签版本号和地址，可以用版本号做 ETag；
+    # 刚写入过的访客读主库，绕过缓存才能看到自己的修改
+    return (request.method == 'GET' and not current_user.is_authenticated and '_flashes' not in session
+            and not read_your_writes())
+
+
+def _set_validators(response, etag, modified):
+    response.set_etag(etag, weak=True)
+    if modified is not None:
+        response.last_modified = modified
+    # 允许浏览器缓存，但每次使用前都要带上验证器重新确认
+    response.cache_control.no_cache = True
+    return response
+
+
+def cached_page(*tags):
+    """Cache the rendered response for anonymous readers.
+
+    ``tags`` are formatted with the view arguments, e.g. ``'post:{post_id}'``; the cached
+    page is discarded as soon as any of their versions is bumped. The same versions form
+    the page's ETag, so revalidating clients get a 304 without the view running at all,
+    also when the page cache is off (MYBLOG_PAGE_CACHE_SIZE = 0). Pages are kept in the
+    'pages' namespace of the cache, shared by the workers when MYBLOG_CACHE_URL is a
+    shared backend.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(**kwargs):
+            if not _page_versioned():
+                cache.count('pages', 'bypass')
+                request.environ['myblog.cache'] = 'bypass'
+                return f(**kwargs)
+
+            versions = {tag.format(**kwargs): get_version(tag.format(**kwargs)) for tag in tags}
+            key = (request.full_path, request.cookies.get('theme'))
+            etag = hashlib.md5(repr((sorted(versions.items()), key)).encode('utf-8')).hexdigest()
+            modified = last_modified(*versions)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=modified):
+                cache.count('pages', 'not_modified')
+                request.environ['myblog.cache'] = 'not_modified'
+                return _set_validators(make_response('', 304), etag, modified)
+
+            if current_app.config['MYBLOG_PAGE_CACHE_SIZE'] <= 0:
+                cache.count('pages', 'bypass')
+                request.environ['myblog.cache'] = 'bypass'
+                response = make_response(f(**kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    _set_validators(response, etag, modified)
+                return response
+
+            rendered = []
+
+            def render():
+                response = make_response(f(**kwargs))
+                rendered.append(response)
+                if response.status_code != 200 or response.direct_passthrough:
+                    return None
+                body = response.get_data(as_text=True)
+                # 表单中的 CSRF 令牌与会话绑定，缓存占位符，命中时为每个访客重新生成
+                token = _csrf_token()
+                if token:
+                    body = body.replace(token, CSRF_PLACEHOLDER)
+                return {'body': body, 'mimetype': response.mimetype, 'csrf': bool(token)}
+
+            # ETag 由版本号和地址算出，直接作为缓存键，版本号变化后旧条目不再被读到
+            entry = cache.get_or_set('pages', etag, render)
+            if rendered:
+                request.environ['myblog.cache'] = 'miss'
+                response = rendered[0]
+                response.headers['X-Cache'] = 'MISS'
+                if response.status_code == 200:
+                    _set_validators(response, etag, modified)
+                return response
+
+            request.environ['myblog.cache'] = 'hit'
+            body = entry['body']
+            if entry['csrf']:
+                body = body.replace(CSRF_PLACEHOLDER, generate_csrf())
+            response = make_response(body)
+            response.mimetype = entry['mimetype']
+            response.headers['X-Cache'] = 'HIT'
+            return _set_validators(response, etag, modified)
+        return decorated_function
+    return decorator
+
+
+def page_cache_stats():
+    return cache.stats('pages', sizes=True)
+
+
+def cached_fragment(key, tags, ttl, render):
+    """Return the output of ``render()``, cached under ``key`` until one of ``tags`` is bumped.
+
+    ``ttl`` additionally limits the age of the fragment in seconds (None for the cache's
+    default). CSRF tokens in the fragment are replaced for each request, as in cached_page.
+    """
+    if current_app.config['MYBLOG_FRAGMENT_CACHE_SIZE'] <= 0:
+        return render()
+    versions = sorted((tag, get_version(tag)) for tag in tags)
+
+    def render_fragment():
+        body = render()
+        token = _csrf_token()
+        csrf = bool(token) and token in body
+        return {'body': body.replace(token, CSRF_PLACEHOLDER) if csrf else body, 'csrf': csrf}
+
+    entry = cache.get_or_set('fragments', (key, versions), render_fragment, ttl)
+    if entry['csrf']:
+        # 未命中时 generate_csrf 返回的也是本次请求中已生成的令牌
+        return entry['body'].replace(CSRF_PLACEHOLDER, generate_csrf())
+    return entry['body']
+
+
+class FragmentCacheExtension(Extension):
+    """The ``{% cache %}`` template tag, caching a block of a template with cached_fragment.
+
+    ``{% cache 'comments', post.id, page, tags=['site', 'post:%d' % post.id], ttl=600 %}
+    ... {% endcache %}``: the positional arguments, together with the template and line,
+    form the key, so they must include everything the block depends on that differs
+    between requests (page number, whether the admin is logged in, ...); the block is
+    rendered again when one of the version tags is bumped or after ``ttl`` seconds.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [nodes.Const('%s:%d' % (parser.name, lineno))]
+        options = {'tags': nodes.List([]), 'ttl': nodes.Const(None)}
+        first = True
+        while parser.stream.current.type != 'block_end':
+            if not first:
+                parser.stream.expect('comma')
+            first = False
+            if parser.stream.current.type == 'name' and parser.stream.look().test('assign'):
+                option = next(parser.stream)
+                if option.value not in options:
+                    parser.fail("Unknown option '%s' of the cache tag." % option.value, option.lineno)
+                next(parser.stream)
+                options[option.value] = parser.parse_expression()
+            else:
+                key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render', [nodes.Tuple(key, 'load'), options['tags'], options['ttl']])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    @staticmethod
+    def _render(key, tags, ttl, caller):
+        return cached_fragment(key, tuple(tags), ttl, caller)
+
+
+def fragment_cache_stats():
+    return cache.stats('fragments', sizes=True)
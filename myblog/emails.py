@@ -4,29 +4,194 @@
     :copyright: ©2025 Cheung Jan <CheungJan@live.com>
     :license: MIT, see LICENSE for more details.
 """
-from threading import Thread
-from flask import url_for,current_app
+import os
+import smtplib
+import socket
+import time
+from datetime import datetime, timedelta
+from threading import Thread, Event
+
+from flask import url_for, current_app
 from flask_mail import Message
-from myblog.extensions import mail
 
-def _send_async_mail(app,message):
-    with app.app_context():
-        mail.send(message)
+from myblog.extensions import db, mail
+from myblog.models import OutgoingMail
+
+
+class MailDispatcher(object):
+    """One background sender per worker process, draining the ``outgoing_mail`` table.
+
+    Messages are claimed with a lease before sending, so several gunicorn workers can
+    poll the same outbox, and anything left behind by a dead worker is picked up again
+    once its lease expires. The SMTP connection is kept open between messages and only
+    closed after MYBLOG_MAIL_IDLE_TIMEOUT seconds without work.
+
+    gunicorn workers start it as soon as they boot (see ``startup.after_fork``), so
+    messages queued before a restart are sent without waiting for a new one.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wakeup = Event()
+        self.thread = None
+        self.pid = None
+        self.connection = None
+        self.last_used = 0
+
+    @property
+    def worker_id(self):
+        return '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def start(self):
+        # fork 出来的 worker 不会继承线程，需要按进程重新启动
+        if self.pid != os.getpid() or self.thread is None or not self.thread.is_alive():
+            self.pid = os.getpid()
+            self.connection = None
+            self.thread = Thread(target=self.run, name='myblog-mail', daemon=True)
+            self.thread.start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.app.config['MYBLOG_MAIL_POLL_INTERVAL'])
+            self.wakeup.clear()
+            with self.app.app_context():
+                try:
+                    while self.dispatch():
+                        pass
+                except Exception:
+                    self.app.logger.exception('Mail dispatch failed')
+                if self.connection is not None and \
+                        time.monotonic() - self.last_used > self.app.config['MYBLOG_MAIL_IDLE_TIMEOUT']:
+                    self.close()
+
+    def dispatch(self):
+        """Send one batch of due messages. Returns the number of messages processed."""
+        config = self.app.config
+        now = datetime.utcnow()
+        lease_expired = now - timedelta(seconds=config['MYBLOG_MAIL_LEASE'])
+        claimable = db.or_(OutgoingMail.claimed_at == None, OutgoingMail.claimed_at < lease_expired)
+        due = OutgoingMail.query.filter(OutgoingMail.sent == False, OutgoingMail.send_after <= now, claimable) \
+            .order_by(OutgoingMail.send_after).limit(config['MYBLOG_MAIL_BATCH_SIZE']).all()
+        processed = 0
+        for outgoing in due:
+            claimed = OutgoingMail.query.filter(OutgoingMail.id == outgoing.id, OutgoingMail.sent == False,
+                                                claimable) \
+                .update({'claimed_by': self.worker_id, 'claimed_at': now}, synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                continue
+            db.session.refresh(outgoing)
+            try:
+                self.send(Message(outgoing.subject, recipients=[outgoing.recipient], html=outgoing.html))
+            except Exception as e:
+                outgoing.attempts += 1
+                outgoing.last_error = repr(e)
+                if outgoing.attempts >= config['MYBLOG_MAIL_MAX_ATTEMPTS']:
+                    # 放弃重试，保留记录以便排查
+                    outgoing.sent = True
+                    self.app.logger.error('Giving up mail %d to %s: %r' % (outgoing.id, outgoing.recipient, e))
+                else:
+                    backoff = min(config['MYBLOG_MAIL_RETRY_BACKOFF'] * 2 ** (outgoing.attempts - 1),
+                                  config['MYBLOG_MAIL_RETRY_BACKOFF_MAX'])
+                    outgoing.send_after = datetime.utcnow() + timedelta(seconds=backoff)
+            else:
+                outgoing.sent = True
+                outgoing.sent_at = datetime.utcnow()
+            outgoing.claimed_by = outgoing.claimed_at = None
+            db.session.commit()
+            processed += 1
+        return processed
+
+    def send(self, message):
+        if self.connection is None:
+            self.connection = mail.connect().__enter__()
+        try:
+            self.connection.send(message)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError):
+            # 长连接被服务器关闭，重连一次
+            self.connection = mail.connect().__enter__()
+            self.connection.send(message)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.connection = None
+
+
+def get_dispatcher(app=None):
+    app = app or current_app._get_current_object()
+    if 'myblog_mail' not in app.extensions:
+        app.extensions['myblog_mail'] = MailDispatcher(app)
+    return app.extensions['myblog_mail']
+
+
+def send_mail(subject, to, html, coalesce_key=None, digest=None):
+    """Queue a message in the outbox; the dispatcher sends it outside of the request.
+
+    Messages with the same ``to`` and ``coalesce_key`` that are still waiting are merged:
+    ``digest(count)`` returns the ``(subject, html)`` of the combined message, which is held
+    back for MYBLOG_MAIL_DIGEST_WINDOW seconds to collect more notifications. Returns the
+    id of the outbox row.
+    """
+    if not to:
+        return None
+    now = datetime.utcnow()
+    outgoing_id = None
+    if coalesce_key is not None:
+        waiting = db.session.query(OutgoingMail.id, OutgoingMail.count).filter_by(
+            recipient=to, coalesce_key=coalesce_key, sent=False, claimed_at=None).first()
+        if waiting is not None:
+            digest_subject, digest_html = digest(waiting.count + 1)
+            # 条件更新：这期间 dispatcher 可能已经认领了这封邮件，或者另一个请求已经合并过，
+            # 这时不再改它，另起一封
+            merged = OutgoingMail.query.filter(
+                OutgoingMail.id == waiting.id, OutgoingMail.claimed_at == None, OutgoingMail.sent == False,
+                OutgoingMail.count == waiting.count) \
+                .update({'count': waiting.count + 1, 'subject': digest_subject, 'html': digest_html},
+                        synchronize_session=False)
+            if merged:
+                outgoing_id = waiting.id
+    if outgoing_id is None:
+        send_after = now
+        if coalesce_key is not None:
+            send_after += timedelta(seconds=current_app.config['MYBLOG_MAIL_DIGEST_WINDOW'])
+        outgoing = OutgoingMail(recipient=to, subject=subject, html=html, coalesce_key=coalesce_key,
+                                timestamp=now, send_after=send_after)
+        db.session.add(outgoing)
+        db.session.flush()
+        outgoing_id = outgoing.id
+    db.session.commit()
+
+    if current_app.config['MYBLOG_MAIL_QUEUE_THREAD']:
+        dispatcher = get_dispatcher()
+        dispatcher.start()
+        if coalesce_key is None:
+            dispatcher.notify()
+    return outgoing_id
 
-def send_mail(subject,to,html):
-    # 直接使用 current_app
-    message = Message(subject,recipients=[to],html=html)
-    thr = Thread(target=_send_async_mail,args=(current_app._get_current_object(),message))
-    thr.start()
-    return thr
 
 def send_new_comment_email(post):
-    post_url = url_for('blog.show_post',post_id=post.id,external=True) + '#comments'
+    post_url = url_for('blog.show_post',post_id=post.id,_external=True) + '#comments'
+
+    def digest(count):
+        return ('%d new comments' % count,
+                '<p>%d new comments on post <i>%s</i>,click the link below to check:</p>'
+                '<p><a href="%s">%s</a></p>'
+                '<p><small style="color: #868e96">Do not reply this email.</small></p>'
+                % (count, post.title, post_url, post_url))
+
     send_mail(subject='New comment',to=current_app.config['MYBLOG_EMAIL'],
               html='<p>New comment on post <i>%s</i>,click the link below to check:</p>'
               '<p><a href="%s">%s</a></p>'
               '<p><small style="color: #868e96">Do not reply this email.</small></p>'
-              % (post.title, post_url, post_url))
+              % (post.title, post_url, post_url),
+              coalesce_key='comment:%d' % post.id, digest=digest)
 
 def send_new_reply_email(comment):
     post_url = url_for('blog.show_post',post_id=comment.post_id,_external=True) + '#comments'
@@ -35,6 +200,3 @@ def send_new_reply_email(comment):
               '<p><a href="%s">%s</a></p>'
               '<p><small style="color: #868e96">Do not reply this email.</small></p>'
               % (comment.post.title, post_url, post_url))
-              
-    
-    
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+
+from flask import current_app, url_for
+
+from myblog.assets import fingerprint
+from myblog.caching import load_versions
+from myblog.extensions import db
+from myblog.feeds import MIMETYPES as FEED_MIMETYPES
+from myblog.sitemap import post_shards
+from myblog.models import Post, Category
+
+MANIFEST = '.myblog-export.json'
+
+# 子进程中用于渲染的应用实例
+_app = None
+
+
+def dynamic_url_for(endpoint, **values):
+    """``url_for`` for pages that must be served by the Flask app, even from an exported page."""
+    url = url_for(endpoint, **values)
+    if current_app.config['MYBLOG_STATIC_EXPORT']:
+        return current_app.config['MYBLOG_EXPORT_APP_URL'].rstrip('/') + url
+    return url
+
+
+def page_file(path, page=1):
+    """Output file of the page at ``path``: ``/post/3?page=2`` is written to ``post/3/page/2.html``."""
+    path = path.strip('/')
+    if '.' in path.rsplit('/', 1)[-1]:
+        return path  # 订阅源等带扩展名的地址原样保存
+    if page > 1:
+        return '%s/page/%d.html' % (path, page) if path else 'page/%d.html' % page
+    return '%s.html' % path if path else 'index.html'
+
+
+def _page_count(total, per_page):
+    return max((total + per_page - 1) // per_page, 1)
+
+
+def site_pages():
+    """Yield ``(url, file, tags)`` for every public page, reading the tables in id order."""
+    config = current_app.config
+    per_page = config['MYBLOG_POST_PER_PAGE']
+    comment_per_page = config['MYBLOG_COMMENT_PER_PAGE']
+
+    total = db.session.query(db.func.sum(Category.post_count)).scalar() or 0
+    for page in range(1, _page_count(total, per_page) + 1):
+        yield _page('blog.index', {}, page, ('site', 'posts'))
+    yield _page('blog.about', {}, 1, ('site',))
+    for format in FEED_MIMETYPES:
+        yield _page('blog.feed', dict(format=format), 1, ('site', 'feed'))
+    yield _page('blog.robots', {}, 1, ())
+    yield _page('blog.sitemap_index', {}, 1, ('site', 'posts'))
+    yield _page('blog.sitemap_pages', {}, 1, ('site', 'posts'))
+    for shard, timestamp in post_shards():
+        yield _page('blog.sitemap_posts', dict(shard=shard), 1, ('site', 'posts'))
+    for id, post_count in db.session.query(Category.id, Category.post_count).order_by(Category.id):
+        for page in range(1, _page_count(post_count, per_page) + 1):
+            yield _page('blog.show_category', dict(category_id=id), page, ('site', 'category:%d' % id))
+        for format in FEED_MIMETYPES:
+            yield _page('blog.category_feed', dict(category_id=id, format=format), 1,
+                        ('site', 'feed:category:%d' % id))
+    posts = db.session.query(Post.id, Post.comment_count).order_by(Post.id).yield_per(1000)
+    for id, comment_count in posts:
+        for page in range(1, _page_count(comment_count, comment_per_page) + 1):
+            yield _page('blog.show_post', dict(post_id=id), page, ('site', 'post:%d' % id, 'images'))
+
+
+def _page(endpoint, values, page, tags):
+    path = url_for(endpoint, **values)
+    url = url_for(endpoint, page=page, **values) if page > 1 else path
+    return url, page_file(path, page), tags
+
+
+def _build_fingerprint(app):
+    """Changes whenever a template or a static file changes, forcing a full re-render."""
+    digest = hashlib.md5()
+    for root in (app.template_folder and os.path.join(app.root_path, app.template_folder), app.static_folder):
+        for directory, dirnames, filenames in sorted(os.walk(root)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                digest.update(('%s:%s\n' % (os.path.relpath(path, root), fingerprint(path))).encode('utf-8'))
+    digest.update(repr(sorted((key, repr(value)) for key, value in app.config.items()
+                              if key.startswith('MYBLOG_EXPORT'))).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _prepare(app):
+    # 导出的页面使用 ?page=N 分页（由 _redirects 改写到静态文件），不经过整页和片段缓存
+    app.config.update(MYBLOG_STATIC_EXPORT=True, MYBLOG_KEYSET_PAGINATION=False, MYBLOG_PAGE_CACHE_SIZE=0,
+                      MYBLOG_FRAGMENT_CACHE_SIZE=0)
+    return app
+
+
+def _init_worker(config_name):
+    global _app
+    if _app is None:
+        # spawn 方式启动的子进程需要重新创建应用
+        from myblog import create_app
+        _app = _prepare(create_app(config_name))
+    with _app.app_context():
+        # fork 继承的连接属于父进程，子进程使用自己的连接
+        db.engine.dispose(close=False)
+
+
+def _render_pages(output, pages):
+    client = _app.test_client()
+    # 订阅源中的绝对地址使用站点的公开地址
+    base_url = _app.config['MYBLOG_EXPORT_SITE_URL']
+    for url, filename in pages:
+        response = client.get(url, base_url=base_url)
+        if response.status_code != 200:
+            raise RuntimeError('%s returned %d' % (url, response.status_code))
+        _write(os.path.join(output, filename), response.get_data())
+    return len(pages)
+
+
+def _render_chunk(args):
+    return _render_pages(*args)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def _copy_tree(source, target):
+    """Copy files that are new or changed (by size and mtime); returns the number copied."""
+    copied = 0
+    if not os.path.isdir(source):
+        return copied
+    for directory, dirnames, filenames in os.walk(source):
+        for filename in filenames:
+            if filename.endswith('.part'):
+                continue
+            path = os.path.join(directory, filename)
+            destination = os.path.join(target, os.path.relpath(path, source))
+            stat = os.stat(path)
+            try:
+                existing = os.stat(destination)
+                if existing.st_size == stat.st_size and existing.st_mtime_ns == stat.st_mtime_ns:
+                    continue
+            except OSError:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copy2(path, destination)
+            copied += 1
+    return copied
+
+
+def _redirects():
+    """Rules in Netlify's ``_redirects`` format for paginated pages and the dynamic routes."""
+    lines = [
+        '# Generated by flask export',
+        '/                page=:page  /page/:page                200',
+        '/category/:id    page=:page  /category/:id/page/:page   200',
+        '/post/:id        page=:page  /post/:id/page/:page       200',
+    ]
+    app_url = current_app.config['MYBLOG_EXPORT_APP_URL'].rstrip('/')
+    if app_url:
+        # 写操作、后台和搜索交给 Flask 应用；已导出的上传文件优先由 CDN 提供
+        for prefix in ('/admin/*', '/auth/*', '/reply/*'):
+            lines.append('%-30s %s%s:splat  200' % (prefix, app_url, prefix[:-1]))
+        lines.append('%-30s %s/search  200' % ('/search', app_url))
+    return '\n'.join(lines) + '\n'
+
+
+def export_site(app, output, jobs=1, full=False):
+    """Render the public site to ``output``, re-rendering only pages whose cache tags changed.
+
+    Each page is recorded in a manifest with the versions of its cache tags (the same
+    tags that invalidate the page cache), so a later export only re-renders pages that
+    were affected by a write, plus every page when a template or static file changed.
+    Returns ``(rendered, total, removed)``.
+    """
+    manifest_path = os.path.join(output, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    build = _build_fingerprint(app)
+    if manifest.get('build') != build:
+        full = True
+    previous = manifest.get('pages', {})
+
+    _prepare(app)
+    with app.test_request_context():
+        versions = load_versions(force=True)
+        pages = {}
+        stale = []
+        for url, filename, tags in site_pages():
+            page_versions = {tag: versions.get(tag, 0) for tag in tags}
+            pages[url] = {'file': filename, 'versions': page_versions}
+            entry = previous.get(url)
+            if full or entry is None or entry['versions'] != page_versions or \
+                    not os.path.exists(os.path.join(output, filename)):
+                stale.append((url, filename))
+        _write(os.path.join(output, '_redirects'), _redirects().encode('utf-8'))
+        _copy_tree(app.static_folder, os.path.join(output, app.static_url_path.strip('/')))
+        upload_url = url_for('admin.get_image', filename='x')[:-1].strip('/')
+        _copy_tree(app.config['MYBLOG_UPLOAD_PATH'], os.path.join(output, upload_url))
+
+    global _app
+    _app = app
+    if jobs > 1 and len(stale) > 1:
+        chunk_size = max(min(len(stale) // (jobs * 4), 100), 1)
+        chunks = [(output, stale[i:i + chunk_size]) for i in range(0, len(stale), chunk_size)]
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        if method == 'spawn':
+            _app = None
+        context = multiprocessing.get_context(method)
+        with context.Pool(jobs, initializer=_init_worker, initargs=(os.getenv('FLASK_CONFIG', 'development'),)) as pool:
+            for _ in pool.imap_unordered(_render_chunk, chunks):
+                pass
+    elif stale:
+        _render_pages(output, stale)
+
+    # 删除已经不存在的页面（删除的文章、变少的分页）
+    removed = 0
+    for url, entry in previous.items():
+        if url not in pages:
+            path = os.path.join(output, entry['file'])
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+    _write(manifest_path, json.dumps({'build': build, 'pages': pages}, indent=1, sort_keys=True).encode('utf-8'))
+    return len(stale), len(pages), removed
@@ -4,26 +4,32 @@
     :copyright: © 2025 Cheung Jan <CheungJan@live.com>
     :license: MIT, see LICENSE for more details.
 """
+import os
+import sys
+
+import click
+from flask import Blueprint, current_app
 from flask_bootstrap import Bootstrap  # Flask-Bootstrap 3.3.7.1
-from flask_ckeditor import CKEditor     
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
-from flask_debugtoolbar import DebugToolbarExtension
-from flask_migrate import Migrate
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from myblog.replication import RoutingSession, replica_keys
+from myblog.sharedcache import Cache
 
 # 初始化扩展
 bootstrap = Bootstrap()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 csrf = CSRFProtect()
-ckeditor = CKEditor()
 mail = Mail()
 moment = Moment()
-migrate = Migrate()
-toolbar = DebugToolbarExtension()
+cache = Cache()
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -34,3 +40,145 @@ def load_user(user_id):
 login_manager.login_view = 'auth.login'
 # login_manager.login_message = 'Your custom message'
 login_manager.login_message_category = 'warning'
+
+
+def worker_class(config):
+    """The gunicorn worker class the pools are sized for: 'sync', 'gthread' or 'gevent'."""
+    name = config['MYBLOG_WORKER_CLASS']
+    if name is None:
+        monkey = sys.modules.get('gevent.monkey')
+        name = 'gevent' if monkey is not None and monkey.is_module_patched('socket') else 'sync'
+    # 也接受 gunicorn.workers.ggevent.GeventWorker 这样的完整类名
+    name = name.lower()
+    if 'gevent' in name or 'eventlet' in name:
+        return 'gevent'
+    if 'thread' in name:
+        return 'gthread'
+    return name
+
+
+def engine_options(config, url=None):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database (or ``url``), sized for the worker class.
+
+    SQLite files get a real connection pool (SQLAlchemy 1.4 opens a new connection per
+    checkout by default), so the per-connection page cache and memory map survive
+    between requests; in-memory databases keep Flask-SQLAlchemy's defaults. Server
+    databases are pre-pinged, and MySQL connections are recycled before the server
+    drops them.
+    """
+    url = make_url(url or config['SQLALCHEMY_DATABASE_URI'])
+    pool_sizes = config['MYBLOG_DB_POOL_SIZES']
+    pool_size, max_overflow = pool_sizes.get(worker_class(config), pool_sizes['sync'])
+    options = dict(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=config['MYBLOG_DB_POOL_TIMEOUT'])
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return {}
+        # 连接会在线程（或 greenlet）之间复用
+        options.update(poolclass=QueuePool, connect_args={'check_same_thread': False})
+        return options
+    options['pool_pre_ping'] = True
+    if url.get_backend_name() == 'mysql':
+        options['pool_recycle'] = config['MYBLOG_DB_POOL_RECYCLE']
+    return options
+
+
+def set_sqlite_pragmas(engine, pragmas):
+    """Run ``PRAGMA name = value`` for each of ``pragmas`` on every new connection of ``engine``."""
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+    event.listen(engine, 'connect', connect)
+
+
+def init_db(app):
+    explicit = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    options = engine_options(app.config)
+    # 配置中显式给出的引擎参数优先
+    options.update(explicit)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    # 只读副本作为额外的绑定，由 RoutingSession 按请求选用（见 myblog.replication）
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    for key, url in zip(replica_keys(app), app.config['MYBLOG_REPLICA_URLS']):
+        binds.setdefault(key, dict(engine_options(app.config, url), **explicit, url=url))
+    db.init_app(app)
+    with app.app_context():
+        for key, engine in db.engines.items():
+            if engine.dialect.name == 'sqlite' and make_url(engine.url).database not in (None, '', ':memory:'):
+                pragmas = app.config['MYBLOG_SQLITE_PRAGMAS']
+                if key in binds:
+                    # 副本由复制写入，应用的连接只读
+                    pragmas = dict(pragmas, query_only='ON')
+                set_sqlite_pragmas(engine, pragmas)
+
+
+
+class LazyCKEditor(object):
+    """Stand-in for flask_ckeditor's ``CKEditor`` that imports the package on first use.
+
+    Only the admin editor pages call ``ckeditor.config()``, so the public pages never
+    import flask_ckeditor. The blueprint and the template global are still registered
+    at startup, as Flask does not allow it after the first request; the CKEDITOR_*
+    defaults are in BaseConfig.
+    """
+
+    def init_app(self, app):
+        # 按包名创建蓝图只查找 flask_ckeditor 的目录，不会导入它
+        app.register_blueprint(Blueprint('ckeditor', 'flask_ckeditor', static_folder='static',
+                                         static_url_path='/ckeditor' + app.static_url_path))
+        app.extensions['ckeditor'] = self
+        app.context_processor(self.context_processor)
+
+    @staticmethod
+    def context_processor():
+        return {'ckeditor': current_app.extensions['ckeditor']}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        from flask_ckeditor import _CKEditor
+        return getattr(_CKEditor, name)
+
+
+def init_ckeditor(app):
+    if app.config['MYBLOG_LAZY_EXTENSIONS']:
+        LazyCKEditor().init_app(app)
+    else:
+        from flask_ckeditor import CKEditor
+        CKEditor(app)
+
+
+def init_migrate(app):
+    """Set up Flask-Migrate for the ``flask db`` commands.
+
+    With MYBLOG_LAZY_EXTENSIONS only apps created by the flask command get it: importing
+    Flask-Migrate imports Alembic, the largest part of the startup time, and web
+    processes never run migrations.
+    """
+    if app.config['MYBLOG_LAZY_EXTENSIONS'] and click.get_current_context(silent=True) is None:
+        return
+    from flask_migrate import Migrate
+    # 不依赖当前目录，create_schema() 在任何目录下运行 flask forge 时都能找到迁移脚本
+    Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations'))
+
+
+def create_schema():
+    """``db.create_all()``, recording a new database as being at the newest migration.
+
+    Otherwise ``flask db upgrade`` would run every migration again on tables that
+    already have their changes. A database that already had tables is not stamped:
+    create_all() does not alter existing tables, so it still needs ``flask db upgrade``.
+    """
+    fresh = not inspect(db.engine).has_table('post')
+    db.create_all()
+    if fresh and 'migrate' in current_app.extensions:
+        from flask_migrate import stamp
+        stamp()
+
+
+def init_debug_toolbar(app):
+    if app.config['MYBLOG_DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
@@ -4,16 +4,178 @@
     :copyright: ©2025 Cheung Jan <CheungJan@live.com>
     :license: MIT, see LICENSE for more details.
 """
+import multiprocessing
 import random
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
 
 from faker import Faker
-from sqlalchemy.exc import IntegrityError
 
+from myblog.caching import bump_version
+from myblog.extensions import create_schema
 from myblog.models import db
-from myblog.models import Admin,Category,Post,Comment,Link
+from myblog.models import Admin,Category,Post,Comment,Link,rebuild_counters,post_text
 
 fake = Faker()
 
+# 每批生成并插入的行数；每批的随机数种子由总种子和批号决定，与进程数无关
+BATCH_SIZE = 10000
+# 从 Faker 取的姓名、邮箱、网址和词汇数量，行内容从中随机组合（逐行调用 Faker 太慢）
+POOL_SIZE = 500
+VOCABULARY_SIZE = 1000
+
+# 设置了种子时时间戳落在这个日期之前的一年内，同样的参数在任何一天生成的数据都相同
+SEEDED_END = datetime(2025, 1, 1)
+
+_state = {'seed': None}
+
+
+def seed_fakes(seed):
+    """Make the following fake_* calls deterministic (None for fresh random data)."""
+    _state['seed'] = seed
+    random.seed(seed)
+    fake.seed_instance(seed)
+
+
+def _seed():
+    if _state['seed'] is None:
+        _state['seed'] = random.randrange(2 ** 32)
+    return _state['seed']
+
+
+def _window():
+    end = SEEDED_END if _state['seed'] is not None else datetime.utcnow().replace(microsecond=0)
+    return end - timedelta(days=365), 365 * 24 * 3600
+
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+@lru_cache(maxsize=4)
+def _pools(seed):
+    """Words, names, emails and sites to draw from; depends only on the seed, so each process builds it once."""
+    faker = Faker()
+    faker.seed_instance(seed)
+    return (faker.words(VOCABULARY_SIZE), [faker.name() for i in range(POOL_SIZE)],
+            [faker.email() for i in range(POOL_SIZE)], [faker.url() for i in range(POOL_SIZE)])
+
+
+class _Text(object):
+    """Fast fake text: sentences are drawn from a fixed vocabulary instead of calling Faker."""
+
+    def __init__(self, rng, words):
+        self.rng = rng
+        self.words = words
+
+    def sentence(self, low=6, high=14):
+        words = self.rng.choices(self.words, k=self.rng.randint(low, high))
+        return ' '.join(words).capitalize() + '.'
+
+    def paragraph(self, sentences):
+        return ' '.join(self.sentence() for i in range(sentences))
+
+    def text(self, length):
+        paragraphs = []
+        size = 0
+        while size < length:
+            paragraphs.append(self.paragraph(self.rng.randint(3, 6)))
+            size += len(paragraphs[-1])
+        return '\n'.join(paragraphs)
+
+
+def _batch_random(seed, table, index):
+    return random.Random('%s:%s:%d' % (seed, table, index))
+
+
+def _post_batch(args):
+    seed, index, start, count, category_count, window = args
+    rng = _batch_random(seed, 'post', index)
+    text = _Text(rng, _pools(seed)[0])
+    begin, seconds = window
+    rows = []
+    for id in range(start, start + count):
+        body = text.text(2000)
+        plain_text, excerpt, word_count = post_text(body)
+        rows.append(dict(
+            id=id, title=text.sentence(3, 8)[:60], body=body, plain_text=plain_text, excerpt=excerpt,
+            word_count=word_count, timestamp=begin + timedelta(seconds=rng.randrange(seconds)),
+            can_comment=True, comment_count=0, category_id=rng.randint(1, category_count),
+        ))
+    return rows
+
+
+def _comment_batch(args):
+    seed, index, start, count, kind, post_range, replied_range, window = args
+    rng = _batch_random(seed, 'comment-%s' % kind, index)
+    words, authors, emails, sites = _pools(seed)
+    text = _Text(rng, words)
+    begin, seconds = window
+    rows = []
+    for id in range(start, start + count):
+        row = dict(
+            id=id, author=rng.choice(authors), email=rng.choice(emails), site=rng.choice(sites),
+            body=text.sentence(), from_admin=False, reviewed=kind != 'unreviewed',
+            timestamp=begin + timedelta(seconds=rng.randrange(seconds)), replied_id=None,
+            post_id=rng.randint(*post_range),
+        )
+        if kind == 'admin':
+            row.update(author='Mima Kirigoe', email='mima@example.com', site='example.com', from_admin=True)
+        elif kind == 'reply':
+            row['replied_id'] = rng.randint(*replied_range)
+        rows.append(row)
+    return rows
+
+
+def _bulk_insert(model, batches, jobs=1, generate=None):
+    """Generate the rows of ``batches`` (optionally in ``jobs`` processes) and insert them in order.
+
+    Each batch is inserted with one executemany in its own transaction, so memory use is
+    bounded by a few batches and a failure keeps the rows inserted so far.
+    """
+    if jobs > 1 and len(batches) > 1:
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        with multiprocessing.get_context(method).Pool(jobs) as pool:
+            for rows in pool.imap(generate, batches):
+                _insert_rows(model, rows)
+    else:
+        for batch in batches:
+            _insert_rows(model, generate(batch))
+
+
+def _insert_rows(model, rows):
+    if rows:
+        db.session.execute(model.__table__.insert(), rows)
+        db.session.commit()
+
+
+@contextmanager
+def _indexes_deferred(*models):
+    """Drop the secondary indexes of ``models`` during a bulk load and build them once at the end.
+
+    Building an index over sorted data is much cheaper than updating it for every row
+    inserted in random key order (about twice as fast for the comment table).
+    """
+    indexes = [index for model in models for index in model.__table__.indexes]
+    connection = db.session.connection()
+    for index in indexes:
+        index.drop(connection)
+    db.session.commit()
+    try:
+        yield
+    finally:
+        connection = db.session.connection()
+        for index in indexes:
+            index.create(connection)
+        db.session.commit()
+
+
+def _batches(start, count):
+    for index, offset in enumerate(range(0, count, BATCH_SIZE)):
+        yield index, start + offset, min(BATCH_SIZE, count - offset)
+
+
 def fake_admin():
     admin = Admin(
         username='admin',
@@ -27,83 +189,43 @@ def fake_admin():
     db.session.commit()
 
 def fake_categories(count=10):
-    category = Category(name='Default')
-    db.session.add(category)
-
-    for i in range(count):
-        category = Category(name=fake.word())
-        db.session.add(category)
-        try:
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
-
-def fake_posts(count=50):
-    for i in range(count):
-        post = Post(
-            title=fake.sentence(),
-            body=fake.text(2000),
-            category=Category.query.get(random.randint(1, Category.query.count())),
-            timestamp=fake.date_time_this_year()
-        )
-        db.session.add(post)
-    db.session.commit()
+    names = {name for name, in db.session.query(Category.name)}
+    rows = []
+    for name in ['Default'] + [fake.word() for i in range(count)]:
+        if name in names:
+            if name == 'Default':
+                continue
+            # 词汇重复时加上序号，保证名称唯一且数量准确
+            name = '%s-%d' % (name, len(names))
+        names.add(name)
+        rows.append(dict(name=name, post_count=0))
+    _insert_rows(Category, rows)
 
-def fake_comments(count=500):
-    for i in range(count):
-        comment = Comment(
-            author=fake.name(),
-            email=fake.email(),
-            site=fake.url(),
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            reviewed=True,
-            post=Post.query.get(random.randint(1, Post.query.count())),
-        )
-        db.session.add(comment)
-    
-    salt = int(count * 0.1)
-    for i in range(salt):
-        #unreversed comments
-        comment = Comment(
-            author=fake.name(),
-            email=fake.email(),
-            site=fake.url(),
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            reviewed=False,
-            post=Post.query.get(random.randint(1, Post.query.count())),
-        )
-        db.session.add(comment)
-
-        #from admin
-        comment = Comment(
-            author='Mima Kirigoe',
-            email='mima@example.com',
-            site='example.com',
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            from_admin=True,
-            reviewed=True,
-            post=Post.query.get(random.randint(1, Post.query.count())),
-        )
-        db.session.add(comment)
-    db.session.commit()
+def fake_posts(count=50, jobs=1):
+    start = _next_id(Post)
+    category_count = db.session.query(db.func.max(Category.id)).scalar() or 1
+    seed, window = _seed(), _window()
+    batches = [(seed, index, batch_start, size, category_count, window)
+               for index, batch_start, size in _batches(start, count)]
+    _bulk_insert(Post, batches, jobs, _post_batch)
 
-    #replies
-    for i in range(salt):
-        comment = Comment(
-            author=fake.name(),
-            email=fake.email(),
-            site=fake.url(),
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            reviewed=True,
-            replied=Comment.query.get(random.randint(1, Comment.query.count())),
-            post=Post.query.get(random.randint(1, Post.query.count()))
-        )
-        db.session.add(comment)
-    db.session.commit()
+def fake_comments(count=500, jobs=1):
+    """Insert ``count`` reviewed comments, plus 10% each of unreviewed, admin and reply comments."""
+    start = _next_id(Comment)
+    first = db.session.query(db.func.min(Comment.id)).scalar() or start
+    post_range = (db.session.query(db.func.min(Post.id)).scalar() or 1, _next_id(Post) - 1)
+    if post_range[1] < post_range[0]:
+        return
+    salt = int(count * 0.1)
+    seed, window = _seed(), _window()
+    batches = []
+    # 预先分好每类评论的 id 区间，回复只指向这之前的评论
+    for kind, size in (('reviewed', count), ('unreviewed', salt), ('admin', salt), ('reply', salt)):
+        replied_range = (first, start - 1)
+        batches.extend((seed, index, batch_start, batch_size, kind, post_range, replied_range, window)
+                       for index, batch_start, batch_size in _batches(start, size))
+        start += size
+    _bulk_insert(Comment, batches, jobs, _comment_batch)
 
 def fake_links():
     twitter = Link(name='Twitter',url='#')
@@ -112,6 +234,45 @@ def fake_links():
     facebook = Link(name='Facebook',url='#')
     db.session.add_all([twitter,github,linkedin,facebook])
     db.session.commit()
-    
-    
-        
\ No newline at end of file
+
+
+def forge(category=10, post=50, comment=500, seed=None, jobs=1, echo=print):
+    """Recreate the tables and fill them with fake data (``flask forge``).
+
+    Rows are written with bulk inserts in batches of BATCH_SIZE, with ids assigned up
+    front, and the fake text can be generated in ``jobs`` processes. With a ``seed`` the
+    result is the same on every run, whatever the number of jobs.
+    """
+    from myblog.search import reindex as rebuild_search_index
+
+    seed_fakes(seed)
+    db.drop_all()
+    create_schema()
+
+    echo('Initializing the database...')
+    fake_admin()
+
+    echo('Generating %d categories...' % category)
+    fake_categories(category)
+
+    with _indexes_deferred(Post, Comment):
+        echo('Generating %d posts...' % post)
+        fake_posts(post, jobs)
+
+        echo('Generating %d comments...' % comment)
+        fake_comments(comment, jobs)
+
+        echo('Building indexes...')
+
+    echo('Generating links...')
+    fake_links()
+
+    echo('Updating counters...')
+    rebuild_counters()
+
+    echo('Building search index...')
+    rebuild_search_index()
+    bump_version('site')
+    db.session.commit()
+
+    echo('Done.')
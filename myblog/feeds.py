@@ -0,0 +1,67 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import re
+
+from flask import current_app, render_template, request, url_for, make_response
+from sqlalchemy.orm import joinedload, defer
+from werkzeug.http import http_date
+
+from myblog.caching import last_modified
+from myblog.models import Post
+
+MIMETYPES = {
+    'atom': 'application/atom+xml',
+    'rss': 'application/rss+xml',
+    'json': 'application/feed+json',
+}
+
+_relative_url_re = re.compile(r'(\s(?:src|href)=")/(?!/)')
+
+
+def feed_tags(post):
+    """Tags of the feeds that list ``post``; bump them when a post is created, edited or deleted."""
+    return ('feed', 'feed:category:%d' % post.category_id)
+
+
+def absolute_urls(html):
+    # 阅读器不一定按订阅地址解析站内相对链接，图片和链接改为绝对地址
+    return _relative_url_re.sub(r'\1%s/' % request.url_root.rstrip('/'), html or '')
+
+
+def render_feed(format, title, link, query, tags):
+    """Render the newest MYBLOG_FEED_ITEMS posts of ``query`` as an Atom, RSS or JSON feed."""
+    config = current_app.config
+    options = [joinedload(Post.category), defer(Post.plain_text)]
+    if not config['MYBLOG_FEED_FULL_TEXT']:
+        options.append(defer(Post.body))
+    posts = query.options(*options).order_by(Post.timestamp.desc(), Post.id.desc()) \
+        .limit(config['MYBLOG_FEED_ITEMS']).all()
+    updated = last_modified(*tags) or (posts[0].timestamp if posts else None)
+    feed_url = request.base_url
+
+    if format == 'json':
+        items = []
+        for post in posts:
+            url = url_for('blog.show_post', post_id=post.id, _external=True)
+            item = {'id': url, 'url': url, 'title': post.title, 'summary': post.excerpt,
+                    'date_published': post.timestamp.isoformat() + 'Z', 'tags': [post.category.name]}
+            if config['MYBLOG_FEED_FULL_TEXT']:
+                item['content_html'] = absolute_urls(post.body)
+            else:
+                item['content_text'] = post.excerpt
+            items.append(item)
+        body = json.dumps({'version': 'https://jsonfeed.org/version/1.1', 'title': title,
+                           'home_page_url': link, 'feed_url': feed_url, 'items': items},
+                          ensure_ascii=False, indent=1)
+    else:
+        body = render_template('feeds/%s.xml' % format, title=title, link=link, feed_url=feed_url,
+                               posts=posts, updated=updated, full_text=config['MYBLOG_FEED_FULL_TEXT'],
+                               absolute_urls=absolute_urls, http_date=http_date)
+    response = make_response(body)
+    response.mimetype = MIMETYPES[format]
+    return response
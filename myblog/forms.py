@@ -4,15 +4,30 @@
     :copyright: ©2025 Cheung Jan <CheungJan@live.com>
     :license: MIT, see LICENSE for more details.
 """
-from turtle import title
-from flask_ckeditor import CKEditorField
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField, \
     ValidationError, HiddenField,SelectField
 from wtforms.validators import DataRequired, Email, Length, Optional,URL
+from wtforms.widgets import TextArea
 
 from myblog.models import Category
 
+
+class CKEditorTextArea(TextArea):
+    def __call__(self, field, **kwargs):
+        kwargs['class'] = 'ckeditor %s' % (kwargs.pop('class', '') or kwargs.pop('class_', ''))
+        return super(CKEditorTextArea, self).__call__(field, **kwargs)
+
+
+class CKEditorField(TextAreaField):
+    """The same field as flask_ckeditor's, a textarea with the ``ckeditor`` class.
+
+    Defined here because the public pages import this module too, and importing
+    flask_ckeditor (which pulls in bleach) would slow down every cold start.
+    """
+    widget = CKEditorTextArea()
+
+
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(),Length(1,20)])
     password = PasswordField('Password', validators=[DataRequired(),Length(1,120)])
@@ -0,0 +1,258 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+import os
+import re
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, url_for
+from markupsafe import Markup
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from myblog.caching import bump_version
+from myblog.extensions import db
+from myblog.models import Image
+
+CHUNK_SIZE = 64 * 1024
+
+# Pillow 的保存格式；GIF 的缩略图转存为 PNG（动图不处理）
+_formats = {'jpg': 'JPEG', 'png': 'PNG'}
+
+
+def variant_ext(ext):
+    return 'png' if ext == 'gif' else ext
+
+
+def store_upload(storage):
+    """Stream an uploaded file into content-addressed storage and return its Image row.
+
+    The file is copied to disk in chunks while it is hashed, so memory use does not depend
+    on the upload size. Uploading the same content again reuses the existing row and file.
+    """
+    ext = storage.filename.rsplit('.', 1)[1].lower()
+    if ext == 'jpeg':
+        ext = 'jpg'
+    upload_path = current_app.config['MYBLOG_UPLOAD_PATH']
+    os.makedirs(upload_path, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=upload_path, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+        image = _get_or_create(digest.hexdigest(), ext, secure_filename(storage.filename), size)
+        target = os.path.join(upload_path, image.path)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(temp_path, target)
+            temp_path = None
+            # 文件被手工删除后重新上传，缩略图也要重新生成
+            image.processed = False
+            db.session.commit()
+    finally:
+        if temp_path is not None:
+            os.remove(temp_path)
+    return image
+
+
+def _get_or_create(hash, ext, filename, size):
+    image = Image.query.filter_by(hash=hash).first()
+    if image is not None:
+        return image
+    image = Image(hash=hash, ext=ext, filename=filename, size=size)
+    db.session.add(image)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # 另一个请求同时上传了相同的内容
+        db.session.rollback()
+        image = Image.query.filter_by(hash=hash).one()
+    return image
+
+
+def render_variants(source, widths, quality, webp_quality):
+    """Write resized, re-encoded copies of ``source`` (and WebP versions) next to it.
+
+    Works on plain paths so it can run in any worker. Variants are never wider than the
+    original; EXIF orientation is applied and metadata is dropped. Returns
+    ``((width, height), widths, webp)``, or None when Pillow is not installed.
+    """
+    try:
+        from PIL import Image as PILImage, ImageOps, features
+    except ImportError:
+        return None
+
+    directory, name = os.path.split(source)
+    hash, ext = name.rsplit('.', 1)
+    with PILImage.open(source) as original:
+        if getattr(original, 'is_animated', False):
+            return original.size, [], False
+        picture = ImageOps.exif_transpose(original)
+        width, height = picture.size
+        ext = variant_ext(ext)
+        if ext == 'jpg':
+            picture = picture.convert('RGB')
+        elif picture.mode not in ('RGB', 'RGBA'):
+            picture = picture.convert('RGBA')
+        webp = features.check('webp')
+        targets = sorted({min(target, width) for target in widths})
+        for target in targets:
+            resized = picture
+            if target != width:
+                resized = picture.resize((target, max(round(height * target / width), 1)), PILImage.LANCZOS)
+            base = os.path.join(directory, '%s-%d' % (hash, target))
+            _save(resized, '%s.%s' % (base, ext), _formats[ext], quality)
+            if webp:
+                _save(resized, base + '.webp', 'WEBP', webp_quality)
+    return (width, height), targets, webp
+
+
+def _save(picture, path, format, quality):
+    # 先写临时文件再改名，读者不会拿到写了一半的图片，同一张图被并发处理也不会互相覆盖
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    os.close(fd)
+    if format == 'JPEG':
+        picture.save(temp_path, format, quality=quality, optimize=True, progressive=True)
+    elif format == 'WEBP':
+        picture.save(temp_path, format, quality=quality, method=4)
+    else:
+        picture.save(temp_path, format, optimize=True)
+    os.replace(temp_path, path)
+
+
+def _gevent_patched():
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+class ImageProcessor(object):
+    """Generates image variants in a thread pool, off the request path.
+
+    Pillow only releases the GIL in parts of its C code, so the threads still share the
+    worker's CPU with its requests; they keep uploads from waiting for the variants. In
+    a gevent worker the pool's threads are greenlets, which would hold up every request
+    of the worker for the whole resize, so the Pillow work runs in gevent's pool of
+    native threads instead. Images that were never processed (e.g. the worker exited
+    first) are picked up by ``flask process-images``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.executor = None
+        self.pid = None
+
+    def submit(self, image_id):
+        workers = self.app.config['MYBLOG_IMAGE_WORKERS']
+        if not workers:
+            return self.run(image_id)
+        # fork 出来的 worker 不继承线程池，按进程重新创建
+        if self.executor is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='myblog-image')
+        return self.executor.submit(self.run, image_id)
+
+    def run(self, image_id):
+        with self.app.app_context():
+            try:
+                return self.process(image_id)
+            except Exception:
+                self.app.logger.exception('Processing image %d failed' % image_id)
+                return False
+
+    def render(self, *args):
+        if _gevent_patched():
+            # 只把不碰数据库的图片运算交给原生线程，会话和连接池留在 greenlet 里
+            import gevent
+            return gevent.get_hub().threadpool.apply(render_variants, args)
+        return render_variants(*args)
+
+    def process(self, image_id):
+        """Generate the variants of one image. Returns True if the row was updated."""
+        config = self.app.config
+        image = db.session.get(Image, image_id)
+        if image is None:
+            return False
+        source = os.path.join(config['MYBLOG_UPLOAD_PATH'], image.path)
+        try:
+            result = self.render(source, config['MYBLOG_IMAGE_WIDTHS'], config['MYBLOG_IMAGE_QUALITY'],
+                                 config['MYBLOG_IMAGE_WEBP_QUALITY'])
+        except OSError as e:
+            # 文件损坏或不是图片，按原样提供，不再重试
+            self.app.logger.warning('Cannot process image %s: %s' % (image.path, e))
+            result = (None, None), [], False
+        if result is None:
+            self.app.logger.warning('Pillow is not installed, serving image %s without variants' % image.path)
+            return False
+        (image.width, image.height), widths, image.webp = result
+        image.variants = ','.join(str(width) for width in widths)
+        image.processed = True
+        # 已缓存的文章页要换成带 srcset 的版本
+        bump_version('images')
+        db.session.commit()
+        return True
+
+
+def get_processor(app=None):
+    app = app or current_app._get_current_object()
+    if 'myblog_images' not in app.extensions:
+        app.extensions['myblog_images'] = ImageProcessor(app)
+    return app.extensions['myblog_images']
+
+
+_img_re = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+_src_re = re.compile(r'\bsrc="[^"]*/[0-9a-f]{2}/([0-9a-f]{64})\.\w+"')
+
+
+def responsive_images(html):
+    """Template filter: point uploaded images in ``html`` at their resized variants.
+
+    Each ``<img>`` whose source is a processed upload gets a ``srcset`` of its variants
+    and is wrapped in a ``<picture>`` offering the WebP versions first, so browsers
+    download the smallest file that fits the layout. Costs one query per page, and only
+    when the HTML contains uploads.
+    """
+    if not html:
+        return Markup('')
+    hashes = set(_src_re.findall(html))
+    if not hashes:
+        return Markup(html)
+    images = {image.hash: image for image in
+              Image.query.filter(Image.hash.in_(hashes), Image.processed == True).all()}
+    sizes = current_app.config['MYBLOG_IMAGE_SIZES']
+
+    def srcset(image, ext):
+        return ', '.join('%s %dw' % (url_for('admin.get_image', filename=image.variant_path(width, ext)), width)
+                         for width in image.widths)
+
+    def rewrite(match):
+        tag = match.group(0)
+        src = _src_re.search(tag)
+        image = images.get(src.group(1)) if src else None
+        if image is None or not image.widths:
+            return tag
+        largest = url_for('admin.get_image', filename=image.variant_path(image.widths[-1], variant_ext(image.ext)))
+        attributes = ' srcset="%s" sizes="%s"' % (srcset(image, variant_ext(image.ext)), sizes)
+        if 'loading=' not in tag:
+            attributes += ' loading="lazy" decoding="async"'
+        end = -2 if tag.endswith('/>') else -1
+        tag = tag[:src.start()] + 'src="%s"' % largest + tag[src.end():end].rstrip() + attributes + tag[end:]
+        if not image.webp:
+            return tag
+        return '<picture><source type="image/webp" srcset="%s" sizes="%s">%s</picture>' % (
+            srcset(image, 'webp'), sizes, tag)
+
+    return Markup(_img_re.sub(rewrite, html))
@@ -0,0 +1,263 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import atexit
+import glob
+import hmac
+import json
+import os
+import time
+from bisect import bisect_left
+from threading import Lock
+
+from flask import current_app, request, g, abort, make_response
+from flask.signals import before_render_template, template_rendered, signals_available
+from flask_sqlalchemy import get_debug_queries
+
+HELP = {
+    'myblog_requests_total': ('counter', 'Requests handled, by endpoint, method and status.'),
+    'myblog_request_duration_seconds': ('histogram', 'Request latency, by endpoint.'),
+    'myblog_db_queries_total': ('counter', 'SQL statements executed, by endpoint.'),
+    'myblog_db_query_seconds_total': ('counter', 'Time spent in SQL statements, by endpoint.'),
+    'myblog_template_render_seconds_total': ('counter', 'Time spent rendering templates, by endpoint.'),
+    'myblog_page_cache_total': ('counter', 'Page cache lookups, by endpoint and result.'),
+    'myblog_cache_total': ('counter', 'Cache operations, by namespace and result.'),
+    'myblog_response_bytes_total': ('counter', 'Response body bytes, by endpoint.'),
+}
+
+
+class MetricsCollector(object):
+    """Per-process counters and histograms, periodically written to MYBLOG_METRICS_DIR.
+
+    Every gunicorn worker writes its own ``<pid>.json``; ``/metrics`` adds up the files
+    of all workers, so the numbers do not depend on which worker answers the scrape.
+    Without a directory the collector only reports the current process.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.flushed_at = 0
+        self.pid = os.getpid()
+
+    def _reset_after_fork(self):
+        # fork 出来的 worker 从零开始计数，避免重复计入父进程的数据
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self.app.config['MYBLOG_METRICS_BUCKETS']
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0, 'count': 0}
+        histogram['buckets'][bisect_left(buckets, value)] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    def record(self, endpoint, method, status, duration, queries, query_time, render_time, cache, size):
+        with self.lock:
+            self._reset_after_fork()
+            labels = {'endpoint': endpoint}
+            self.inc('myblog_requests_total', dict(labels, method=method, status=str(status)))
+            self.observe('myblog_request_duration_seconds', labels, duration)
+            self.inc('myblog_db_queries_total', labels, queries)
+            self.inc('myblog_db_query_seconds_total', labels, query_time)
+            self.inc('myblog_template_render_seconds_total', labels, render_time)
+            if cache is not None:
+                self.inc('myblog_page_cache_total', dict(labels, result=cache))
+            if size is not None:
+                self.inc('myblog_response_bytes_total', labels, size)
+            self.maybe_flush()
+
+    def snapshot(self):
+        counters = [[name, dict(labels), value] for (name, labels), value in self.counters.items()]
+        # 缓存客户端自己计数（同样在 fork 后清零），写出时一并带上
+        client = self.app.extensions.get('cache')
+        if client is not None:
+            counters.extend(['myblog_cache_total', {'namespace': namespace, 'result': result}, value]
+                            for namespace, results in client.stats().items() for result, value in results.items())
+        return {
+            'counters': counters,
+            'histograms': [[name, dict(labels), histogram] for (name, labels), histogram in self.histograms.items()],
+        }
+
+    def maybe_flush(self, force=False):
+        directory = self.app.config['MYBLOG_METRICS_DIR']
+        now = time.monotonic()
+        if directory is None or (not force and now - self.flushed_at < self.app.config['MYBLOG_METRICS_FLUSH_INTERVAL']):
+            return
+        self.flushed_at = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '%d.json' % os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def flush_at_exit(self):
+        # gunicorn 正常停止 worker 时写出最后一段时间的数据
+        with self.lock:
+            self._reset_after_fork()
+            if self.counters or self.histograms:
+                self.maybe_flush(force=True)
+
+    def collect(self):
+        """Sum the snapshots of every worker (or just this process without a directory)."""
+        with self.lock:
+            self._reset_after_fork()
+            self.maybe_flush(force=True)
+            snapshots = [self.snapshot()]
+        directory = self.app.config['MYBLOG_METRICS_DIR']
+        if directory is not None:
+            snapshots = load_snapshots(directory)
+        return sum_snapshots(snapshots)
+
+
+def load_snapshots(directory):
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def sum_snapshots(snapshots):
+    """Add up worker snapshots into ``(counters, histograms)`` keyed by ``(name, labels)``."""
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            total = histograms.setdefault(key, {'buckets': [0] * len(histogram['buckets']), 'sum': 0, 'count': 0})
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return counters, histograms
+
+
+def _labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in items)
+
+
+def render_prometheus(counters, histograms, buckets):
+    lines = []
+    for name, (kind, help) in HELP.items():
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        if kind == 'histogram':
+            for (series, labels), histogram in sorted(histograms.items()):
+                if series != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], histogram['buckets']):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, _labels(labels, le=bound), cumulative))
+                lines.append('%s_sum%s %r' % (name, _labels(labels), float(histogram['sum'])))
+                lines.append('%s_count%s %d' % (name, _labels(labels), histogram['count']))
+        else:
+            for (series, labels), value in sorted(counters.items()):
+                if series == name:
+                    lines.append('%s%s %r' % (name, _labels(labels), float(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def get_collector(app=None):
+    app = app or current_app._get_current_object()
+    if 'myblog_metrics' not in app.extensions:
+        app.extensions['myblog_metrics'] = collector = MetricsCollector(app)
+        atexit.register(collector.flush_at_exit)
+    return app.extensions['myblog_metrics']
+
+
+def _local_request():
+    # 经本机反向代理转发的请求 remote_addr 也是 127.0.0.1，但会带上 X-Forwarded-For
+    return request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+
+
+def metrics():
+    """Prometheus text format; needs MYBLOG_METRICS_TOKEN, or without one a direct request from this host."""
+    token = current_app.config['MYBLOG_METRICS_TOKEN']
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer %s' % token):
+            abort(403)
+    elif not _local_request():
+        abort(403)
+    counters, histograms = get_collector().collect()
+    response = make_response(render_prometheus(counters, histograms, current_app.config['MYBLOG_METRICS_BUCKETS']))
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+def register_metrics(app):
+    """Time every request and expose the totals on /metrics (see MYBLOG_METRICS)."""
+    if not app.config['MYBLOG_METRICS']:
+        return
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+    if signals_available:
+        def start_render(sender, template, context, **extra):
+            g.setdefault('myblog_render_started', []).append(time.perf_counter())
+
+        def end_render(sender, template, context, **extra):
+            started = g.get('myblog_render_started')
+            if started:
+                elapsed = time.perf_counter() - started.pop()
+                # 嵌套渲染（如在视图中先渲染片段）只计外层
+                if not started:
+                    g.myblog_render_time = g.get('myblog_render_time', 0) + elapsed
+
+        before_render_template.connect(start_render, app, weak=False)
+        template_rendered.connect(end_render, app, weak=False)
+
+    @app.before_request
+    def start_timer():
+        if request.environ.get('myblog.warmup'):
+            return
+        request.environ['myblog.started'] = time.perf_counter()
+        g.myblog_render_time = 0
+
+    @app.after_request
+    def record_metrics(response):
+        started = request.environ.get('myblog.started')
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        queries = get_debug_queries()
+        query_time = sum(query.duration for query in queries)
+        render_time = g.get('myblog_render_time', 0)
+        cache = request.environ.get('myblog.cache')
+        size = response.content_length
+        if size is None and response.is_sequence:
+            size = response.calculate_content_length()
+        get_collector(app).record(request.endpoint or 'none', request.method, response.status_code, duration,
+                                  len(queries), query_time, render_time, cache, size)
+
+        # 管理员可以在浏览器开发者工具里直接看到服务端耗时
+        user = g.get('_login_user')
+        if user is not None and user.is_authenticated:
+            timings = ['app;dur=%.1f' % (duration * 1000),
+                       'db;dur=%.1f;desc="%d queries"' % (query_time * 1000, len(queries)),
+                       'tpl;dur=%.1f' % (render_time * 1000)]
+            if cache is not None:
+                timings.append('cache;desc=%s' % cache)
+            response.headers['Server-Timing'] = ', '.join(timings)
+        return response
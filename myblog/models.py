@@ -4,11 +4,32 @@
     :copyright: ©2025 Cheung Jan <CheungJan@live.com>
     :license: MIT, see LICENSE for more details.
 """
+import re
+
 from myblog.extensions import db
 from flask_login import UserMixin
+from markupsafe import Markup
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
+# 中日韩文字逐字计数，其余按空白分隔的词计数
+_word_re = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]|[^\s\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+')
+
+def truncate_text(text, length=255, end='...'):
+    """Jinja's ``truncate`` filter without its leeway: the result never exceeds ``length``.
+
+    Post.excerpt is a String(255) column, and the filter keeps texts up to 5 characters
+    longer than ``length`` as they are.
+    """
+    if len(text) <= length:
+        return text
+    return text[:length - len(end)].rsplit(' ', 1)[0] + end
+
+def post_text(body):
+    """``(plain_text, excerpt, word_count)`` of a post's HTML body."""
+    plain_text = Markup(body or '').striptags()
+    return plain_text, truncate_text(plain_text), len(_word_re.findall(plain_text))
+
 class Admin(db.Model,UserMixin):
     id = db.Column(db.Integer,primary_key=True) #主键字段
     username = db.Column(db.String(20)) #用户姓名
@@ -27,29 +48,54 @@ class Admin(db.Model,UserMixin):
 class Category(db.Model):
     id = db.Column(db.Integer,primary_key=True) #主键字段
     name = db.Column(db.String(30),unique=True) #分类名称
+    post_count = db.Column(db.Integer, default=0, nullable=False) #文章数量（冗余计数）
     posts = db.relationship('Post',back_populates='category') #文章
 
+    def update_post_count(self):
+        self.post_count = Post.query.with_parent(self).count()
+
     def delete(self):
         default_category = Category.query.get(1)
-        posts = self.posts[:]
-        for post in posts:
-            post.category = default_category
+        # 直接批量更新外键，避免加载该分类下的全部文章
+        Post.query.filter_by(category_id=self.id).update({'category_id': default_category.id})
         db.session.delete(self)
+        default_category.update_post_count()
         db.session.commit()
 
 class Post(db.Model):
+    __table_args__ = (
+        db.Index('ix_post_category_id_timestamp', 'category_id', 'timestamp'), # 分类页文章列表
+    )
+
     id = db.Column(db.Integer,primary_key=True) #主键字段
     title=db.Column(db.String(60)) #标题
     body = db.Column(db.Text) #内容
+    plain_text = db.Column(db.Text) #去掉 HTML 标签后的内容
+    excerpt = db.Column(db.String(255)) #摘要
+    word_count = db.Column(db.Integer, default=0, nullable=False) #字数
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True) #时间戳
     can_comment = db.Column(db.Boolean, default=True) #是否允许评论
+    comment_count = db.Column(db.Integer, default=0, nullable=False) #已审核评论数量（冗余计数）
 
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
 
     category = db.relationship('Category', back_populates='posts')
     comments = db.relationship('Comment', back_populates='post', cascade='all, delete-orphan')
 
+    def update_text(self):
+        """Derive plain_text, excerpt and word_count from the HTML body; call whenever body changes."""
+        self.plain_text, self.excerpt, self.word_count = post_text(self.body)
+
+    def update_comment_count(self):
+        self.comment_count = Comment.query.with_parent(self).filter_by(reviewed=True).count()
+
 class Comment(db.Model):
+    __table_args__ = (
+        db.Index('ix_comment_post_id_reviewed_timestamp', 'post_id', 'reviewed', 'timestamp'), # 文章页评论列表
+        db.Index('ix_comment_reviewed_timestamp', 'reviewed', 'timestamp'), # 未读评论筛选与计数
+        db.Index('ix_comment_from_admin_timestamp', 'from_admin', 'timestamp'), # 管理员评论筛选
+    )
+
     id = db.Column(db.Integer,primary_key=True) #主键字段
     author = db.Column(db.String(30)) #作者
     email = db.Column(db.String(254)) #邮箱
@@ -69,4 +115,119 @@ class Comment(db.Model):
 class Link(db.Model):
     id = db.Column(db.Integer,primary_key=True) #主键字段
     name = db.Column(db.String(30)) #链接名称
-    url = db.Column(db.String(255)) #链接地址
\ No newline at end of file
+    url = db.Column(db.String(255)) #链接地址
+
+class OutgoingMail(db.Model):
+    __table_args__ = (
+        db.Index('ix_outgoing_mail_pending', 'sent', 'send_after'), # 发送队列轮询
+        db.Index('ix_outgoing_mail_coalesce', 'recipient', 'coalesce_key', 'sent'), # 合并同类通知
+    )
+
+    id = db.Column(db.Integer, primary_key=True) #主键字段
+    recipient = db.Column(db.String(254)) #收件人
+    subject = db.Column(db.String(255)) #主题
+    html = db.Column(db.Text) #正文
+    coalesce_key = db.Column(db.String(64)) #合并键，相同收件人和键的未发送邮件合并为一封摘要
+    count = db.Column(db.Integer, default=1, nullable=False) #合并的通知数量
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow) #入队时间
+    send_after = db.Column(db.DateTime, default=datetime.utcnow) #最早发送时间（合并窗口/重试退避）
+    attempts = db.Column(db.Integer, default=0, nullable=False) #已尝试次数
+    last_error = db.Column(db.Text) #最近一次失败原因
+    claimed_by = db.Column(db.String(64)) #正在发送的进程
+    claimed_at = db.Column(db.DateTime) #领取时间
+    sent = db.Column(db.Boolean, default=False, nullable=False) #是否已发送（或已放弃）
+    sent_at = db.Column(db.DateTime) #发送时间
+
+class Image(db.Model):
+    id = db.Column(db.Integer, primary_key=True) #主键字段
+    hash = db.Column(db.String(64), unique=True, index=True) #内容的 SHA-256，相同内容只保存一份
+    ext = db.Column(db.String(10)) #原图扩展名
+    filename = db.Column(db.String(255)) #上传时的文件名
+    size = db.Column(db.Integer) #原图字节数
+    width = db.Column(db.Integer) #原图宽度
+    height = db.Column(db.Integer) #原图高度
+    variants = db.Column(db.String(255)) #已生成的缩放宽度，逗号分隔
+    webp = db.Column(db.Boolean, default=False, nullable=False) #是否有 WebP 版本
+    processed = db.Column(db.Boolean, default=False, nullable=False) #缩略图是否已处理完成
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow) #上传时间
+
+    @property
+    def path(self):
+        """Path of the original, relative to MYBLOG_UPLOAD_PATH."""
+        return '%s/%s.%s' % (self.hash[:2], self.hash, self.ext)
+
+    @property
+    def widths(self):
+        return [int(width) for width in self.variants.split(',')] if self.variants else []
+
+    def variant_path(self, width, ext=None):
+        return '%s/%s-%d.%s' % (self.hash[:2], self.hash, width, ext or self.ext)
+
+class CacheVersion(db.Model):
+    name = db.Column(db.String(64), primary_key=True) #缓存标签
+    version = db.Column(db.Integer, default=0, nullable=False) #版本号，每次写入递增
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow) #最后修改时间
+
+def comment_tree(*criteria):
+    """Recursive CTE of the comments matching ``criteria`` and all of their replies.
+
+    Its columns are ``id``, ``post_id`` and ``depth``, 0 for the matching comments; one
+    query reads the whole tree, where walking ``Comment.replies`` loads every level
+    separately. A reply may belong to another post than the comment it replies to.
+    """
+    tree = db.select(Comment.id, Comment.post_id, db.literal(0).label('depth')).where(*criteria) \
+        .cte('comment_tree', recursive=True)
+    return tree.union_all(db.select(Comment.id, Comment.post_id, tree.c.depth + 1)
+                          .where(Comment.replied_id == tree.c.id))
+
+def delete_comment_tree(*criteria):
+    """Bulk-delete the comments matching ``criteria`` together with all of their replies.
+
+    The reply tree is read with one recursive query, where the ORM cascade would load
+    the replies of every deleted comment separately. Replies are deleted before the
+    comments they reply to, so comment.replied_id never points at a deleted row.
+    Returns ``{id: post_id}`` of the deleted comments; replies can be on other posts,
+    whose counters then need updating too (see update_comment_counts).
+    """
+    tree = comment_tree(*criteria)
+    levels = {}
+    posts = {}
+    for id, post_id, depth in db.session.execute(db.select(tree.c.id, tree.c.post_id, tree.c.depth)):
+        # 同一条评论可能出现在多层（条件同时匹配了它和它的上级），取最深的一层
+        levels[id] = max(depth, levels.get(id, depth))
+        posts[id] = post_id
+    ids = sorted(levels, key=levels.get, reverse=True)
+    # 从最深的回复开始逐层删除，每层再分批，避免超出数据库对参数个数的限制；
+    # 同一条 DELETE 里不会同时有回复和它的上级（MySQL 按行检查外键）
+    for depth in sorted(set(levels.values()), reverse=True):
+        level = [id for id in ids if levels[id] == depth]
+        for start in range(0, len(level), 500):
+            Comment.query.filter(Comment.id.in_(level[start:start + 500])).delete(synchronize_session=False)
+    return {id: posts[id] for id in ids}
+
+def update_comment_counts(*criteria):
+    """Recalculate Post.comment_count of the posts matching ``criteria`` (all posts if none) in one UPDATE."""
+    comment_count = db.select(db.func.count(Comment.id)).where(
+        Comment.post_id == Post.id, Comment.reviewed == True).scalar_subquery()
+    Post.query.filter(*criteria).update({Post.comment_count: comment_count}, synchronize_session=False)
+
+def rebuild_counters():
+    """Recalculate the denormalized post/comment counters from scratch."""
+    update_comment_counts()
+    post_count = db.select(db.func.count(Post.id)).where(Post.category_id == Category.id).scalar_subquery()
+    Category.query.update({Category.post_count: post_count}, synchronize_session=False)
+    db.session.commit()
+
+def backfill_post_text(batch_size=500):
+    """Fill the derived text columns of every post, committing in batches. Returns the post count."""
+    count = 0
+    last_id = 0
+    while True:
+        posts = Post.query.filter(Post.id > last_id).order_by(Post.id).limit(batch_size).all()
+        if not posts:
+            return count
+        for post in posts:
+            post.update_text()
+        db.session.commit()
+        count += len(posts)
+        last_id = posts[-1].id
@@ -0,0 +1,103 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from flask import current_app, request, url_for, abort
+
+from myblog.extensions import db
+
+
+def encode_cursor(direction, timestamp, id):
+    raw = '%s|%s|%d' % (direction, timestamp.isoformat(), id)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        direction, timestamp, id = raw.split('|')
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        abort(404)
+
+
+class KeysetPagination(object):
+    """Seek pagination over ``(timestamp, id)`` in descending order.
+
+    Unlike ``Query.paginate`` it never issues OFFSET, so deep pages cost the same as the
+    first one, and ``total`` is only counted if a template actually asks for it.
+    """
+    keyset = True
+
+    def __init__(self, query, model, per_page, cursor=None, total=None):
+        self.per_page = per_page
+        self._query = query
+        self._total = total
+        direction, timestamp, id = decode_cursor(cursor) if cursor else ('next', None, None)
+        # 冗余的 timestamp 范围条件让数据库可以直接在 timestamp 索引上做范围查找
+        if direction == 'prev':
+            newer = db.and_(model.timestamp >= timestamp, db.or_(model.timestamp > timestamp, model.id > id))
+            rows = query.filter(newer).order_by(model.timestamp.asc(), model.id.asc()).limit(per_page + 1).all()
+            self.has_prev = len(rows) > per_page
+            self.has_next = True
+            self.items = rows[:per_page][::-1]
+        else:
+            if timestamp is not None:
+                query = query.filter(
+                    db.and_(model.timestamp <= timestamp, db.or_(model.timestamp < timestamp, model.id < id)))
+            rows = query.order_by(model.timestamp.desc(), model.id.desc()).limit(per_page + 1).all()
+            self.has_next = len(rows) > per_page
+            self.has_prev = timestamp is not None
+            self.items = rows[:per_page]
+
+        self.next_cursor = self.prev_cursor = None
+        if self.items:
+            first, last = self.items[0], self.items[-1]
+            if self.has_next:
+                self.next_cursor = encode_cursor('next', last.timestamp, last.id)
+            if self.has_prev:
+                self.prev_cursor = encode_cursor('prev', first.timestamp, first.id)
+        else:
+            self.has_next = self.has_prev = False
+
+    @property
+    def total(self):
+        if self._total is None:
+            self._total = self._query.order_by(None).count()
+        elif callable(self._total):
+            self._total = self._total()
+        return self._total
+
+    def url_for_cursor(self, cursor, **kwargs):
+        args = {key: value for key, value in request.args.items() if key not in ('cursor', 'page')}
+        args.update(request.view_args)
+        args.update(kwargs)
+        return url_for(request.endpoint, cursor=cursor, **args)
+
+    @property
+    def next_url(self):
+        return self.url_for_cursor(self.next_cursor) if self.has_next else None
+
+    @property
+    def prev_url(self):
+        return self.url_for_cursor(self.prev_cursor) if self.has_prev else None
+
+
+def paginate(query, model, per_page, total=None):
+    """Paginate ``query`` from the current request's arguments.
+
+    ``?page=N`` keeps the old OFFSET pagination for existing links; otherwise the
+    keyset mode is used (when MYBLOG_KEYSET_PAGINATION is on) with ``?cursor=`` links.
+    """
+    page = request.args.get('page', type=int)
+    if page is not None or not current_app.config['MYBLOG_KEYSET_PAGINATION']:
+        return query.order_by(model.timestamp.desc()).paginate(page=page or 1, per_page=per_page)
+    return KeysetPagination(query, model, per_page, cursor=request.args.get('cursor'), total=total)
@@ -0,0 +1,259 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import re
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import url_for, request, g, has_app_context
+from flask_login import current_user
+from flask_sqlalchemy import get_debug_queries
+from sqlalchemy import event
+
+from myblog.extensions import db
+from myblog.models import Admin, Category, Post, Comment
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Collect every SQL statement sent to the database inside the block."""
+    statements = []
+    engine = engine if engine is not None else db.engine
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _sample_urls():
+    """One representative URL per listing view, picked from the current database."""
+    category = Category.query.order_by(Category.post_count.desc()).first()
+    post = Post.query.order_by(Post.comment_count.desc()).first()
+    urls = [('blog.index', url_for('blog.index')), ('blog.about', url_for('blog.about'))]
+    if category is not None:
+        urls.append(('blog.show_category', url_for('blog.show_category', category_id=category.id)))
+    if post is not None:
+        urls.append(('blog.show_post', url_for('blog.show_post', post_id=post.id)))
+    admin_urls = [
+        ('admin.manage_post', url_for('admin.manage_post')),
+        ('admin.manage_comment', url_for('admin.manage_comment')),
+        ('admin.manage_category', url_for('admin.manage_category')),
+        ('admin.manage_link', url_for('admin.manage_link')),
+    ]
+    return urls, admin_urls
+
+
+def check_view_queries(app):
+    """Request each view twice and count the queries of the warm request.
+
+    The page cache is switched off while measuring so that the numbers reflect the
+    views themselves. Returns a list of ``(endpoint, url, count, budget)`` tuples;
+    ``budget`` is None when MYBLOG_QUERY_BUDGETS has no entry for the endpoint.
+    """
+    budgets = app.config['MYBLOG_QUERY_BUDGETS']
+    page_cache_size = app.config['MYBLOG_PAGE_CACHE_SIZE']
+    audit = app.config['MYBLOG_QUERY_AUDIT']
+    app.config['MYBLOG_PAGE_CACHE_SIZE'] = 0
+    # 超出预算的视图由这里汇报，不让请求本身失败
+    app.config['MYBLOG_QUERY_AUDIT'] = audit and 'warn'
+    try:
+        with app.test_request_context():
+            urls, admin_urls = _sample_urls()
+            admin = Admin.query.first()
+            engine = db.engine
+        results = []
+        client = app.test_client()
+        for endpoint, url in urls:
+            results.append(_measure(client, engine, endpoint, url, budgets))
+        if admin is not None:
+            with client.session_transaction() as session:
+                session['_user_id'] = str(admin.id)
+                session['_fresh'] = True
+            for endpoint, url in admin_urls:
+                results.append(_measure(client, engine, endpoint, url, budgets))
+        return results
+    finally:
+        app.config['MYBLOG_PAGE_CACHE_SIZE'] = page_cache_size
+        app.config['MYBLOG_QUERY_AUDIT'] = audit
+
+
+def _measure(client, engine, endpoint, url, budgets):
+    client.get(url)
+    with count_queries(engine) as statements:
+        response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError('%s returned %d' % (url, response.status_code))
+    return endpoint, url, len(statements), budgets.get(endpoint)
+
+
+def listing_queries():
+    """The hot listing queries of the blog and admin views, as ``(name, statement)`` pairs."""
+    now = datetime.utcnow()
+    per_page = 10
+    # 与 pagination.KeysetPagination 生成的游标条件保持一致
+    post_seek = db.and_(Post.timestamp <= now, db.or_(Post.timestamp < now, Post.id < 1))
+    comment_seek = db.and_(Comment.timestamp <= now, db.or_(Comment.timestamp < now, Comment.id < 1))
+    newest_posts = (Post.timestamp.desc(), Post.id.desc())
+    newest_comments = (Comment.timestamp.desc(), Comment.id.desc())
+    queries = [
+        ('index', Post.query.order_by(*newest_posts).limit(per_page + 1)),
+        ('index (seek)', Post.query.filter(post_seek).order_by(*newest_posts).limit(per_page + 1)),
+        ('category (seek)', Post.query.filter(Post.category_id == 1, post_seek)
+            .order_by(*newest_posts).limit(per_page + 1)),
+        ('post comments', Comment.query.filter_by(post_id=1, reviewed=True)
+            .order_by(Comment.timestamp.desc()).limit(per_page).offset(per_page)),
+        ('manage comments: unread (seek)', Comment.query.filter(Comment.reviewed == False, comment_seek)
+            .order_by(*newest_comments).limit(per_page + 1)),
+        ('manage comments: admin (seek)', Comment.query.filter(Comment.from_admin == True, comment_seek)
+            .order_by(*newest_comments).limit(per_page + 1)),
+        ('unread badge', db.session.query(db.func.count(Comment.id)).filter(Comment.reviewed == False)),
+    ]
+    return [(name, query.statement) for name, query in queries]
+
+
+def explain(statement):
+    """Return the database's query plan for ``statement`` as a list of text lines."""
+    engine = db.engine
+    compiled = statement.compile(dialect=engine.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    with engine.connect() as connection:
+        result = connection.exec_driver_sql(prefix + str(compiled), params)
+        rows = result.fetchall()
+    if engine.dialect.name == 'sqlite':
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [' | '.join('%s=%s' % (key, value) for key, value in row._mapping.items()) for row in rows]
+
+
+class QueryAuditError(AssertionError):
+    """A request exceeded its query budget or repeated the same query (MYBLOG_QUERY_AUDIT = 'raise')."""
+
+
+# 进程级缓存的重建查询，分摊到很多请求上，不计入单个请求的预算
+_AMORTIZED = {('myblog.caching', 'load_versions'), ('myblog.caching', '_build_site_context'),
+              ('myblog.replication', 'measure_lag')}
+
+_string_re = re.compile(r"'(?:[^']|'')*'")
+_number_re = re.compile(r'\b\d+(?:\.\d+)?\b')
+_placeholder_re = re.compile(r'%\(\w+\)s|%s')
+_in_list_re = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+def fingerprint_statement(statement):
+    """The shape of a SQL statement: literals, placeholders and IN lists collapsed to ``?``."""
+    statement = _string_re.sub('?', statement)
+    statement = _number_re.sub('?', statement)
+    statement = _placeholder_re.sub('?', statement)
+    statement = _in_list_re.sub('(?)', statement)
+    return ' '.join(statement.split())
+
+
+def _query_origin(root_path):
+    """``(location, amortized)`` of the query being executed, read from the call stack.
+
+    The location is the template and line that triggered the query (e.g. a lazy load in
+    ``{{ post.category.name }}``), or else the innermost line of application code.
+    """
+    template = code = None
+    frame = sys._getframe(2)
+    while frame is not None and (template is None or code is None):
+        namespace = frame.f_globals
+        if template is None and '__jinja_template__' in namespace:
+            source = namespace['__jinja_template__']
+            template = '%s:%d' % (source.name or source.filename, source.get_corresponding_lineno(frame.f_lineno))
+        name = namespace.get('__name__') or ''
+        if code is None and (name == 'myblog' or name.startswith('myblog.')) and name != __name__:
+            code = (name, frame.f_code.co_name, '%s:%d (%s)' % (
+                os.path.relpath(frame.f_code.co_filename, root_path), frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
+    if code is None:
+        return template or '<unknown>', False
+    return template or code[2], code[:2] in _AMORTIZED
+
+
+def audit_queries(endpoint, queries, origins, budget, threshold):
+    """Return the problems found in one request's queries, as human-readable messages.
+
+    ``queries`` are the statements recorded by SQLALCHEMY_RECORD_QUERIES and ``origins``
+    the matching ``(location, amortized)`` pairs. A SELECT whose shape is repeated
+    ``threshold`` times or more is reported as an N+1 with the places that issued it,
+    and the number of queries is checked against ``budget`` (None for no budget).
+    """
+    problems = []
+    counted = [(query, location) for query, (location, amortized) in zip(queries, origins) if not amortized]
+    if budget is not None and len(counted) > budget:
+        problems.append('%s issued %d queries, over its budget of %d:\n%s' % (
+            endpoint, len(counted), budget,
+            '\n'.join('  %s  %s' % (location, ' '.join(query.statement.split())) for query, location in counted)))
+
+    shapes = {}
+    for query, location in counted:
+        if query.statement.lstrip()[:6].upper() == 'SELECT':
+            shapes.setdefault(fingerprint_statement(query.statement), []).append(location)
+    for shape, locations in shapes.items():
+        if len(locations) >= threshold:
+            places = sorted(set(locations), key=locations.index)
+            problems.append('%s repeated a query %d times (N+1) from %s:\n  %s' % (
+                endpoint, len(locations), ', '.join(places), shape))
+    return problems
+
+
+def register_query_audit(app):
+    """Check each request for N+1 queries and query budgets (see MYBLOG_QUERY_AUDIT).
+
+    Meant for development and testing: every statement is traced back to the template
+    line or function that issued it, which costs a stack walk per query. With 'warn' the
+    problems are logged; with 'raise' the request fails with QueryAuditError so a
+    regression fails the test that made the request.
+    """
+    if not app.config['MYBLOG_QUERY_AUDIT']:
+        return
+    if not app.config['SQLALCHEMY_RECORD_QUERIES']:
+        raise RuntimeError('MYBLOG_QUERY_AUDIT needs SQLALCHEMY_RECORD_QUERIES')
+
+    def record_origin(conn, cursor, statement, parameters, context, executemany):
+        if has_app_context():
+            g.setdefault('myblog_query_origins', []).append(_query_origin(app.root_path))
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', record_origin)
+
+    @app.before_request
+    def mark_queries():
+        # 在已推入的应用上下文中（如命令里用测试客户端）g 与外层共用，只检查本请求的查询
+        request.environ['myblog.queries'] = (len(get_debug_queries()), len(g.get('myblog_query_origins', ())))
+
+    @app.after_request
+    def check_queries(response):
+        start, origins_start = request.environ.get('myblog.queries', (0, 0))
+        queries = get_debug_queries()[start:]
+        origins = g.get('myblog_query_origins', [])[origins_start:]
+        if len(origins) != len(queries):
+            # 与 Flask-SQLAlchemy 的记录对不上时不区分来源
+            origins = [('<unknown>', False)] * len(queries)
+        # 预算针对读页面；提交表单的请求只检查 N+1
+        budget = app.config['MYBLOG_QUERY_BUDGETS'].get(request.endpoint) if request.method == 'GET' else None
+        if budget is not None and request.blueprint != 'admin' and current_user.is_authenticated:
+            # 预算按访客测量；管理员浏览前台时还要加载用户和未读评论数
+            budget += app.config['MYBLOG_QUERY_BUDGET_LOGIN_EXTRA']
+        problems = audit_queries(request.endpoint, queries, origins, budget, app.config['MYBLOG_NPLUSONE_THRESHOLD'])
+        if problems and app.config['MYBLOG_QUERY_AUDIT'] == 'raise':
+            raise QueryAuditError('\n'.join(problems))
+        for problem in problems:
+            app.logger.warning(problem)
+        return response
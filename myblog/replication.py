@@ -0,0 +1,199 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import random
+import sqlite3
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app, request, session, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import select, func
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.expression import UpdateBase, TextClause
+
+# 提交过写入的浏览器带上这个 cookie，在 MYBLOG_READ_YOUR_WRITES 秒内读主库
+PRIMARY_COOKIE = 'myblog_primary'
+
+
+def replica_keys(app=None):
+    """Bind keys of the configured read replicas (``replica-0``, ``replica-1``, ...)."""
+    app = app or current_app
+    return ['replica-%d' % index for index in range(len(app.config['MYBLOG_REPLICA_URLS']))]
+
+
+def current_replica():
+    """Bind key of the replica serving the reads of the current request, or None for the primary."""
+    return g.get('myblog_replica') if has_app_context() else None
+
+
+def read_your_writes():
+    """Whether the current request comes from a browser that wrote recently and must read the primary."""
+    return bool(current_app.config['MYBLOG_REPLICA_URLS']) and PRIMARY_COOKIE in request.cookies
+
+
+class RoutingSession(Session):
+    """Session sending the SELECTs of a request routed to a replica (see ``g.myblog_replica``) there.
+
+    Flushes and INSERT / UPDATE / DELETE statements always go to the primary, and once
+    a request has written, the rest of its queries read the primary as well, so a view
+    sees its own changes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = current_replica() if bind is None else None
+        if replica is not None:
+            if self._flushing or isinstance(clause, UpdateBase) or \
+                    (isinstance(clause, TextClause) and clause.text.lstrip()[:6].upper() != 'SELECT'):
+                g.myblog_replica = None
+                g.myblog_wrote = True
+            else:
+                return self._db.engines[replica]
+        if self._flushing or isinstance(clause, UpdateBase):
+            if has_app_context():
+                g.myblog_wrote = True
+        return super(RoutingSession, self).get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _state(app):
+    return app.extensions.setdefault('myblog_replicas', {'checked_at': None, 'replicas': {}})
+
+
+def measure_lag(app):
+    """Return ``{bind key: lag in seconds, or None if the replica is unreachable}``.
+
+    Every content change bumps a row of cache_version on the primary, so the lag of a
+    replica is the age of the oldest bump it has not received yet (0 when it has all
+    of them), a portable heartbeat that needs no replication privileges.
+    """
+    from myblog.models import CacheVersion
+
+    now = datetime.utcnow()
+    lags = {}
+    for key in replica_keys(app):
+        try:
+            with app.extensions['sqlalchemy'].engines[key].connect() as connection:
+                applied = connection.execute(select(func.max(CacheVersion.timestamp))).scalar()
+        except Exception as e:
+            app.logger.warning('Read replica %s is unreachable: %s', key, e)
+            lags[key] = None
+            continue
+        statement = select(func.min(CacheVersion.timestamp))
+        if applied is not None:
+            statement = statement.where(CacheVersion.timestamp > applied)
+        with app.extensions['sqlalchemy'].engines[None].connect() as connection:
+            missing = connection.execute(statement).scalar()
+        lags[key] = max((now - missing).total_seconds(), 0) if missing is not None else 0
+    return lags
+
+
+def replica_status(app):
+    """The last measured lags, measured again at most every MYBLOG_REPLICA_CHECK_INTERVAL seconds."""
+    state = _state(app)
+    now = time.monotonic()
+    if state['checked_at'] is None or now - state['checked_at'] >= app.config['MYBLOG_REPLICA_CHECK_INTERVAL']:
+        state['checked_at'] = now
+        lags = measure_lag(app)
+        usable = {key for key, lag in lags.items() if lag is not None and lag <= app.config['MYBLOG_REPLICA_MAX_LAG']}
+        previous = {key for key, replica in state['replicas'].items() if replica['usable']}
+        if usable != previous and state['replicas']:
+            app.logger.warning('Read replicas in use: %s (lag: %s)', ', '.join(sorted(usable)) or 'none, reading the primary',
+                               ', '.join('%s %s' % (key, '%.1fs' % lag if lag is not None else 'down')
+                                         for key, lag in sorted(lags.items())))
+        state['replicas'] = {key: {'lag': lag, 'usable': key in usable} for key, lag in lags.items()}
+    return state['replicas']
+
+
+def choose_replica(app):
+    """A replica within MYBLOG_REPLICA_MAX_LAG for the current request, or None to read the primary."""
+    if not app.config['MYBLOG_REPLICA_URLS'] or request.method not in ('GET', 'HEAD') or \
+            request.blueprint != 'blog' or '_user_id' in session or read_your_writes():
+        return None
+    usable = [key for key, replica in replica_status(app).items() if replica['usable']]
+    return random.choice(usable) if usable else None
+
+
+def register_read_replicas(app):
+    """Route the public pages' reads to MYBLOG_REPLICA_URLS and keep writers on the primary.
+
+    Anonymous GET requests to the blog read a replica whose lag is within
+    MYBLOG_REPLICA_MAX_LAG, or the primary when none is; the admin, logins and every
+    write use the primary. After a request that wrote, the browser gets a cookie that
+    keeps its reads on the primary for MYBLOG_READ_YOUR_WRITES seconds, so a
+    commenter sees their comment even before the replicas do.
+    """
+    if not app.config['MYBLOG_REPLICA_URLS']:
+        return
+
+    @app.before_request
+    def route_reads():
+        g.myblog_replica = choose_replica(app)
+        request.environ['myblog.db'] = g.myblog_replica or 'primary'
+
+    @app.after_request
+    def mark_writer(response):
+        if g.get('myblog_wrote'):
+            response.set_cookie(PRIMARY_COOKIE, '1', max_age=app.config['MYBLOG_READ_YOUR_WRITES'],
+                                httponly=True, samesite='Lax')
+        return response
+
+
+def sqlite_path(url):
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise ValueError('%s is not a SQLite file.' % url)
+    return url.database
+
+
+class SQLiteReplicator(object):
+    """Stand-in for database replication: copies a SQLite primary to replica files.
+
+    Each ``tick()`` takes a snapshot of the primary with SQLite's backup API and writes
+    to the replicas the newest snapshot that is at least ``lag`` seconds old, so the
+    replicas trail the primary like asynchronous replicas do. Every snapshot is a full
+    copy, which is fine for development databases.
+    """
+
+    def __init__(self, primary, replicas, lag=0):
+        self.primary = primary
+        self.replicas = replicas
+        self.lag = lag
+        self.snapshots = deque()
+
+    def tick(self):
+        """Snapshot the primary and apply the due snapshot; returns whether the replicas were updated."""
+        snapshot = sqlite3.connect(':memory:')
+        source = sqlite3.connect(self.primary)
+        try:
+            source.backup(snapshot)
+        finally:
+            source.close()
+        self.snapshots.append((time.monotonic(), snapshot))
+        due = None
+        while self.snapshots and time.monotonic() - self.snapshots[0][0] >= self.lag:
+            if due is not None:
+                due.close()
+            due = self.snapshots.popleft()[1]
+        if due is None:
+            return False
+        for path in self.replicas:
+            target = sqlite3.connect(path, timeout=30)
+            try:
+                due.backup(target)
+            finally:
+                target.close()
+        due.close()
+        return True
+
+    def run(self, interval=1, echo=None):
+        while True:
+            started = time.monotonic()
+            if self.tick() and echo is not None:
+                echo('%s  copied %s to %s' % (datetime.now().strftime('%H:%M:%S'), os.path.basename(self.primary),
+                                              ', '.join(os.path.basename(path) for path in self.replicas)))
+            time.sleep(max(interval - (time.monotonic() - started), 0))
@@ -0,0 +1,195 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import fnmatch
+import socketserver
+import time
+import zlib
+from threading import Lock, Thread
+
+
+class _RESPHandler(socketserver.StreamRequestHandler):
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # telnet 之类手工输入的内联命令
+            return line.split()
+        args = []
+        for i in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            try:
+                args = self.read_command()
+            except ValueError:
+                self.wfile.write(b'-ERR Protocol error\r\n')
+                return
+            if args is None:
+                return
+            if not args:
+                continue
+            name = args[0].decode('ascii', 'replace').upper()
+            if name == 'QUIT':
+                self.wfile.write(b'+OK\r\n')
+                return
+            command = getattr(self.server, 'command_' + name.lower(), None)
+            if command is None:
+                self.wfile.write(b"-ERR unknown command '%s'\r\n" % args[0])
+                continue
+            try:
+                reply = command(*args[1:])
+            except (TypeError, ValueError):
+                reply = RESPServer.Error("ERR syntax error or wrong number of arguments for '%s'" % name.lower())
+            self.wfile.write(_encode(reply))
+
+
+def _encode(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, RESPServer.Error):
+        return b'-%s\r\n' % str(reply).encode('utf-8')
+    if isinstance(reply, RESPServer.Status):
+        return b'+%s\r\n' % str(reply).encode('utf-8')
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, list):
+        return b'*%d\r\n' % len(reply) + b''.join(_encode(item) for item in reply)
+    return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+
+class RESPServer(socketserver.ThreadingTCPServer):
+    """A small in-memory server speaking the subset of the Redis protocol the cache uses.
+
+    A stand-in for Redis in development and tests: point MYBLOG_CACHE_URL at
+    ``redis://127.0.0.1:<port>``. Supports PING, GET, SET (EX, PX, NX, XX), DEL,
+    EXISTS, PTTL, KEYS, SCAN (MATCH, COUNT), DBSIZE, FLUSHDB, SELECT, AUTH and QUIT, with a
+    single database.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    class Error(str):
+        pass
+
+    class Status(str):
+        pass
+
+    def __init__(self, host='127.0.0.1', port=6379):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _RESPHandler)
+        self.lock = Lock()
+        self.data = {}
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serve in a background thread and return self, for use in tests."""
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def _get(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def command_ping(self, message=None):
+        return message if message is not None else self.Status('PONG')
+
+    def command_auth(self, *args):
+        return self.Status('OK')
+
+    def command_select(self, db):
+        int(db)
+        return self.Status('OK')
+
+    def command_get(self, key):
+        with self.lock:
+            entry = self._get(key)
+            return entry[0] if entry is not None else None
+
+    def command_set(self, key, value, *options):
+        expires, condition = None, None
+        options = [option.upper() for option in options]
+        while options:
+            option = options.pop(0)
+            if option in (b'EX', b'PX'):
+                amount = int(options.pop(0))
+                expires = time.monotonic() + (amount if option == b'EX' else amount / 1000.0)
+            elif option in (b'NX', b'XX'):
+                condition = option
+            else:
+                raise ValueError(option)
+        with self.lock:
+            exists = self._get(key) is not None
+            if (condition == b'NX' and exists) or (condition == b'XX' and not exists):
+                return None
+            self.data[key] = (value, expires)
+        return self.Status('OK')
+
+    def command_del(self, *keys):
+        with self.lock:
+            return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def command_exists(self, *keys):
+        with self.lock:
+            return sum(self._get(key) is not None for key in keys)
+
+    def command_pttl(self, key):
+        with self.lock:
+            entry = self._get(key)
+        if entry is None:
+            return -2
+        return -1 if entry[1] is None else int((entry[1] - time.monotonic()) * 1000)
+
+    def command_keys(self, pattern):
+        pattern = pattern.decode('utf-8')
+        with self.lock:
+            keys = [key for key in list(self.data) if self._get(key) is not None]
+        return [key for key in keys if fnmatch.fnmatchcase(key.decode('utf-8', 'replace'), pattern)]
+
+    def command_scan(self, cursor, *options):
+        cursor, pattern, count = int(cursor), '*', 10
+        options = list(options)
+        while options:
+            option = options.pop(0).upper()
+            if option == b'MATCH':
+                pattern = options.pop(0).decode('utf-8')
+            elif option == b'COUNT':
+                count = int(options.pop(0))
+                if count < 1:
+                    raise ValueError(count)
+            else:
+                raise ValueError(option)
+        # 与 Redis 一样按键的散列值遍历，游标是下一个散列值；删除已返回的键不会让后面的键被跳过
+        with self.lock:
+            keys = sorted((zlib.crc32(key) + 1, key) for key in list(self.data) if self._get(key) is not None)
+        keys = [(order, key) for order, key in keys if order >= cursor]
+        # 散列值相同的键放在同一批里返回
+        last = keys[count - 1][0] if len(keys) >= count else None
+        later = [order for order, key in keys if last is not None and order > last]
+        cursor = later[0] if later else 0
+        if cursor:
+            keys = [(order, key) for order, key in keys if order < cursor]
+        return [str(cursor).encode('ascii'),
+                [key for order, key in keys if fnmatch.fnmatchcase(key.decode('utf-8', 'replace'), pattern)]]
+
+    def command_dbsize(self):
+        with self.lock:
+            return len(self.data)
+
+    def command_flushdb(self, *args):
+        with self.lock:
+            self.data.clear()
+        return self.Status('OK')
@@ -0,0 +1,246 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import re
+
+from flask import current_app
+from flask_sqlalchemy.pagination import Pagination
+from markupsafe import Markup, escape
+from sqlalchemy import and_, column, delete, event, table, text
+
+from myblog.extensions import db
+from myblog.models import Post
+
+# 高亮标记，先用控制字符占位，转义后再替换成 <mark>
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def _dialect(bind=None):
+    return (bind or db.engine).dialect.name
+
+
+def create_search_index(bind):
+    """Create the full-text table: an FTS5 virtual table on SQLite, a FULLTEXT-indexed table on MySQL."""
+    dialect = _dialect(bind)
+    if dialect == 'sqlite':
+        tokenizer = current_app.config['MYBLOG_SEARCH_TOKENIZER']
+        bind.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+            "kind UNINDEXED, ref_id UNINDEXED, post_id UNINDEXED, title, body, tokenize='%s')" % tokenizer))
+    elif dialect == 'mysql':
+        bind.execute(text(
+            'CREATE TABLE IF NOT EXISTS search_index ('
+            'id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY, '
+            'kind VARCHAR(10) NOT NULL, ref_id INTEGER NOT NULL, post_id INTEGER NOT NULL, '
+            'title VARCHAR(255), body LONGTEXT, '
+            'KEY ix_search_index_ref (kind, ref_id), KEY ix_search_index_post_id (post_id), '
+            'FULLTEXT KEY ft_search_index (title, body) WITH PARSER ngram'
+            ') ENGINE=InnoDB DEFAULT CHARSET=utf8mb4'))
+
+
+def drop_search_index(bind):
+    if _dialect(bind) in ('sqlite', 'mysql'):
+        bind.execute(text('DROP TABLE IF EXISTS search_index'))
+
+
+# db.create_all()/drop_all() 时一并处理全文索引表
+event.listen(db.metadata, 'after_create', lambda target, connection, **kw: create_search_index(connection))
+event.listen(db.metadata, 'before_drop', lambda target, connection, **kw: drop_search_index(connection))
+
+
+def _enabled():
+    return _dialect() in ('sqlite', 'mysql')
+
+
+# 只用于生成 DELETE 语句，表本身由 create_search_index 创建
+search_table = table('search_index', column('rowid'), column('kind'), column('ref_id'), column('post_id'))
+
+_KINDS = {'post': 0, 'comment': 1}
+
+
+def _rowid(kind, ref_id):
+    """Rowid of a row of the FTS5 table, derived from its kind and id.
+
+    Only the rowid of an FTS5 table is indexed, so rows are looked up by it rather than
+    by the UNINDEXED kind and ref_id columns, which would scan the whole table.
+    """
+    return ref_id * 2 + _KINDS[kind]
+
+
+def _insert(kind, ref_id, post_id, title, body):
+    params = dict(kind=kind, ref_id=ref_id, post_id=post_id, title=title, body=body)
+    if _dialect() == 'sqlite':
+        db.session.execute(
+            text('INSERT INTO search_index (rowid, kind, ref_id, post_id, title, body) '
+                 'VALUES (:rowid, :kind, :ref_id, :post_id, :title, :body)'),
+            dict(params, rowid=_rowid(kind, ref_id)))
+    else:
+        db.session.execute(
+            text('INSERT INTO search_index (kind, ref_id, post_id, title, body) '
+                 'VALUES (:kind, :ref_id, :post_id, :title, :body)'), params)
+
+
+def _delete(kind, ids):
+    """Delete the rows of the listed ids, in batches to stay within the databases' parameter limits."""
+    for start in range(0, len(ids), 500):
+        batch = ids[start:start + 500]
+        if _dialect() == 'sqlite':
+            criterion = search_table.c.rowid.in_([_rowid(kind, id) for id in batch])
+        else:
+            # MySQL 表上有 (kind, ref_id) 索引
+            criterion = and_(search_table.c.kind == kind, search_table.c.ref_id.in_(batch))
+        db.session.execute(delete(search_table).where(criterion))
+
+
+def index_post(post):
+    """(Re)index a post; call after it has an id, inside the same transaction as the write."""
+    if not _enabled():
+        return
+    _delete('post', [post.id])
+    _insert('post', post.id, post.id, post.title, post.plain_text)
+
+
+def index_comment(comment):
+    if not _enabled():
+        return
+    _delete('comment', [comment.id])
+    if comment.reviewed:
+        _insert('comment', comment.id, comment.post_id, '', comment.body)
+
+
+def remove_post(post):
+    """Remove a post from the index; its comments are removed with remove_comments()."""
+    if _enabled():
+        _delete('post', [post.id])
+
+
+def remove_comments(ids):
+    """Remove deleted comments, e.g. the ids returned by ``delete_comment_tree``, from the index."""
+    if _enabled():
+        _delete('comment', list(ids))
+
+
+def fill_search_index(bind):
+    """Replace the contents of the index with the post and comment tables. Returns the number of rows."""
+    bind.execute(text('DELETE FROM search_index'))
+    # 在数据库内整表复制，不经过 Python 逐行插入；SQLite 上同时写入由 kind 和 id 算出的 rowid
+    if _dialect(bind) == 'sqlite':
+        posts = "INSERT INTO search_index (rowid, kind, ref_id, post_id, title, body) " \
+                "SELECT id * 2, 'post', id, id, title, plain_text FROM post"
+        comments = "INSERT INTO search_index (rowid, kind, ref_id, post_id, title, body) " \
+                   "SELECT id * 2 + 1, 'comment', id, post_id, '', body FROM comment WHERE reviewed = :reviewed"
+    else:
+        posts = "INSERT INTO search_index (kind, ref_id, post_id, title, body) " \
+                "SELECT 'post', id, id, title, plain_text FROM post"
+        comments = "INSERT INTO search_index (kind, ref_id, post_id, title, body) " \
+                   "SELECT 'comment', id, post_id, '', body FROM comment WHERE reviewed = :reviewed"
+    count = bind.execute(text(posts)).rowcount
+    count += bind.execute(text(comments), dict(reviewed=True)).rowcount
+    return count
+
+
+def reindex():
+    """Rebuild the whole index from the post and comment tables. Returns the number of rows indexed."""
+    if not _enabled():
+        return 0
+    count = fill_search_index(db.session.connection())
+    db.session.commit()
+    return count
+
+
+def _highlight(value):
+    """Escape FTS output and turn the placeholder markers into <mark> tags."""
+    return Markup(str(escape(value)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def _mark_terms(value, terms, width=None):
+    """Python-side highlight (and optional snippet) for backends without FTS5's helpers."""
+    if width is not None and len(value) > width:
+        lowered = value.lower()
+        positions = [lowered.find(term.lower()) for term in terms]
+        start = max(min([position for position in positions if position >= 0], default=0) - width // 4, 0)
+        value = ('…' if start else '') + value[start:start + width] + '…'
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE) if terms else None
+    if pattern is not None:
+        value = pattern.sub(lambda m: MARK_START + m.group(0) + MARK_END, value)
+    return _highlight(value)
+
+
+class SearchResult(object):
+
+    def __init__(self, kind, ref_id, post_id, title, snippet, score):
+        self.kind = kind
+        self.ref_id = ref_id
+        self.post_id = post_id
+        self.title = title
+        self.snippet = snippet
+        self.score = score
+        self.post_title = None
+
+
+class SearchPagination(Pagination):
+    """Ranked search results, paginated with the same interface as ``Query.paginate``."""
+
+    def _query_items(self):
+        q, offset, limit = self._query_args['q'], self._query_offset, self.per_page
+        dialect = _dialect()
+        if dialect == 'sqlite':
+            rows = db.session.execute(text(
+                "SELECT kind, ref_id, post_id, highlight(search_index, 3, :start, :end), "
+                "snippet(search_index, 4, :start, :end, '…', 32), bm25(search_index, 0, 0, 0, 10.0, 1.0) AS score "
+                "FROM search_index WHERE search_index MATCH :q ORDER BY score LIMIT :limit OFFSET :offset"),
+                dict(q=_fts5_query(q), start=MARK_START, end=MARK_END, limit=limit, offset=offset))
+            results = [SearchResult(kind, ref_id, post_id, _highlight(title), _highlight(snippet), score)
+                       for kind, ref_id, post_id, title, snippet, score in rows]
+        elif dialect == 'mysql':
+            terms = q.split()
+            rows = db.session.execute(text(
+                'SELECT kind, ref_id, post_id, title, body, '
+                'MATCH (title, body) AGAINST (:q IN NATURAL LANGUAGE MODE) AS score '
+                'FROM search_index WHERE MATCH (title, body) AGAINST (:q IN NATURAL LANGUAGE MODE) '
+                'ORDER BY score DESC LIMIT :limit OFFSET :offset'),
+                dict(q=q, limit=limit, offset=offset))
+            results = [SearchResult(kind, ref_id, post_id, _mark_terms(title or '', terms),
+                                    _mark_terms(body or '', terms, width=200), score)
+                       for kind, ref_id, post_id, title, body, score in rows]
+        else:
+            # 其他数据库没有全文索引，退化为对文章的 LIKE 查询
+            pattern = '%%%s%%' % q
+            posts = Post.query.filter(db.or_(Post.title.like(pattern), Post.plain_text.like(pattern))) \
+                .order_by(Post.timestamp.desc()).limit(limit).offset(offset).all()
+            results = [SearchResult('post', post.id, post.id, _mark_terms(post.title, q.split()),
+                                    _mark_terms(post.plain_text, q.split(), width=200), 0)
+                       for post in posts]
+
+        # 评论结果显示所属文章的标题，一次查询取回
+        post_ids = {result.post_id for result in results if result.kind == 'comment'}
+        if post_ids:
+            titles = dict(db.session.query(Post.id, Post.title).filter(Post.id.in_(post_ids)).all())
+            for result in results:
+                result.post_title = titles.get(result.post_id)
+        return results
+
+    def _query_count(self):
+        q = self._query_args['q']
+        dialect = _dialect()
+        if dialect == 'sqlite':
+            return db.session.execute(text('SELECT count(*) FROM search_index WHERE search_index MATCH :q'),
+                                      dict(q=_fts5_query(q))).scalar()
+        if dialect == 'mysql':
+            return db.session.execute(text(
+                'SELECT count(*) FROM search_index '
+                'WHERE MATCH (title, body) AGAINST (:q IN NATURAL LANGUAGE MODE)'), dict(q=q)).scalar()
+        pattern = '%%%s%%' % q
+        return Post.query.filter(db.or_(Post.title.like(pattern), Post.plain_text.like(pattern))).count()
+
+
+def _fts5_query(q):
+    # 每个词都作为短语加引号，避免用户输入被当作 FTS5 查询语法
+    return ' '.join('"%s"' % term.replace('"', '""') for term in q.split())
+
+
+def search(q, page, per_page):
+    return SearchPagination(page=page, per_page=per_page, q=q)
@@ -23,45 +23,200 @@ class BaseConfig(object):
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_RECORD_QUERIES = True
+
+    # 每个 SQLite 连接建立时执行的 PRAGMA：WAL 让读写互不阻塞，写锁冲突时最多等待 busy_timeout 毫秒
+    MYBLOG_SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,  # 负数单位为 KiB，每个连接约 16MB
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    }
+    # 每个进程的连接池 (pool_size, max_overflow)，按 gunicorn worker 类型选择；
+    # 类型取自 MYBLOG_WORKER_CLASS（gunicorn_config.py 会设置），未设置时检测 gevent
+    MYBLOG_WORKER_CLASS = os.getenv('MYBLOG_WORKER_CLASS')
+    MYBLOG_DB_POOL_SIZES = {
+        'sync': (2, 2),  # 一次一个请求，另加发信和图片处理线程
+        'gthread': (4, 8),
+        'gevent': (10, 20),
+    }
+    MYBLOG_DB_POOL_TIMEOUT = 10
+    # MySQL 在 wait_timeout 后断开空闲连接（很多主机设为 300 秒），提前回收并在取用前检测
+    MYBLOG_DB_POOL_RECYCLE = 280
+    # 只读副本的数据库地址（逗号分隔）：匿名访客浏览前台的查询发到副本，后台、登录和写入使用主库
+    MYBLOG_REPLICA_URLS = [url.strip() for url in os.getenv('MYBLOG_REPLICA_URLS', '').split(',') if url.strip()]
+    # 副本落后主库超过这么多秒时改读主库；每个 worker 每隔多少秒检查一次
+    MYBLOG_REPLICA_MAX_LAG = 5
+    MYBLOG_REPLICA_CHECK_INTERVAL = 1
+    # 写入后这么多秒内同一个浏览器的请求都读主库，能看到自己的修改
+    MYBLOG_READ_YOUR_WRITES = 10
     
     CKEDITOR_ENABLE = True
     CKEDITOR_FILE_UPLOADER = 'admin.upload_image'
     CKEDITOR_ENABLE_CSRF = True  # 启用CSRF保护
     CKEDITOR_HEIGHT = 400  # 编辑器高度
+    # 以下为 flask_ckeditor 的默认值，推迟导入 flask_ckeditor 时由这里提供
+    CKEDITOR_SERVE_LOCAL = False
+    CKEDITOR_PKG_TYPE = 'standard'
+    CKEDITOR_LANGUAGE = ''
+    CKEDITOR_WIDTH = 0
+    CKEDITOR_CODE_THEME = 'monokai_sublime'
+    CKEDITOR_FILE_BROWSER = ''
+    CKEDITOR_UPLOAD_ERROR_MESSAGE = 'Upload failed.'
+    CKEDITOR_ENABLE_CODESNIPPET = False
+    CKEDITOR_EXTRA_PLUGINS = []
 
     MAIL_SERVER = os.getenv('MAIL_SERVER')
-    MAIL_PORT = 465
-    MAIL_USE_SSL = True
+    MAIL_PORT = int(os.getenv('MAIL_PORT', 465))
+    MAIL_USE_SSL = os.getenv('MAIL_USE_SSL', 'true').lower() == 'true'
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = ('Myblog Admin', 'MAIL_USERNAME')
 
     MYBLOG_EMAIL = os.getenv('MYBLOG_EMAIL')
+    # 发件队列：后台线程轮询间隔、批量大小、领取租约、合并窗口与重试退避（秒）
+    MYBLOG_MAIL_QUEUE_THREAD = True
+    MYBLOG_MAIL_POLL_INTERVAL = 5
+    MYBLOG_MAIL_BATCH_SIZE = 50
+    MYBLOG_MAIL_LEASE = 300
+    MYBLOG_MAIL_DIGEST_WINDOW = 60
+    MYBLOG_MAIL_IDLE_TIMEOUT = 60
+    MYBLOG_MAIL_MAX_ATTEMPTS = 6
+    MYBLOG_MAIL_RETRY_BACKOFF = 30
+    MYBLOG_MAIL_RETRY_BACKOFF_MAX = 3600
     MYBLOG_POST_PER_PAGE = 10
     MYBLOG_MANAGE_POST_PER_PAGE = 15
     MYBLOG_COMMENT_PER_PAGE = 15
+    MYBLOG_SEARCH_RESULT_PER_PAGE = 20
+    # 订阅源中的文章数量，以及是否输出全文（否则只有摘要）
+    MYBLOG_FEED_ITEMS = 20
+    MYBLOG_FEED_FULL_TEXT = True
+    # 每个文章站点地图分片覆盖的文章 id 范围（协议上限为 50000 条）
+    MYBLOG_SITEMAP_SHARD_SIZE = 5000
+    # SQLite FTS5 分词器，中文内容可改为 'trigram'（至少三个字符的查询）
+    MYBLOG_SEARCH_TOKENIZER = 'unicode61'
+    # 列表使用基于 (timestamp, id) 的游标分页，?page=N 的旧链接仍然可用
+    MYBLOG_KEYSET_PAGINATION = True
     #('THEME NAME','display name')
     MYBLOG_THEMES = {'perfect_blue':'Perfect Blue','black_swan':'Black Swan'}
     MYBLOG_SLOW_QUERY_THRESHOLD = 1
+    # /metrics 性能指标：各 worker 把计数写到 MYBLOG_METRICS_DIR 下自己的文件中，抓取时汇总
+    MYBLOG_METRICS = True
+    MYBLOG_METRICS_DIR = os.getenv('MYBLOG_METRICS_DIR', os.path.join(basedir, 'logs', 'metrics'))
+    MYBLOG_METRICS_FLUSH_INTERVAL = 2
+    # 设置后抓取需带 Authorization: Bearer <token>；未设置时只允许本机直接访问（不经反向代理）
+    MYBLOG_METRICS_TOKEN = os.getenv('MYBLOG_METRICS_TOKEN')
+    MYBLOG_METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    # 各视图允许的最大查询数，由 flask check-queries 检查，开启 MYBLOG_QUERY_AUDIT 时每个请求都检查
+    MYBLOG_QUERY_BUDGETS = {
+        'blog.index': 2,
+        'blog.about': 1,
+        'blog.show_category': 3,
+        'blog.show_post': 3,
+        'admin.manage_post': 5,
+        'admin.manage_comment': 5,
+        'admin.manage_category': 3,
+        'admin.manage_link': 3,
+    }
+    # 检查每个请求的 N+1 查询和查询预算：None、'warn'（记录日志）或 'raise'（请求失败，用于测试）
+    MYBLOG_QUERY_AUDIT = None
+    # 同一形状的 SELECT 在一个请求中出现这么多次即视为 N+1
+    MYBLOG_NPLUSONE_THRESHOLD = 3
+    # 管理员访问前台页面时在预算之外允许的查询（加载用户、未读评论数）
+    MYBLOG_QUERY_BUDGET_LOGIN_EXTRA = 2
+    # 每个 worker 最多每隔多少秒到数据库检查一次缓存版本号
+    MYBLOG_CACHE_VERSION_CHECK_INTERVAL = 2
+    # 匿名访客整页缓存的最大条目数，0 表示关闭
+    MYBLOG_PAGE_CACHE_SIZE = 500
+    # 模板中 {% cache %} 片段缓存的最大条目数，0 表示关闭
+    MYBLOG_FRAGMENT_CACHE_SIZE = 1000
+    # 缓存后端：memory://（每个 worker 各一份）、sqlite:///<文件>（同一台机器上的 worker 共用）
+    # 或 redis://[:密码@]主机[:端口][/库]（可以用 flask cache-server 启动的替身服务器）
+    MYBLOG_CACHE_URL = os.getenv('MYBLOG_CACHE_URL', 'memory://')
+    # 其他命名空间的最大条目数，以及没有指定时的过期时间（秒）
+    MYBLOG_CACHE_SIZE = 1000
+    MYBLOG_CACHE_DEFAULT_TTL = 3600
+    # 每次渲染都要读取的小对象总是缓存在进程内，不经过共享后端
+    MYBLOG_CACHE_LOCAL_NAMESPACES = ('site',)
+    # 连接和读写共享后端的超时；出错后这么多秒内不再访问，按未命中处理
+    MYBLOG_CACHE_TIMEOUT = 0.5
+    MYBLOG_CACHE_RETRY_INTERVAL = 5
+    # 重新计算同一个键的租约时长，以及其他 worker 最多等待多久
+    MYBLOG_CACHE_LOCK_TIMEOUT = 10
+    MYBLOG_CACHE_LOCK_WAIT = 2
 
     MYBLOG_UPLOAD_PATH = os.path.join(basedir,'uploads')
     MYBLOG_ALLOWED_IMAGE_EXTENSIONS = {'png','jpg','jpeg','gif'}
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+    # 上传图片生成的缩略图宽度（不超过原图），以及文章中图片的显示宽度
+    MYBLOG_IMAGE_WIDTHS = (320, 640, 960, 1280)
+    MYBLOG_IMAGE_SIZES = '(max-width: 768px) 100vw, 730px'
+    MYBLOG_IMAGE_QUALITY = 82
+    MYBLOG_IMAGE_WEBP_QUALITY = 80
+    # 每个 worker 处理图片的线程数，0 表示在上传请求中同步处理
+    MYBLOG_IMAGE_WORKERS = 2
+    # 内容寻址的上传文件和带指纹的静态文件缓存一年，旧的上传文件缓存一小时
+    MYBLOG_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+    MYBLOG_UPLOAD_MAX_AGE = 3600
+    # 交给前端服务器发送上传文件：None、'x-sendfile'（Apache/lighttpd）或 'x-accel'（nginx）
+    MYBLOG_UPLOAD_OFFLOAD = os.getenv('MYBLOG_UPLOAD_OFFLOAD')
+    # nginx 中指向 MYBLOG_UPLOAD_PATH 的 internal location
+    MYBLOG_UPLOAD_ACCEL_PREFIX = '/_uploads/'
+
+    # flask export 的输出目录，以及处理评论、后台和搜索的 Flask 应用地址
+    MYBLOG_EXPORT_PATH = os.path.join(basedir,'public')
+    MYBLOG_EXPORT_APP_URL = os.getenv('MYBLOG_EXPORT_APP_URL', '')
+    MYBLOG_EXPORT_SITE_URL = os.getenv('MYBLOG_EXPORT_SITE_URL', 'http://localhost')
+    MYBLOG_STATIC_EXPORT = False  # 渲染导出页面时由 flask export 打开
+
+    # 启动优化：只有后台或开发时用到的扩展（CKEditor、Flask-Migrate）推迟到第一次用到时导入，
+    # 缩短 serverless 部署的冷启动时间；flask profile-imports 和 flask cold-start 用来测量
+    MYBLOG_LAZY_EXTENSIONS = os.getenv('MYBLOG_LAZY_EXTENSIONS', 'false').lower() == 'true'
+    MYBLOG_DEBUG_TOOLBAR = False
+    # Jinja 模板字节码缓存目录，所有 worker 共用，None 表示不使用；
+    # 缓存文件会被直接加载执行，目录只能属于运行博客的用户，不要放在 /tmp 这类公共目录下
+    MYBLOG_TEMPLATE_CACHE_PATH = os.getenv('MYBLOG_TEMPLATE_CACHE_PATH', os.path.join(basedir, 'cache', 'jinja'))
+    # gunicorn 在主进程中预加载应用后请求一次的页面（见 gunicorn_config.py）
+    MYBLOG_WARMUP_PATHS = ('/', '/about', '/auth/login')
+
+    # flask bench 生成的各规模数据集和结果文件所在目录
+    MYBLOG_BENCH_PATH = os.getenv('MYBLOG_BENCH_PATH', os.path.join(basedir,'bench'))
 
 class DevelopmentConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = prefix + os.path.join(basedir,'data-dev.db')
+    MYBLOG_QUERY_AUDIT = 'warn'
+    MYBLOG_DEBUG_TOOLBAR = False  # 暂时禁用debug toolbar以解决跨盘符问题
 
 class TestingConfig(BaseConfig):
     TESTING = True
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    MYBLOG_CACHE_VERSION_CHECK_INTERVAL = 0
+    MYBLOG_QUERY_AUDIT = 'raise'
+    MYBLOG_IMAGE_WORKERS = 0
+    MYBLOG_METRICS_DIR = None  # 只统计当前进程
+    MYBLOG_TEMPLATE_CACHE_PATH = None
+    MYBLOG_MAIL_QUEUE_THREAD = False  # 测试中用 flask send-mail 或 get_dispatcher().dispatch() 同步发送
 
 class ProductionConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL',prefix + os.path.join(basedir,'data.db'))    
+    MYBLOG_LAZY_EXTENSIONS = os.getenv('MYBLOG_LAZY_EXTENSIONS', 'true').lower() == 'true'
+    # gunicorn 的各个 worker 共用一份缓存，每个页面只需渲染一次；
+    # 缓存值是 pickle，文件同样不要放在 /tmp 这类公共目录下
+    MYBLOG_CACHE_URL = os.getenv('MYBLOG_CACHE_URL', 'sqlite:///' + os.path.join(basedir, 'cache', 'myblog-cache.db'))
+
+class BenchmarkConfig(ProductionConfig):
+    # flask bench 用生产配置压测，数据库由 myblog.bench.create_bench_app 指定
+    WTF_CSRF_ENABLED = False  # 压测脚本直接提交表单，不先取令牌
+    MYBLOG_MAIL_QUEUE_THREAD = False  # 通知邮件只进发件队列
+    MYBLOG_METRICS_DIR = None
     
 config = {
     'development':DevelopmentConfig,
     'testing':TestingConfig,
-    'production':ProductionConfig
+    'production':ProductionConfig,
+    'benchmark':BenchmarkConfig
 }
     
     
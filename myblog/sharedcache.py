@@ -0,0 +1,551 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit, unquote
+
+from flask import current_app
+
+# 共享后端中的键：myblog:<部署指纹>:<命名空间>:<键>
+KEY_PREFIX = 'myblog'
+
+
+class CacheError(Exception):
+    """The cache backend could not be reached or answered with an error."""
+
+
+class MemoryBackend(object):
+    """Process-local LRU cache with a TTL per entry and a size limit per namespace.
+
+    Values are stored as they are, without pickling, so callers must not modify them.
+    """
+    shared = False
+
+    def __init__(self, limits=None, default_size=1000):
+        self.limits = limits or {}
+        self.default_size = default_size
+        self.lock = threading.Lock()
+        self.namespaces = {}
+        self.evictions = 0
+
+    def _entries(self, namespace):
+        entries = self.namespaces.get(namespace)
+        if entries is None:
+            entries = self.namespaces[namespace] = OrderedDict()
+        return entries
+
+    def get(self, namespace, key):
+        with self.lock:
+            entries = self._entries(namespace)
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return value
+
+    def set(self, namespace, key, value, ttl):
+        size = self.limits.get(namespace, self.default_size)
+        if size <= 0:
+            return
+        with self.lock:
+            entries = self._entries(namespace)
+            entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            entries.move_to_end(key)
+            while len(entries) > size:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def add(self, namespace, key, value, ttl):
+        with self.lock:
+            entries = self._entries(namespace)
+            entry = entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                return False
+            entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            return True
+
+    def delete(self, namespace, key):
+        with self.lock:
+            self._entries(namespace).pop(key, None)
+
+    def clear(self, namespace=None):
+        with self.lock:
+            if namespace is None:
+                self.namespaces.clear()
+            else:
+                self.namespaces.pop(namespace, None)
+
+    def size(self, namespace):
+        return len(self.namespaces.get(namespace, ()))
+
+
+class SQLiteBackend(object):
+    """Cache in a SQLite file, shared by the workers on one host.
+
+    Values are pickled. Reads refresh an entry's access time at most once per
+    TOUCH_INTERVAL seconds, and every TRIM_INTERVAL writes to a namespace remove its
+    expired entries and the least recently used ones above the namespace's limit.
+    Each process opens its own connection on first use, also after a fork.
+
+    Since unpickling a value can run code, the file is created readable and writable
+    by the current user only, and a file owned by someone else or writable by group or
+    others is refused.
+    """
+    shared = True
+    TOUCH_INTERVAL = 60
+    TRIM_INTERVAL = 100
+
+    def __init__(self, path, limits=None, default_size=1000, timeout=0.5):
+        self.path = path
+        self.limits = limits or {}
+        self.default_size = default_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+        self.writes = {}
+
+    def _connect(self):
+        if self.connection is not None and self.pid == os.getpid():
+            return self.connection
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        try:
+            os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+            st = os.stat(self.path)
+        except OSError as e:
+            raise CacheError('%s: %s' % (self.path, e))
+        if os.name != 'nt' and (st.st_uid != os.getuid() or st.st_mode & 0o022):
+            raise CacheError('%s must be owned by the current user and not writable by group or others.' % self.path)
+        # fork 继承的连接属于父进程，不关闭也不再使用
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        # 缓存内容丢了可以重建，不需要每次写入都落盘
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, namespace TEXT NOT NULL, '
+                           'value BLOB NOT NULL, expires REAL, accessed REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_namespace_accessed ON cache (namespace, accessed)')
+        self.connection, self.pid, self.writes = connection, os.getpid(), {}
+        return connection
+
+    @contextmanager
+    def _cursor(self):
+        with self.lock:
+            try:
+                yield self._connect()
+            except sqlite3.Error as e:
+                raise CacheError('%s: %s' % (self.path, e))
+
+    def get(self, namespace, key):
+        now = time.time()
+        with self._cursor() as connection:
+            row = connection.execute('SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires, accessed = row
+            if expires is not None and expires <= now:
+                return None
+            if now - accessed >= self.TOUCH_INTERVAL:
+                connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(value)
+
+    def set(self, namespace, key, value, ttl):
+        size = self.limits.get(namespace, self.default_size)
+        if size <= 0:
+            return
+        now = time.time()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._cursor() as connection:
+            connection.execute('INSERT OR REPLACE INTO cache (key, namespace, value, expires, accessed) '
+                               'VALUES (?, ?, ?, ?, ?)', (key, namespace, data, now + ttl if ttl else None, now))
+            writes = self.writes[namespace] = self.writes.get(namespace, 0) + 1
+            if writes % self.TRIM_INTERVAL == 0:
+                self._trim(connection, namespace, size, now)
+
+    @staticmethod
+    def _trim(connection, namespace, size, now):
+        connection.execute('DELETE FROM cache WHERE namespace = ? AND expires <= ?', (namespace, now))
+        connection.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache WHERE namespace = ? '
+                           'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (namespace, size))
+
+    def add(self, namespace, key, value, ttl):
+        now = time.time()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._cursor() as connection:
+            connection.execute('DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now))
+            cursor = connection.execute('INSERT OR IGNORE INTO cache (key, namespace, value, expires, accessed) '
+                                        'VALUES (?, ?, ?, ?, ?)', (key, namespace, data, now + ttl, now))
+            return cursor.rowcount == 1
+
+    def delete(self, namespace, key):
+        with self._cursor() as connection:
+            connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self, namespace=None):
+        with self._cursor() as connection:
+            if namespace is None:
+                connection.execute('DELETE FROM cache')
+            else:
+                connection.execute('DELETE FROM cache WHERE namespace = ?', (namespace,))
+
+    def size(self, namespace):
+        with self._cursor() as connection:
+            return connection.execute('SELECT count(*) FROM cache WHERE namespace = ?', (namespace,)).fetchone()[0]
+
+
+class RESPConnection(object):
+    """One connection speaking the Redis protocol (RESP)."""
+
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile('rb')
+
+    def execute(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self.sock.sendall(b''.join(parts))
+        return self.read_reply()
+
+    def read_reply(self):
+        line = self.file.readline()
+        if not line.endswith(b'\r\n'):
+            raise CacheError('Connection closed by the server.')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            raise CacheError(payload.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.file.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            return None if length < 0 else [self.read_reply() for i in range(length)]
+        raise CacheError('Unexpected reply %r.' % line)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class RedisBackend(object):
+    """Cache on a Redis server (or the ``flask cache-server`` stand-in).
+
+    Values are pickled and every entry gets a TTL; the size limit is left to the
+    server's ``maxmemory`` policy. Idle connections are kept in a small per-process pool.
+    """
+    shared = True
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, password=None, timeout=0.5, pool_size=8):
+        self.host, self.port, self.db, self.password = host, port, db, password
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.pool = []
+        self.pid = os.getpid()
+
+    def _acquire(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # fork 继承的连接属于父进程
+                self.pool, self.pid = [], os.getpid()
+            if self.pool:
+                return self.pool.pop()
+        connection = RESPConnection(self.host, self.port, self.timeout)
+        if self.password:
+            connection.execute('AUTH', self.password)
+        if self.db:
+            connection.execute('SELECT', self.db)
+        return connection
+
+    def _release(self, connection):
+        with self.lock:
+            if self.pid == os.getpid() and len(self.pool) < self.pool_size:
+                self.pool.append(connection)
+                return
+        connection.close()
+
+    def execute(self, *args):
+        try:
+            connection = self._acquire()
+        except OSError as e:
+            raise CacheError('%s:%d: %s' % (self.host, self.port, e))
+        try:
+            reply = connection.execute(*args)
+        except CacheError as e:
+            # 服务器返回的错误不影响连接本身
+            if str(e).startswith('Connection closed'):
+                connection.close()
+            else:
+                self._release(connection)
+            raise
+        except (OSError, ValueError) as e:
+            connection.close()
+            raise CacheError('%s:%d: %s' % (self.host, self.port, e))
+        self._release(connection)
+        return reply
+
+    def get(self, namespace, key):
+        data = self.execute('GET', key)
+        return None if data is None else pickle.loads(data)
+
+    def set(self, namespace, key, value, ttl):
+        self.execute('SET', key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 'PX', int(ttl * 1000))
+
+    def add(self, namespace, key, value, ttl):
+        return self.execute('SET', key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 'PX', int(ttl * 1000),
+                            'NX') is not None
+
+    def delete(self, namespace, key):
+        self.execute('DEL', key)
+
+    def clear(self, namespace=None):
+        # KEYS 会阻塞整个 Redis，共享实例上改用 SCAN 分批遍历，每批找到的键随即删除
+        pattern = '%s:*:%s:*' % (KEY_PREFIX, namespace) if namespace else '%s:*' % KEY_PREFIX
+        cursor = b'0'
+        while True:
+            cursor, keys = self.execute('SCAN', cursor, 'MATCH', pattern, 'COUNT', 500)
+            if keys:
+                self.execute('DEL', *keys)
+            if cursor == b'0':
+                return
+
+    def size(self, namespace):
+        return None
+
+
+def create_backend(url, limits=None, default_size=1000, timeout=0.5):
+    """The backend for a MYBLOG_CACHE_URL: ``memory://``, ``sqlite:///<path>`` or ``redis://[:password@]host[:port][/db]``."""
+    parts = urlsplit(url)
+    if parts.scheme == 'memory':
+        return MemoryBackend(limits, default_size)
+    if parts.scheme == 'sqlite':
+        # sqlite:///relative/path 和 sqlite:////absolute/path，与 SQLAlchemy 的写法相同
+        return SQLiteBackend(unquote(parts.path[1:]), limits, default_size, timeout)
+    if parts.scheme == 'redis':
+        db = int(parts.path.strip('/') or 0)
+        password = unquote(parts.password) if parts.password else None
+        return RedisBackend(parts.hostname or '127.0.0.1', parts.port or 6379, db, password, timeout)
+    raise ValueError('Unsupported MYBLOG_CACHE_URL: %s' % url)
+
+
+def deploy_fingerprint(app):
+    """Identifies the site and its deploy in the keys of a shared cache.
+
+    Changes when a template or static file changes, so pages rendered by an older deploy
+    are never served; different databases (e.g. staging next to production) get different
+    keys as well.
+    """
+    digest = hashlib.md5(app.config['SQLALCHEMY_DATABASE_URI'].encode('utf-8'))
+    for root in (os.path.join(app.root_path, app.template_folder), app.static_folder):
+        for directory, dirnames, filenames in sorted(os.walk(root)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                stat = os.stat(os.path.join(directory, filename))
+                digest.update(('%s/%s:%d:%d\n' % (directory, filename, stat.st_mtime_ns, stat.st_size)).encode('utf-8'))
+    return digest.hexdigest()[:8]
+
+
+class CacheClient(object):
+    """The cache of one app: namespaced keys, single-flight recomputation and statistics.
+
+    Namespaces listed in MYBLOG_CACHE_LOCAL_NAMESPACES always use an in-process LRU,
+    the others the backend of MYBLOG_CACHE_URL. A backend error counts as a miss and
+    the backend is skipped for MYBLOG_CACHE_RETRY_INTERVAL seconds, so an unreachable
+    cache server slows nothing down.
+    """
+
+    def __init__(self, app):
+        config = app.config
+        self.app = app
+        limits = {'pages': config['MYBLOG_PAGE_CACHE_SIZE'], 'fragments': config['MYBLOG_FRAGMENT_CACHE_SIZE']}
+        self.backend = create_backend(config['MYBLOG_CACHE_URL'], limits, config['MYBLOG_CACHE_SIZE'],
+                                      config['MYBLOG_CACHE_TIMEOUT'])
+        self.local = self.backend if not self.backend.shared else MemoryBackend(limits, config['MYBLOG_CACHE_SIZE'])
+        self.local_namespaces = set(config['MYBLOG_CACHE_LOCAL_NAMESPACES'])
+        self.default_ttl = config['MYBLOG_CACHE_DEFAULT_TTL']
+        self.lock_timeout = config['MYBLOG_CACHE_LOCK_TIMEOUT']
+        self.lock_wait = config['MYBLOG_CACHE_LOCK_WAIT']
+        self.retry_interval = config['MYBLOG_CACHE_RETRY_INTERVAL']
+        self.prefix = None
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.failed_at = None
+        self.counters = {}
+        self.pid = os.getpid()
+
+    def _backend(self, namespace):
+        return self.local if namespace in self.local_namespaces else self.backend
+
+    def _key(self, namespace, key):
+        if not isinstance(key, str):
+            key = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+        if self.prefix is None:
+            # 共享后端中的键带上部署指纹，更新模板或静态文件后旧页面自然失效
+            self.prefix = '%s:%s:' % (KEY_PREFIX, deploy_fingerprint(self.app)) if self.backend.shared else ''
+        return '%s%s:%s' % (self.prefix, namespace, key)
+
+    def _reset_after_fork(self):
+        # fork 出来的 worker 从零开始计数
+        if self.pid != os.getpid():
+            self.pid, self.counters, self.flights = os.getpid(), {}, {}
+
+    def count(self, namespace, result, value=1):
+        """Add to the ``result`` counter of ``namespace`` (hit, miss, wait, set, error, ...)."""
+        with self.lock:
+            self._reset_after_fork()
+            counters = self.counters.setdefault(namespace, {})
+            counters[result] = counters.get(result, 0) + value
+
+    def stats(self, namespace=None, sizes=False):
+        """Counters of this process by namespace (or of one namespace), optionally with the number of entries."""
+        with self.lock:
+            self._reset_after_fork()
+            stats = {name: dict(counters) for name, counters in self.counters.items()}
+        if sizes:
+            for name, counters in stats.items():
+                counters['size'] = self._call(self._backend(name), name, 'size', name)
+        return stats.get(namespace, {}) if namespace is not None else stats
+
+    def _call(self, backend, namespace, method, *args):
+        if backend.shared and self.failed_at is not None:
+            if time.monotonic() - self.failed_at < self.retry_interval:
+                self.count(namespace, 'error')
+                return None
+            self.failed_at = None
+        try:
+            return getattr(backend, method)(*args)
+        except CacheError as e:
+            self.failed_at = time.monotonic()
+            self.count(namespace, 'error')
+            self.app.logger.warning('Cache backend failed, retrying in %ds: %s', self.retry_interval, e)
+            return None
+
+    def get(self, namespace, key):
+        value = self._call(self._backend(namespace), namespace, 'get', namespace, self._key(namespace, key))
+        self.count(namespace, 'hit' if value is not None else 'miss')
+        return value
+
+    def set(self, namespace, key, value, ttl=None):
+        self.count(namespace, 'set')
+        self._call(self._backend(namespace), namespace, 'set', namespace, self._key(namespace, key), value,
+                   ttl or self.default_ttl)
+
+    def delete(self, namespace, key):
+        self._call(self._backend(namespace), namespace, 'delete', namespace, self._key(namespace, key))
+
+    def clear(self, namespace=None):
+        """Remove the entries of ``namespace`` (or everything) from the local and shared caches."""
+        self.local.clear(namespace)
+        if self.backend is not self.local:
+            self.backend.clear(namespace)
+
+    @contextmanager
+    def _flight(self, key):
+        # 同一进程内同一个键只有一个线程（或 greenlet）在重新计算，其余的等它完成
+        with self.lock:
+            self._reset_after_fork()
+            flight = self.flights.get(key)
+            if flight is None:
+                # 每次新建锁：gevent worker 中 threading.Lock 在 fork 之后才被替换
+                flight = self.flights[key] = [threading.Lock(), 0]
+            flight[1] += 1
+        try:
+            with flight[0]:
+                yield
+        finally:
+            with self.lock:
+                flight[1] -= 1
+                if not flight[1] and self.flights.get(key) is flight:
+                    del self.flights[key]
+
+    def _wait(self, backend, namespace, key, lease):
+        """Wait for the process holding ``lease`` to store ``key``; None if it gives up or takes too long."""
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+            value = self._call(backend, namespace, 'get', namespace, key)
+            if value is not None:
+                return value
+            if self._call(backend, namespace, 'get', '__lease__', lease) is None:
+                return None
+        return None
+
+    def get_or_set(self, namespace, key, compute, ttl=None):
+        """Return the cached value of ``key``, or store and return ``compute()``.
+
+        Concurrent misses on the same key are single-flight: in one process they wait
+        for the first caller, and with a shared backend the processes on other workers
+        wait for the holder of a lease (up to MYBLOG_CACHE_LOCK_WAIT seconds) instead of
+        all recomputing it. None is never cached.
+        """
+        backend = self._backend(namespace)
+        key = self._key(namespace, key)
+        value = self._call(backend, namespace, 'get', namespace, key)
+        if value is not None:
+            self.count(namespace, 'hit')
+            return value
+        with self._flight(key):
+            value = self._call(backend, namespace, 'get', namespace, key)
+            if value is not None:
+                self.count(namespace, 'wait')
+                return value
+            lease = key + ':lease'
+            leased = backend.shared and self._call(backend, namespace, 'add', '__lease__', lease, os.getpid(),
+                                                   self.lock_timeout)
+            if backend.shared and leased is False:
+                value = self._wait(backend, namespace, key, lease)
+                if value is not None:
+                    self.count(namespace, 'wait')
+                    return value
+            try:
+                self.count(namespace, 'miss')
+                value = compute()
+                if value is not None:
+                    self.count(namespace, 'set')
+                    self._call(backend, namespace, 'set', namespace, key, value, ttl or self.default_ttl)
+            finally:
+                if leased:
+                    self._call(backend, namespace, 'delete', '__lease__', lease)
+        return value
+
+
+class Cache(object):
+    """Flask extension giving each app a CacheClient in ``app.extensions['cache']``.
+
+    Attribute access is forwarded to the client of the current app, e.g.
+    ``cache.get_or_set('pages', key, render)``.
+    """
+
+    def init_app(self, app):
+        app.extensions['cache'] = CacheClient(app)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(current_app.extensions['cache'], name)
@@ -0,0 +1,85 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+from flask import current_app, url_for, make_response
+from markupsafe import escape
+
+from myblog.extensions import db
+from myblog.models import Post, Category
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def _lastmod(timestamp):
+    return '<lastmod>%sZ</lastmod>' % timestamp.replace(microsecond=0).isoformat() if timestamp else ''
+
+
+def _url(loc, timestamp=None):
+    return '<url><loc>%s</loc>%s</url>\n' % (escape(loc), _lastmod(timestamp))
+
+
+def _xml_response(chunks):
+    response = make_response(''.join(chunks))
+    response.mimetype = 'application/xml'
+    return response
+
+
+def post_shards():
+    """``(shard, lastmod)`` for each non-empty shard of posts.
+
+    Shard N holds the posts with ``N * size < id <= (N + 1) * size``, so a shard never
+    exceeds MYBLOG_SITEMAP_SHARD_SIZE URLs and is read with a range scan on the
+    primary key; a single GROUP BY gives the whole index.
+    """
+    size = current_app.config['MYBLOG_SITEMAP_SHARD_SIZE']
+    # 整除写成 (n - n % size) / size，各数据库的结果都是整数
+    offset = Post.id - 1
+    shard = (offset - offset % size) / size
+    rows = db.session.query(shard, db.func.max(Post.timestamp)).group_by(shard).order_by(shard).all()
+    return [(int(number), timestamp) for number, timestamp in rows]
+
+
+def render_index():
+    latest = db.session.query(db.func.max(Post.timestamp)).scalar()
+    chunks = [XML_HEADER, '<sitemapindex xmlns="%s">\n' % XMLNS]
+    chunks.append('<sitemap><loc>%s</loc>%s</sitemap>\n' % (
+        escape(url_for('blog.sitemap_pages', _external=True)), _lastmod(latest)))
+    for shard, timestamp in post_shards():
+        chunks.append('<sitemap><loc>%s</loc>%s</sitemap>\n' % (
+            escape(url_for('blog.sitemap_posts', shard=shard, _external=True)), _lastmod(timestamp)))
+    chunks.append('</sitemapindex>\n')
+    return _xml_response(chunks)
+
+
+def render_pages():
+    """Home, about and category pages; a category's lastmod is its newest post."""
+    latest = db.session.query(db.func.max(Post.timestamp)).scalar()
+    chunks = [XML_HEADER, '<urlset xmlns="%s">\n' % XMLNS,
+              _url(url_for('blog.index', _external=True), latest),
+              _url(url_for('blog.about', _external=True))]
+    newest = db.session.query(Category.id, db.func.max(Post.timestamp)) \
+        .outerjoin(Post, Post.category_id == Category.id).group_by(Category.id).order_by(Category.id)
+    for id, timestamp in newest:
+        chunks.append(_url(url_for('blog.show_category', category_id=id, _external=True), timestamp))
+    chunks.append('</urlset>\n')
+    return _xml_response(chunks)
+
+
+def render_posts(shard):
+    size = current_app.config['MYBLOG_SITEMAP_SHARD_SIZE']
+    # 只取 id 和时间戳，按主键分批读取，不加载正文
+    rows = db.session.query(Post.id, Post.timestamp) \
+        .filter(Post.id > shard * size, Post.id <= (shard + 1) * size).order_by(Post.id).yield_per(1000)
+    chunks = [XML_HEADER, '<urlset xmlns="%s">\n' % XMLNS]
+    empty = True
+    for id, timestamp in rows:
+        empty = False
+        chunks.append(_url(url_for('blog.show_post', post_id=id, _external=True), timestamp))
+    if empty and shard != 0:
+        return None
+    chunks.append('</urlset>\n')
+    return _xml_response(chunks)
@@ -0,0 +1,82 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import socketserver
+from email import message_from_bytes
+from threading import Thread
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('ascii'))
+
+    def handle(self):
+        self.reply('220 myblog smtp sink ready')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 myblog')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command[8:].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(chunk[1:] if chunk.startswith(b'..') else chunk)
+                self.server.receive(sender, recipients, message_from_bytes(b''.join(data)))
+                self.reply('250 OK: queued')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """A plain-SMTP server that keeps every received message in ``messages``.
+
+    A stand-in for the real mail server in development and tests: point MAIL_SERVER /
+    MAIL_PORT at it and set MAIL_USE_SSL=false.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=1025, echo=None):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _SMTPHandler)
+        self.messages = []
+        self.echo = echo
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def receive(self, sender, recipients, message):
+        self.messages.append((sender, recipients, message))
+        if self.echo is not None:
+            self.echo('From %s to %s: %s' % (sender, ', '.join(recipients), message['Subject']))
+
+    def start(self):
+        """Serve in a background thread and return self, for use in tests."""
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
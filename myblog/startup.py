@@ -0,0 +1,185 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from myblog.extensions import db
+from myblog.templating import compile_templates
+
+basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+
+# 在新的解释器中执行：导入入口模块（wsgi 在导入时创建应用），再处理第一个请求
+COLD_START_SCRIPT = '''
+import importlib, json, sys, time
+started = time.perf_counter()
+module, _, attribute = sys.argv[1].partition(':')
+app = getattr(importlib.import_module(module), attribute or 'app')
+imported = time.perf_counter()
+response = app.test_client().get(sys.argv[2])
+finished = time.perf_counter()
+print(json.dumps({'import': imported - started, 'request': finished - imported, 'status': response.status_code}))
+'''
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def _environ(config_name, lazy=None, database=None):
+    env = dict(os.environ, FLASK_CONFIG=config_name, PYTHONWARNINGS='ignore')
+    if lazy is not None:
+        env['MYBLOG_LAZY_EXTENSIONS'] = 'true' if lazy else 'false'
+    if database:
+        env['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(database)
+    return env
+
+
+class ImportNode(object):
+
+    def __init__(self, name, self_time, cumulative, depth):
+        self.name = name
+        self.package = name.split('.')[0]
+        self.self_time = self_time
+        self.cumulative = cumulative
+        self.depth = depth
+        self.children = []
+        self.parent = None
+
+
+def parse_import_times(output):
+    """Build the import tree from ``python -X importtime`` output; returns the root nodes.
+
+    Modules are listed after the modules they import, indented one level deeper than
+    their importer, so the children of a line are the deeper lines just before it.
+    """
+    pending = {}
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        self_time, cumulative, indent, name = match.groups()
+        node = ImportNode(name, int(self_time), int(cumulative), len(indent) // 2)
+        node.children = pending.pop(node.depth + 1, [])
+        for child in node.children:
+            child.parent = node
+        pending.setdefault(node.depth, []).append(node)
+    return pending.get(0, [])
+
+
+def _walk(nodes):
+    for node in nodes:
+        yield node
+        yield from _walk(node.children)
+
+
+def _importer(node):
+    """The myblog module (or entry point) whose import first pulled in ``node``."""
+    parent = node.parent
+    while parent is not None and parent.package != 'myblog' and parent.parent is not None:
+        parent = parent.parent
+    return parent.name if parent is not None else '-'
+
+
+def import_profile(target='wsgi:app', config_name='production', lazy=None):
+    """Import the module of ``target`` in a fresh interpreter and total the time per package.
+
+    Returns ``(total, packages)``, times in microseconds; each package is a dict with its
+    own import time (excluding the packages it imports), the number of modules and
+    the module of the app that first imported it, sorted by time.
+    """
+    module = target.partition(':')[0]
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                            cwd=basedir, env=_environ(config_name, lazy), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError('Importing %s failed:\n%s' % (module, result.stderr[-2000:]))
+    roots = parse_import_times(result.stderr)
+    packages = {}
+    for node in _walk(roots):
+        package = packages.get(node.package)
+        if package is None:
+            package = packages[node.package] = dict(name=node.package, time=0, modules=0, importer=_importer(node))
+        package['time'] += node.self_time
+        package['modules'] += 1
+    total = sum(root.cumulative for root in roots)
+    return total, sorted(packages.values(), key=lambda package: package['time'], reverse=True)
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def cold_start(target='wsgi:app', config_name='production', runs=10, path='/', lazy=None, database=None):
+    """Start ``target`` in ``runs`` fresh interpreters and time the phases of each cold start.
+
+    Every run imports the entry point (which creates the app) and serves ``path`` once.
+    A first, unmeasured run writes the ``.pyc`` files. Returns the median, minimum and
+    maximum of each phase in milliseconds, plus the status codes seen.
+    """
+    env = _environ(config_name, lazy, database)
+    samples = []
+    for run in range(runs + 1):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT, target, path],
+                                cwd=basedir, env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            raise RuntimeError('Starting %s failed:\n%s' % (target, result.stderr[-2000:]))
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        timings['process'] = elapsed
+        # 解释器启动和退出的时间
+        timings['interpreter'] = elapsed - timings['import'] - timings['request']
+        if run:
+            samples.append(timings)
+    summary = {'runs': runs, 'status': sorted({sample['status'] for sample in samples})}
+    for phase in ('interpreter', 'import', 'request', 'process'):
+        values = [sample[phase] * 1000 for sample in samples]
+        summary[phase] = {'median': _median(values), 'min': min(values), 'max': max(values)}
+    return summary
+
+
+def warm_up(app):
+    """Prepare an app preloaded in the gunicorn master before the workers are forked.
+
+    Every template is compiled and each of MYBLOG_WARMUP_PATHS is requested once, so
+    the workers share the compiled templates, the URL matcher and the page cache
+    copy-on-write instead of each building them on its first requests. The database
+    connections opened meanwhile are closed before forking. Returns the number of
+    templates and the status of each path.
+    """
+    templates = compile_templates(app)
+    client = app.test_client()
+    statuses = {}
+    for path in app.config['MYBLOG_WARMUP_PATHS']:
+        # 预热请求不计入 /metrics
+        statuses[path] = client.get(path, environ_base={'myblog.warmup': True}).status_code
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    return templates, statuses
+
+
+def after_fork(app):
+    """Give a worker its own connection pools (gunicorn's ``post_worker_init`` hook).
+
+    The pools of a preloaded app were created in the master, before the gevent worker
+    patched the threading module, so their locks would block the whole worker. Pools
+    created again in the worker use gevent's locks.
+
+    Also starts the worker's mail dispatcher, which sends what is left in the outbox.
+    """
+    from myblog.emails import get_dispatcher
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    if app.config['MYBLOG_MAIL_QUEUE_THREAD']:
+        # 不等下一封通知入队，重启前留在发件队列里的邮件也要发出去
+        get_dispatcher(app).start()
@@ -0,0 +1,93 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import tempfile
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    """Jinja's file bytecode cache, written atomically so that workers can share it.
+
+    A worker never reads a half-written file while another one is writing the same
+    template. Entries are keyed by template name and path and checked against the
+    source, so an edited template is compiled again.
+
+    The cached bytecode is executed as is, so like Jinja's default cache directory the
+    directory must belong to the current user and not be writable by anyone else.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if os.name != 'nt':
+            st = os.stat(directory)
+            if st.st_uid != os.getuid() or st.st_mode & 0o022:
+                raise RuntimeError('The template cache directory %s must be owned by the current user and '
+                                   'not writable by group or others.' % directory)
+        super(SharedBytecodeCache, self).__init__(directory, 'myblog-%s.cache')
+
+    def dump_bytecode(self, bucket):
+        path = self._get_cache_filename(bucket)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def init_template_cache(app):
+    """Use the bytecode cache in MYBLOG_TEMPLATE_CACHE_PATH; must run before ``app.jinja_env`` is used."""
+    path = app.config['MYBLOG_TEMPLATE_CACHE_PATH']
+    if path:
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=SharedBytecodeCache(path))
+
+
+def template_names(env):
+    # 模板目录里可能有 .DS_Store 之类的隐藏文件
+    return env.list_templates(filter_func=lambda name: not os.path.basename(name).startswith('.'))
+
+
+def compile_templates(app):
+    """Load every template of the app and its extensions into the environment's cache.
+
+    Returns the number of templates. Templates missing from the bytecode cache are
+    compiled and written to it.
+    """
+    env = app.jinja_env
+    names = template_names(env)
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def template_costs(app):
+    """Time compiling each template from source, and loading it from the bytecode cache.
+
+    Yields ``(name, compile_ms, cached_ms)``, with ``cached_ms`` None when there is no
+    bytecode cache. Compiled code missing from the cache is written to it.
+    """
+    env = app.jinja_env
+    cache = env.bytecode_cache
+    for name in sorted(template_names(env)):
+        source, filename, uptodate = env.loader.get_source(env, name)
+        started = time.perf_counter()
+        code = env.compile(source, name, filename)
+        compile_ms = (time.perf_counter() - started) * 1000
+        cached_ms = None
+        if cache is not None:
+            bucket = cache.get_bucket(env, name, filename, source)
+            if bucket.code is None:
+                bucket.code = code
+                cache.set_bucket(bucket)
+            started = time.perf_counter()
+            cache.get_bucket(env, name, filename, source)
+            cached_ms = (time.perf_counter() - started) * 1000
+        yield name, compile_ms, cached_ms
@@ -0,0 +1,39 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import pytest
+
+from myblog import create_app
+from myblog.extensions import db
+from myblog.fakes import forge
+from myblog.models import Admin
+
+
+@pytest.fixture
+def app():
+    """A TestingConfig app (MYBLOG_QUERY_AUDIT='raise') on an in-memory database with fake data."""
+    app = create_app('testing')
+    # 关闭整页缓存，测量的是视图本身的查询
+    app.config['MYBLOG_PAGE_CACHE_SIZE'] = 0
+    with app.app_context():
+        forge(category=3, post=12, comment=60, seed=1, echo=lambda message: None)
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(Admin.query.first().id)
+        session['_fresh'] = True
+    return client
@@ -0,0 +1,94 @@
+"""
+    :author: CheungJan (CJ)
+    :url: http://cheungjan.com
+    :copyright: ©2025 Cheung Jan <CheungJan@live.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import pytest
+from flask import url_for
+
+from myblog.extensions import db
+from myblog.models import Category, Comment, Post, rebuild_counters
+from myblog.querycount import count_queries
+from myblog.search import reindex
+
+
+def _busiest_post():
+    return Post.query.order_by(Post.comment_count.desc()).first()
+
+
+def _url(endpoint):
+    if endpoint == 'blog.show_category':
+        return url_for(endpoint, category_id=Category.query.order_by(Category.post_count.desc()).first().id)
+    if endpoint == 'blog.show_post':
+        return url_for(endpoint, post_id=_busiest_post().id)
+    return url_for(endpoint)
+
+
+def _check_budget(app, client, endpoint):
+    with app.test_request_context():
+        url = _url(endpoint)
+    # 第一次请求填充站点上下文和缓存版本号，测量第二次
+    assert client.get(url).status_code == 200
+    with count_queries() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    budget = app.config['MYBLOG_QUERY_BUDGETS'][endpoint]
+    assert len(statements) <= budget, '%s ran %d queries, budget %d:\n%s' % (
+        url, len(statements), budget, '\n'.join(statements))
+
+
+@pytest.mark.parametrize('endpoint', ['blog.index', 'blog.about', 'blog.show_category', 'blog.show_post'])
+def test_blog_view_budget(app, client, endpoint):
+    _check_budget(app, client, endpoint)
+
+
+@pytest.mark.parametrize('endpoint', ['admin.manage_post', 'admin.manage_comment', 'admin.manage_category',
+                                      'admin.manage_link'])
+def test_admin_view_budget(app, admin_client, endpoint):
+    _check_budget(app, admin_client, endpoint)
+
+
+def _reply_chain(post, length):
+    """A reviewed comment on ``post`` and a chain of replies to it, spread over other posts."""
+    others = Post.query.filter(Post.id != post.id).order_by(Post.id).limit(length).all()
+    root = Comment(post=post, author='a', email='a@example.com', body='root', reviewed=True)
+    db.session.add(root)
+    replied = root
+    for other in others:
+        replied = Comment(post=other, author='a', email='a@example.com', body='reply', reviewed=True,
+                          replied=replied)
+        db.session.add(replied)
+    db.session.commit()
+    rebuild_counters()
+    reindex()
+    return root.id, [other.id for other in others]
+
+
+def _comment_counts_are_exact():
+    return all(post.comment_count == Comment.query.filter_by(post_id=post.id, reviewed=True).count()
+               for post in Post.query.all())
+
+
+def test_delete_comment_with_replies(admin_client):
+    root_id, other_ids = _reply_chain(_busiest_post(), 5)
+    response = admin_client.post('/admin/comment/%d/delete?next=/' % root_id)
+    assert response.status_code == 302
+    db.session.expire_all()
+    assert db.session.get(Comment, root_id) is None
+    assert _comment_counts_are_exact()
+
+
+def test_delete_post_with_comments(admin_client):
+    post = _busiest_post()
+    post_id = post.id
+    _reply_chain(post, 3)
+    response = admin_client.post('/admin/post/%d/delete?next=/' % post_id)
+    assert response.status_code == 302
+    db.session.expire_all()
+    assert db.session.get(Post, post_id) is None
+    assert Comment.query.filter_by(post_id=post_id).count() == 0
+    assert _comment_counts_are_exact()
+    orphans = db.session.execute(db.text(
+        "SELECT count(*) FROM search_index WHERE kind = 'comment' AND ref_id NOT IN (SELECT id FROM comment)"))
+    assert orphans.scalar() == 0